@@ -2,7 +2,8 @@ import sys
 from sqlalchemy import Column, ForeignKey, Integer, String, Date, Numeric
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import create_engine
+
+from sqlitedb import createEngine
 Base = declarative_base()
 
 
@@ -33,5 +34,7 @@ class Puppy (Base):
 
 
 ########## Insert at end of file ##############
-engine= create_engine('sqlite:///puppyshelter.db')
+# The scripts are single-threaded, so the writer engine of sqlitedb is all
+# they need: one connection in WAL mode, see vagrant/sqlitedb/sqlitedb.py.
+engine = createEngine('puppyshelter.db')
 Base.metadata.create_all(engine)
@@ -1,7 +1,8 @@
 apt-get -qqy update
-apt-get -qqy install postgresql python-psycopg2
+apt-get -qqy install postgresql python-psycopg2 python-numpy
 apt-get -qqy install python-flask python-sqlalchemy
 apt-get -qqy install python-pip
+pip install -e /vagrant/sqlitedb
 pip install bleach
 pip install oauth2client
 pip install requests
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+# cache.py -- in-process response cache shared by the restaurant servers
+#
+# Rendered pages are kept under a key made of the route and its parameters,
+# together with tags naming the rows they were rendered from, such as
+# ('restaurant', 3). Handlers that write call invalidate() with the tags of
+# the rows they changed, so exactly the pages showing those rows are
+# dropped. The cache holds at most a given number of entries and bytes and
+# evicts the least recently used ones first.
+#
+# Every entry has an ETag computed from its body, so clients sending
+# If-None-Match can be answered with a 304 and no body.
+#
+# FragmentCache keeps pieces of pages instead, such as the markup of one
+# menu item, under keys naming the version of the row they show. A write
+# changes the version, so fragments are never invalidated: the old ones are
+# no longer asked for, and evicted.
+#
+# The cache lives in one process: writes made by another process (the
+# BaseHTTPServer webserver.py and the Flask project.py each have their own)
+# are only seen once the entry expires, see the ttl argument.
+
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+MAX_BYTES = 32 * 1024 * 1024
+MAX_ENTRIES = 1024
+MAX_FRAGMENTS = 100000
+
+
+class Entry(object):
+    """A cached response.
+
+    Attributes:
+      body: the response body, a byte string.
+      contentType: the value of its Content-Type header.
+      etag: the quoted ETag of the body.
+      tags: the tags it was stored with.
+      expires: the time.time() after which it is stale, or None.
+    """
+    __slots__ = ('body', 'contentType', 'etag', 'tags', 'expires')
+
+    def __init__(self, body, contentType, tags, expires):
+        self.body = body
+        self.contentType = contentType
+        self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+        self.tags = tags
+        self.expires = expires
+
+    def matches(self, ifNoneMatch):
+        """Returns whether an If-None-Match header value names this entry."""
+        if not ifNoneMatch:
+            return False
+        if ifNoneMatch.strip() == '*':
+            return True
+        for etag in ifNoneMatch.split(','):
+            etag = etag.strip()
+            if etag.startswith('W/'):
+                etag = etag[2:]
+            if etag == self.etag:
+                return True
+        return False
+
+
+class ResponseCache(object):
+    """An LRU cache of rendered responses, invalidated by tag.
+
+    Safe to use from several threads.
+    """
+
+    def __init__(self, maxBytes=MAX_BYTES, maxEntries=MAX_ENTRIES, ttl=None):
+        """Creates an empty cache.
+
+        Args:
+          maxBytes: the total size of the bodies kept. A body larger than a
+            quarter of this is never stored.
+          maxEntries: the number of entries kept.
+          ttl: seconds after which an entry is dropped even if no write
+            invalidated it, or None to keep it until then.
+        """
+        self.maxBytes = maxBytes
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        # Incremented on every invalidate(); tag -> its value the last time
+        # the tag was invalidated. When that map grows past maxEntries it is
+        # emptied and floor set, so put() refuses every older token instead.
+        self.version = 0
+        self.invalidated = {}
+        self.floor = 0
+        self.counters = dict.fromkeys(
+            ('hits', 'misses', 'stores', 'evictions', 'invalidations',
+             'notModified'), 0)
+        self.lock = threading.Lock()
+
+    def begin(self):
+        """Returns the token to pass to put() for a response about to be
+        rendered.
+
+        Call it before reading the database: put() then refuses a body a
+        concurrent write may have made stale.
+        """
+        with self.lock:
+            return self.version
+
+    def get(self, key, ifNoneMatch=None):
+        """Looks up a response.
+
+        Args:
+          key: the key it was stored under.
+          ifNoneMatch: the request's If-None-Match header, if any, only used
+            to count the 304s it allows.
+
+        Returns:
+          The Entry, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires is not None \
+                    and entry.expires < time.time():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            # Most recently used entries are at the end.
+            del self.entries[key]
+            self.entries[key] = entry
+            self.counters['hits'] += 1
+            if entry.matches(ifNoneMatch):
+                self.counters['notModified'] += 1
+            return entry
+
+    def put(self, key, body, contentType, tags, token):
+        """Stores a response.
+
+        Args:
+          key: a hashable identifying the route and its parameters.
+          body: the response body; unicode is stored UTF-8 encoded.
+          contentType: the value of its Content-Type header.
+          tags: hashables naming the rows the body was rendered from.
+          token: what begin() returned before the rows were read.
+
+        Returns:
+          The new Entry, or None if the body is too large or one of the tags
+          was invalidated since token.
+        """
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        if len(body) > self.maxBytes // 4:
+            return None
+        tags = tuple(tags)
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        entry = Entry(body, contentType, tags, expires)
+        with self.lock:
+            if token < self.floor:
+                return None
+            for tag in tags:
+                if self.invalidated.get(tag, -1) >= token:
+                    return None
+            if key in self.entries:
+                self._drop(key)
+            self.entries[key] = entry
+            self.size += len(body)
+            self.counters['stores'] += 1
+            while len(self.entries) > self.maxEntries \
+                    or self.size > self.maxBytes:
+                self._drop(next(iter(self.entries)))
+                self.counters['evictions'] += 1
+        return entry
+
+    def invalidate(self, *tags):
+        """Drops every entry stored with one of tags.
+
+        Call it after the write is committed.
+        """
+        tags = set(tags)
+        with self.lock:
+            if len(self.invalidated) > self.maxEntries:
+                self.invalidated.clear()
+                self.floor = self.version
+            for tag in tags:
+                self.invalidated[tag] = self.version
+            self.version += 1
+            stale = [key for key, entry in self.entries.items()
+                     if tags.intersection(entry.tags)]
+            for key in stale:
+                self._drop(key)
+            self.counters['invalidations'] += len(stale)
+
+    def clear(self):
+        """Drops every entry and resets the counters."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def stats(self):
+        """Returns the counters, the size of the cache and its hit rate."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.size
+            lookups = stats['hits'] + stats['misses']
+            stats['hitRate'] = float(stats['hits']) / lookups if lookups \
+                else 0.0
+            return stats
+
+    def _drop(self, key):
+        entry = self.entries.pop(key)
+        self.size -= len(entry.body)
+
+
+class FragmentCache(object):
+    """A cache of rendered pieces of pages, by (id, version) key.
+
+    Fragments are kept in two generations of at most maxEntries / 2 each:
+    a fragment found in the old one moves to the new one, and when the new
+    one is full it becomes the old one, the fragments left in the old one
+    being dropped. That keeps the recently used ones as an LRU would, with
+    plain dict operations per lookup. Looked up and filled a page at a
+    time, so rendering a page takes the lock twice however many fragments
+    it has. Safe to use from several threads.
+    """
+
+    def __init__(self, maxEntries=MAX_FRAGMENTS):
+        self.maxEntries = maxEntries
+        self.new = {}
+        self.old = {}
+        self.counters = dict.fromkeys(
+            ('hits', 'misses', 'stores', 'evictions'), 0)
+        self.lock = threading.Lock()
+
+    def getMany(self, keys):
+        """Returns the fragments stored under keys, None for those that are
+        not, in the order of keys."""
+        with self.lock:
+            new = self.new
+            found = [new.get(key) for key in keys]
+            misses = 0
+            for n, fragment in enumerate(found):
+                if fragment is None:
+                    fragment = self.old.pop(keys[n], None)
+                    if fragment is None:
+                        misses += 1
+                    else:
+                        found[n] = fragment
+                        self._store(keys[n], fragment)
+            self.counters['hits'] += len(found) - misses
+            self.counters['misses'] += misses
+        return found
+
+    def putMany(self, fragments):
+        """Stores fragments, a dict of key -> fragment."""
+        with self.lock:
+            for key, fragment in fragments.items():
+                self._store(key, fragment)
+            self.counters['stores'] += len(fragments)
+
+    def clear(self):
+        """Drops every fragment and resets the counters."""
+        with self.lock:
+            self.new = {}
+            self.old = {}
+            for name in self.counters:
+                self.counters[name] = 0
+
+    def stats(self):
+        """Returns the counters, the number of fragments and the hit rate."""
+        with self.lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.new) + len(self.old)
+            lookups = stats['hits'] + stats['misses']
+            stats['hitRate'] = float(stats['hits']) / lookups if lookups \
+                else 0.0
+            return stats
+
+    def _store(self, key, fragment):
+        if len(self.new) >= self.maxEntries // 2:
+            self.counters['evictions'] += len(self.old)
+            self.old = self.new
+            self.new = {}
+        self.new[key] = fragment
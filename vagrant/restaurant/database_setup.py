@@ -1,13 +1,59 @@
 import os
+import sqlite3
 import sys
-from sqlalchemy import Column, ForeignKey, Integer, String
+import time
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, cast, func, inspect, literal
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import relationship
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import backref, relationship
 from sqlalchemy import create_engine
 
 Base = declarative_base()
 
 
+def parsePrice(value):
+    """Returns a price like "$7.50", "7.5" or "$.99" in integer cents.
+
+    None and "" are None.
+
+    Raises:
+      ValueError: if value is not an amount of whole cents.
+    """
+    if value is None:
+        return None
+    if not hasattr(value, 'strip'):
+        value = str(value)
+    amount = value.strip().lstrip('$').replace(',', '')
+    if not amount:
+        return None
+    try:
+        cents = Decimal(amount) * 100
+    except InvalidOperation:
+        raise ValueError("Invalid price %r" % (value,))
+    if not cents.is_finite() or cents != cents.to_integral_value() \
+            or cents < 0:
+        raise ValueError("Invalid price %r" % (value,))
+    return int(cents)
+
+
+def formatPrice(cents):
+    """Returns integer cents as shown on menus, like "$7.50"."""
+    if cents is None:
+        return None
+    return "$%d.%02d" % divmod(cents, 100)
+
+
+def newVersion(previous):
+    """Returns the version of a menu item written now: the time in
+    microseconds, and always more than its previous version.
+
+    Unlike a counter from 1, it is not given again to a new item that
+    gets the id of a deleted one.
+    """
+    return max(int(time.time() * 1000000), (previous or 0) + 1)
+
+
 class Restaurant(Base):
     __tablename__ = 'restaurant'
 
@@ -17,14 +63,53 @@ class Restaurant(Base):
 
 class MenuItem(Base):
     __tablename__ = 'menu_item'
+    # A restaurant's menu in id order, whole or from a keyset cursor, and
+    # filtered by course. SQLite appends the id to every index, so the
+    # second one also serves a course filter in id order. The last two
+    # cover the price aggregates per restaurant and per course.
+    __table_args__ = (
+        Index('menu_item_restaurant_id', 'restaurant_id', 'id'),
+        Index('menu_item_restaurant_course', 'restaurant_id', 'course'),
+        Index('menu_item_restaurant_price', 'restaurant_id', 'price_cents'),
+        Index('menu_item_course_price', 'course', 'price_cents'),
+    )
 
     name = Column(String(80), nullable=False)
     id = Column(Integer, primary_key=True)
     description = Column(String(250))
-    price = Column(String(8))
+    price_cents = Column(Integer)
     course = Column(String(250))
     restaurant_id = Column(Integer, ForeignKey('restaurant.id'))
-    restaurant = relationship(Restaurant)
+    # Changed by the ORM on every UPDATE, which also fails with
+    # StaleDataError if the row was changed since it was read. Pages cache
+    # the markup of an item by (id, version); see project.py. Rows inserted
+    # without the ORM start at 0.
+    version = Column(Integer, nullable=False, default=0)
+    __mapper_args__ = {'version_id_col': version,
+                       'version_id_generator': newVersion}
+    # Restaurant.items is the menu, in id order. See repository.py for
+    # loading it along with the restaurant. Deleting a restaurant leaves its
+    # items as they are, as it did before the backref, rather than setting
+    # their restaurant_id to NULL.
+    restaurant = relationship(Restaurant, backref=backref(
+        'items', order_by=id, passive_deletes='all'))
+
+    # The price as shown, "$7.50"; it can be set from any text parsePrice()
+    # reads. In queries, the same text computed by SQLite, without printf(),
+    # which SQLite before 3.8.3 lacks; NULL stays NULL.
+    @hybrid_property
+    def price(self):
+        return formatPrice(self.price_cents)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = parsePrice(value)
+
+    @price.expression
+    def price(cls):
+        cents = cast(cls.price_cents % 100, String)
+        return literal('$') + cast(cls.price_cents / 100, String) + '.' + \
+            func.substr('0' + cents, -2)
 
     @property
     def serialize(self):
@@ -39,7 +124,102 @@ class MenuItem(Base):
 
 
 
+# The first SQLite that can drop a column.
+DROP_COLUMN_VERSION = (3, 35)
+
+
+def migratePrices(engine):
+    """Moves the prices of a database made when menu_item.price was text,
+    like "$7.50", to integer cents in menu_item.price_cents.
+
+    Every text price is converted and cleared, and the old column dropped,
+    all in one transaction. SQLite older than DROP_COLUMN_VERSION cannot
+    drop it and leaves it empty, so later calls find nothing to convert
+    and return without taking the write lock. Does nothing if there is no
+    text price column.
+
+    Returns:
+      The ids of the items whose price could not be read, now NULL.
+    """
+    columns = [column['name'] for column in inspect(engine).get_columns('menu_item')]
+    if 'price' not in columns:
+        return []
+    if 'price_cents' in columns and \
+            sqlite3.sqlite_version_info < DROP_COLUMN_VERSION and \
+            engine.execute("SELECT 1 FROM menu_item WHERE price IS NOT NULL LIMIT 1").first() is None:
+        return []
+    conn = engine.raw_connection()
+    isolationLevel = conn.connection.isolation_level
+    try:
+        # Autocommit mode, so pysqlite does not commit by itself before the
+        # ALTER TABLE statements.
+        conn.connection.isolation_level = None
+        cursor = conn.cursor()
+        # If this fails there is no transaction to roll back.
+        cursor.execute("BEGIN IMMEDIATE")
+        committed = False
+        try:
+            if 'price_cents' not in columns:
+                cursor.execute("ALTER TABLE menu_item ADD COLUMN price_cents INTEGER")
+            # Items with a price in cents already keep it.
+            cursor.execute("SELECT id, price FROM menu_item "
+                           "WHERE price IS NOT NULL AND price_cents IS NULL")
+            updates = []
+            unreadable = []
+            for id, price in cursor.fetchall():
+                try:
+                    updates.append((parsePrice(price), id))
+                except ValueError:
+                    unreadable.append(id)
+            cursor.executemany("UPDATE menu_item SET price_cents = ? WHERE id = ?", updates)
+            cursor.execute("UPDATE menu_item SET price = NULL WHERE price IS NOT NULL")
+            if sqlite3.sqlite_version_info >= DROP_COLUMN_VERSION:
+                cursor.execute("ALTER TABLE menu_item DROP COLUMN price")
+            cursor.execute("COMMIT")
+            committed = True
+        finally:
+            if not committed:
+                # SQLite may have rolled back already; the error raised is
+                # the one that got here.
+                try:
+                    cursor.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+    finally:
+        conn.connection.isolation_level = isolationLevel
+        conn.close()
+    return unreadable
+
+
+def migrateVersions(engine):
+    """Adds menu_item.version to a database made before it, with every item
+    at version 0."""
+    columns = [column['name'] for column in inspect(engine).get_columns('menu_item')]
+    if 'version' not in columns:
+        engine.execute("ALTER TABLE menu_item ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def migrate(engine):
+    """Brings a database up to date with the models: creates what is
+    missing and moves the data of older columns, see migratePrices() and
+    migrateVersions(). Does nothing to a database that is up to date.
+
+    Run by seed.py before it loads and by the servers as they start;
+    importing this module never touches a database.
+    """
+    Base.metadata.create_all(engine)
+    migratePrices(engine)
+    migrateVersions(engine)
+    # create_all() skips tables that exist, and so indexes declared after
+    # the database was made.
+    existing = set(index['name'] for index in inspect(engine).get_indexes('menu_item'))
+    for index in MenuItem.__table__.indexes:
+        if index.name not in existing:
+            index.create(engine)
+
+
 engine = create_engine('sqlite:///restaurantmenu.db')
 
 
-Base.metadata.create_all(engine)
\ No newline at end of file
+if __name__ == '__main__':
+    migrate(engine)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# loadtest.py -- measures throughput and latency of the restaurant server
+#
+# Usage: python loadtest.py [--url URL] [--clients 1 8 64] [--duration 10]
+#
+# Every client is a thread sending GET requests one after the other for the
+# given number of seconds; requests/sec and latency percentiles are printed
+# for every level of concurrency.
+
+import argparse
+import threading
+import time
+
+try:
+    from urllib2 import urlopen
+except ImportError:
+    from urllib.request import urlopen
+
+
+def percentile(samples, p):
+    """Returns the p-th percentile of a sorted list."""
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+def run(url, clients, duration):
+    """Runs clients threads against url for duration seconds.
+
+    Returns (sorted latencies in seconds, errors, elapsed seconds).
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def client():
+        mine = []
+        failed = 0
+        while time.time() < deadline:
+            start = time.time()
+            try:
+                response = urlopen(url, timeout=30)
+                response.read()
+                response.close()
+            except Exception:
+                failed += 1
+                continue
+            mine.append(time.time() - start)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), errors[0], time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test for the restaurant web server")
+    parser.add_argument('--url', default='http://localhost:8080/restaurants')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="seconds to run each level of concurrency")
+    args = parser.parse_args()
+
+    print("%8s %10s %12s %10s %10s %8s" % ("clients", "requests", "req/sec",
+                                           "p50 (ms)", "p99 (ms)", "errors"))
+    for clients in args.clients:
+        latencies, errors, elapsed = run(args.url, clients, args.duration)
+        print("%8d %10d %12.1f %10.1f %10.1f %8d" % (
+            clients, len(latencies), len(latencies) / elapsed,
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000, errors))
+
+
+if __name__ == '__main__':
+    main()
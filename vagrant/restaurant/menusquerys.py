@@ -1,22 +1,19 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from database_setup import Restaurant, Base, MenuItem, migrate
+from sqlitedb import Database
  
-from database_setup import Restaurant, Base, MenuItem
- 
-engine = create_engine('sqlite:///restaurantmenu.db')
+database = Database('restaurantmenu.db')
+migrate(database.writer)
 # Bind the engine to the metadata of the Base class so that the
 # declaratives can be accessed through a DBSession instance
-Base.metadata.bind = engine
+Base.metadata.bind = database.writer
  
-DBSession = sessionmaker(bind=engine)
-# A DBSession() instance establishes all conversations with the database
-# and represents a "staging zone" for all the objects loaded into the
-# database session object. Any change made against the objects in the
-# session won't be persisted into the database until you call
+# The session of this thread; it reads and writes through separate
+# connection pools, see sqlitedb.py. Any change made against the objects in
+# the session won't be persisted into the database until you call
 # session.commit(). If you're not happy about the changes, you can
 # revert all of them back to the last commit by calling
 # session.rollback()
-session = DBSession()
+session = database.session
 
 restaurants = session.query(MenuItem).all()
 for item in restaurants:
@@ -1,34 +1,330 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from database_setup import Base, Restaurant, MenuItem
+from flask import Flask, Markup, Response, abort, get_template_attribute, render_template, request, redirect, url_for, flash, jsonify, stream_with_context
+from flask import session as browserSession
+from jinja2 import FileSystemBytecodeCache
+from database_setup import Base, Restaurant, MenuItem, formatPrice, migrate, parsePrice
+from cache import FragmentCache, ResponseCache
+from menujson import iterMenuJSON
+from repository import MENU_COLUMNS, getMenu, getMenuItem, iterMenuRows, priceHistogram, priceStats
+import search
+from sqlitedb import Database
 
 app = Flask(__name__)
+# Templates are compiled once, not again by every process that starts; the
+# compiled code is kept in a directory of the system's temporary files.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
 
-engine = create_engine('sqlite:///restaurantmenu.db')
+# Rendered menus, tagged ('restaurant', id) and ('item', id) and dropped by
+# the handlers below that change them. Restaurants renamed or deleted through
+# webserver.py are another process, so entries also expire after a while.
+CACHE_TTL = 30
+cache = ResponseCache(ttl=CACHE_TTL)
+
+# The markup of menu items by (id, version), shared by the menus showing
+# them; an edited item has a new version. See menuItemsMarkup().
+fragments = FragmentCache()
+
+# Every request thread gets its own session, reading and writing through
+# separate connection pools; see sqlitedb.py.
+database = Database('restaurantmenu.db')
+engine = database.writer
+migrate(engine)
 Base.metadata.bind = engine
+session = database.session
+
+# Restaurants and menu items by name and description, kept up to date by
+# the handlers that write them.
+searchIndex = search.openIndex(engine, database.reader)
+
+# Search results shown at most.
+MAX_SEARCH_RESULTS = 100
+
+def cachedResponse(key, tags, contentType, render):
+    """Returns the cached page for key, rendering and caching it if needed.
+
+    Args:
+      key: the route and its parameters.
+      tags: the tags of the rows the page shows.
+      contentType: its Content-Type.
+      render: a function returning the body of the page, or an iterator of
+        byte strings to stream it in pieces.
+
+    Returns:
+      The page with its ETag, or a 304 if the client's If-None-Match names
+      it. A streamed page is only cached, and given an ETag, once it has
+      been sent.
+    """
+    ifNoneMatch = request.headers.get('If-None-Match')
+    entry = cache.get(key, ifNoneMatch)
+    if entry is None:
+        token = cache.begin()
+        body = render()
+        if not isinstance(body, (bytes, type(u''))):
+            return Response(stream_with_context(
+                streamAndCache(key, tags, contentType, body, token)),
+                content_type=contentType)
+        entry = cache.put(key, body, contentType, tags, token)
+        if entry is None:
+            return Response(body, content_type=contentType)
+    headers = {'ETag': entry.etag, 'Cache-Control': 'no-cache'}
+    if entry.matches(ifNoneMatch):
+        return Response(status=304, headers=headers)
+    return Response(entry.body, content_type=entry.contentType,
+                    headers=headers)
+
+def streamAndCache(key, tags, contentType, chunks, token):
+    """Yields chunks, then caches them joined unless they were too large."""
+    captured = []
+    remaining = cache.maxBytes // 4
+    for chunk in chunks:
+        if captured is not None:
+            captured.append(chunk)
+            remaining -= len(chunk)
+            if remaining < 0:
+                captured = None
+        yield chunk
+    if captured is not None:
+        cache.put(key, b''.join(captured), contentType, tags, token)
 
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# Items per page of the menu JSON at most, whatever ?limit= asks for.
+MAX_PAGE_SIZE = 1000
+
+def jsonFields():
+    """Returns the item fields ?fields=name,price selects, all by default,
+    in the order of MENU_COLUMNS. Answers 400 to unknown fields."""
+    if 'fields' not in request.args:
+        return tuple(MENU_COLUMNS)
+    requested = request.args['fields'].split(',')
+    unknown = set(requested) - set(MENU_COLUMNS)
+    if unknown:
+        abort(400, "Unknown fields: %s" % ", ".join(sorted(unknown)))
+    return tuple(field for field in MENU_COLUMNS if field in requested)
+
+def menuFilters():
+    """Returns the iterMenuRows() arguments for the page and filters the
+    request asks for, answering 400 to invalid ones.
+
+    ?after=ID&limit=N is a page of N items after item ID, ?course=Entree
+    filters by course and ?min_price=5&max_price=10 by price.
+    """
+    args = request.args
+    filters = {}
+    try:
+        if 'after' in args:
+            filters['after'] = int(args['after'])
+        if 'limit' in args:
+            filters['limit'] = min(int(args['limit']), MAX_PAGE_SIZE)
+            if filters['limit'] < 1:
+                raise ValueError("limit should be positive")
+        if 'min_price' in args:
+            filters['minPrice'] = parsePrice(args['min_price'])
+        if 'max_price' in args:
+            filters['maxPrice'] = parsePrice(args['max_price'])
+    except ValueError as e:
+        abort(400, str(e))
+    if 'course' in args:
+        filters['course'] = args['course']
+    return filters
+
+def menuArgs(fields, filters):
+    """Returns the query arguments jsonFields() and menuFilters() read as
+    fields and filters, and no other argument of the request."""
+    args = {}
+    if fields != tuple(MENU_COLUMNS):
+        args['fields'] = ','.join(fields)
+    for name in ('after', 'limit', 'course'):
+        if name in filters:
+            args[name] = filters[name]
+    if 'minPrice' in filters:
+        args['min_price'] = formatPrice(filters['minPrice'])
+    if 'maxPrice' in filters:
+        args['max_price'] = formatPrice(filters['maxPrice'])
+    return args
+
+def firstPage(rows, limit, idColumn, cursor):
+    """Yields the first limit rows, setting cursor['after'] to the id of
+    the last of them if rows has more."""
+    for n, row in enumerate(rows):
+        if n == limit:
+            cursor['after'] = previous[idColumn]
+            return
+        previous = row
+        yield row
 
 #Making an API Endpoint (GET Request)
 @app.route('/restaurants/<int:restaurant_id>/menu/JSON')
 def restaurantMenuJSON(restaurant_id):
-    restaurant = session.query(Restaurant).filter_by(id=restaurant_id).one()
-    items = session.query(MenuItem).filter_by(restaurant_id=restaurant.id).all()
-    return jsonify(MenuItems=[i.serialize for i in items])
+    fields = jsonFields()
+    filters = menuFilters()
+    def render():
+        # Column tuples encoded in batches rather than a MenuItem object
+        # and serialize dict per item, see menujson.py.
+        limit = filters.get('limit')
+        if limit is None:
+            rows = iterMenuRows(session, restaurant_id, fields, **filters)
+            return iterMenuJSON(rows, fields=fields)
+        # One row more than the page tells whether there is a next one.
+        rows = iterMenuRows(session, restaurant_id, fields,
+                            **dict(filters, limit=limit + 1))
+        idColumn = fields.index('id') if 'id' in fields else len(fields)
+        cursor = {}
+        def more():
+            if not cursor:
+                return None
+            # Only what the page is cached by: other arguments of the
+            # request that rendered it would end up in every request's page.
+            args = menuArgs(fields, filters)
+            args['after'] = cursor['after']
+            return {'next': url_for('restaurantMenuJSON',
+                                    restaurant_id=restaurant_id, **args)}
+        return iterMenuJSON(firstPage(rows, limit, idColumn, cursor),
+                            fields=fields, more=more)
+    return cachedResponse(('menuJSON', restaurant_id, fields,
+                           tuple(sorted(filters.items()))),
+                          [('restaurant', restaurant_id)],
+                          'application/json', render)
 
 @app.route('/restaurants/<int:restaurant_id>/menu/<int:menu_id>/JSON')
 def menuItemJSON(restaurant_id,menu_id):
-    itemedited = session.query(MenuItem).filter_by(id=menu_id).one()
-    return jsonify(MenuItems=[itemedited.serialize])
+    fields = jsonFields()
+    def render():
+        item = getMenuItem(session, menu_id).serialize
+        return jsonify(MenuItems=[dict((field, item[field]) for field in fields)]).get_data()
+    return cachedResponse(('itemJSON', menu_id, fields), [('item', menu_id)],
+                          'application/json', render)
+
+# Width of the price ranges of the histograms when ?bucket= is not given.
+HISTOGRAM_BUCKET = '$5.00'
+
+def priceJSON(stats, name=None):
+    """Returns priceStats() rows as dicts, with the group under name if
+    given."""
+    rows = []
+    for group, count, low, high, avg in stats:
+        row = {'count': count, 'min': formatPrice(low),
+               'max': formatPrice(high), 'avg': formatPrice(int(round(avg)))}
+        if name is not None:
+            row[name] = group
+        rows.append(row)
+    return rows
+
+def histogramJSON(**filters):
+    """Returns the priceHistogram() of the ?bucket= ranges as dicts,
+    answering 400 to an invalid width."""
+    try:
+        width = parsePrice(request.args.get('bucket', HISTOGRAM_BUCKET))
+    except ValueError as e:
+        abort(400, str(e))
+    if not width:
+        abort(400, "bucket should be positive")
+    return [{'from': formatPrice(low), 'to': formatPrice(high), 'count': count}
+            for low, high, count in priceHistogram(session, width, **filters)]
+
+@app.route('/restaurants/prices/JSON')
+def restaurantPricesJSON():
+    """Price statistics of the menu of every restaurant."""
+    return jsonify(Restaurants=priceJSON(
+        priceStats(session, MenuItem.restaurant_id), 'restaurant_id'))
+
+@app.route('/restaurants/<int:restaurant_id>/menu/prices/JSON')
+def menuPricesJSON(restaurant_id):
+    """Price statistics of a menu, overall and by course, and how many of
+    its items are in each ?bucket= wide price range."""
+    session.query(Restaurant.id).filter_by(id=restaurant_id).one()
+    menu = priceJSON(priceStats(session, restaurantId=restaurant_id))
+    return jsonify(
+        Menu=menu[0] if menu else None,
+        Courses=priceJSON(priceStats(session, MenuItem.course,
+                                     restaurant_id), 'course'),
+        Histogram=histogramJSON(restaurantId=restaurant_id))
+
+@app.route('/courses/prices/JSON')
+def coursePricesJSON():
+    """Price statistics of every course across restaurants, and how many
+    items of ?course= (all by default) are in each price range."""
+    return jsonify(
+        Courses=priceJSON(priceStats(session, MenuItem.course), 'course'),
+        Histogram=histogramJSON(course=request.args.get('course')))
+
+# An item id only used to build URL patterns; see itemUrl().
+PLACEHOLDER_ID = 1234567890987654321
+
+def itemUrl(endpoint, restaurant_id):
+    """Returns a function of an item id returning the URL of endpoint for
+    that item of the restaurant, as url_for() would, having built the URL
+    once instead of once per item."""
+    head, placeholder, tail = url_for(
+        endpoint, restaurant_id=restaurant_id,
+        menu_id=PLACEHOLDER_ID).partition(str(PLACEHOLDER_ID))
+    return lambda menu_id: '%s%d%s' % (head, menu_id, tail)
+
+def menuItemsMarkup(restaurant):
+    """Returns the markup of the items on the menu of a restaurant.
+
+    Items are rendered with the menuItem macro of menuitem.html only when
+    there is no fragment for their version yet.
+    """
+    items = restaurant.items
+    keys = [(item.id, item.version) for item in items]
+    markup = fragments.getMany(keys)
+    missing = [n for n, fragment in enumerate(markup) if fragment is None]
+    if missing:
+        menuItem = get_template_attribute('menuitem.html', 'menuItem')
+        editUrl = itemUrl('editMenuItem', restaurant.id)
+        deleteUrl = itemUrl('deleteMenuItem', restaurant.id)
+        rendered = {}
+        for n in missing:
+            item = items[n]
+            # Kept as plain text, which joins faster than Markup.
+            markup[n] = rendered[keys[n]] = type(u'')(menuItem(
+                item, editUrl(item.id), deleteUrl(item.id)))
+        fragments.putMany(rendered)
+    return Markup(u''.join(markup))
+
+def renderMenu(restaurant_id):
+    """Returns the menu page of a restaurant."""
+    restaurant = getMenu(session, restaurant_id)
+    return render_template('menu.html', restaurant=restaurant,
+                           menuItems=menuItemsMarkup(restaurant))
 
 @app.route('/')
 @app.route('/restaurants/<int:restaurant_id>/')
 def restaurantMenu(restaurant_id):
-    restaurant = session.query(Restaurant).filter_by(id=restaurant_id).one()
-    items = session.query(MenuItem).filter_by(restaurant_id=restaurant.id).all()
-    return render_template('menu.html',restaurant=restaurant, items=items)
+    def render():
+        return renderMenu(restaurant_id)
+    # A page showing flashed messages is only for this browser, once.
+    if '_flashes' in browserSession:
+        return render()
+    return cachedResponse(('menu', restaurant_id),
+                          [('restaurant', restaurant_id)],
+                          'text/html; charset=utf-8', render)
+
+def searchHits():
+    """Returns the query of a search request and its Hits, answering 400 to
+    an invalid ?limit=."""
+    query = request.args.get('q', '')
+    try:
+        limit = min(int(request.args.get('limit', search.LIMIT)),
+                    MAX_SEARCH_RESULTS)
+    except ValueError as e:
+        abort(400, str(e))
+    return query, searchIndex.search(query, limit)
+
+@app.route('/search')
+def searchPage():
+    query, hits = searchHits()
+    return render_template('search.html', query=query, hits=hits)
+
+@app.route('/search/JSON')
+def searchJSON():
+    query, hits = searchHits()
+    return jsonify(Results=[dict(hit._asdict()) for hit in hits])
+
+@app.route('/cache')
+def cacheStats():
+    """Shows the counters and hit rates of the page and fragment caches."""
+    stats = cache.stats()
+    stats['fragments'] = fragments.stats()
+    return jsonify(stats)
 # Task 1: Create route for newMenuItem function here
 
 
@@ -36,10 +332,16 @@ def restaurantMenu(restaurant_id):
 def newMenuItem(restaurant_id):
 
     if request.method == 'POST':
-        newItem = MenuItem(name=request.form['name'], description=request.form[
-                           'description'], price=request.form['price'], course=request.form['course'], restaurant_id=restaurant_id)
+        try:
+            newItem = MenuItem(name=request.form['name'], description=request.form[
+                               'description'], price=request.form['price'], course=request.form['course'], restaurant_id=restaurant_id)
+        except ValueError as e:
+            abort(400, str(e))
         session.add(newItem)
         session.commit()
+        cache.invalidate(('restaurant', restaurant_id))
+        searchIndex.add('item', newItem.id, newItem.name, newItem.description,
+                        restaurant_id)
         flash("New item Created!")
         return redirect(url_for('restaurantMenu', restaurant_id=restaurant_id))
     else:
@@ -51,15 +353,19 @@ def newMenuItem(restaurant_id):
 def editMenuItem(restaurant_id, menu_id):
     if request.method == 'POST':
         newname = request.form['name']
-        itemedited = session.query(MenuItem).filter_by(id=menu_id).one()
+        itemedited = getMenuItem(session, menu_id)
         itemedited.name=newname 
        
         session.add(itemedited)
         session.commit()
+        cache.invalidate(('restaurant', itemedited.restaurant_id),
+                         ('item', menu_id))
+        searchIndex.add('item', menu_id, itemedited.name,
+                        itemedited.description, itemedited.restaurant_id)
         flash("Item Edited!")
         return redirect(url_for('restaurantMenu', restaurant_id=restaurant_id))
     else:
-        itemedited = session.query(MenuItem).filter_by(id=menu_id).one()
+        itemedited = getMenuItem(session, menu_id)
         return render_template('editmenuitem.html', restaurant_id=restaurant_id,menu_id=menu_id,itemedited=itemedited)
 
     
@@ -70,16 +376,26 @@ def editMenuItem(restaurant_id, menu_id):
 def deleteMenuItem(restaurant_id, menu_id):
     if request.method == 'POST':
         
-        itemtodelete = session.query(MenuItem).filter_by(id=menu_id).one()
+        itemtodelete = getMenuItem(session, menu_id)
+        menuRestaurant = itemtodelete.restaurant_id
         session.delete(itemtodelete)
         session.commit()
+        cache.invalidate(('restaurant', menuRestaurant), ('item', menu_id))
+        searchIndex.remove('item', menu_id)
         flash("Item Deleted!")
         return redirect(url_for('restaurantMenu', restaurant_id=restaurant_id))
     else:
-        itemtodelete = session.query(MenuItem).filter_by(id=menu_id).one()
+        itemtodelete = getMenuItem(session, menu_id)
         return render_template('deletemenuitem.html', restaurant_id=restaurant_id,menu_id=menu_id,itemtodelete = itemtodelete)
 
 
+@app.teardown_appcontext
+def removeSession(exception=None):
+    # Hand the connections back to the pools and forget the objects loaded
+    # by this request. A streamed page keeps the context until it is sent.
+    session.remove()
+
+
 
 
 
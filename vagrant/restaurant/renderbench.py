@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# renderbench.py -- times rendering the menu page of project.py
+#
+# Compares, for menus of every size given:
+#   template loop    the menu.html loop as it was: every item rendered by
+#                    the template, with two url_for() calls each;
+#   fragments, cold  menuItemsMarkup() with an empty fragment cache: items
+#                    rendered by the menuItem macro, links built once;
+#   fragments, warm  menuItemsMarkup() with every item cached.
+# Times are for rendering only; the menu is loaded once beforehand. It also
+# times compiling the templates from source and from the bytecode cache.
+#
+# Usage: python renderbench.py [--items 10 1000 10000] [--repeat 5]
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from flask import render_template
+from jinja2 import Environment, FileSystemBytecodeCache
+from sqlalchemy import create_engine
+
+import project
+import seed
+from repository import getMenu
+from sqlitedb import Database
+
+# The loop of menu.html before items were cached.
+TEMPLATE_LOOP = """<html><body>
+<h1>{{restaurant.name}}</h1>
+<a href='{{url_for('newMenuItem', restaurant_id = restaurant.id) }}'>New Menu Item</a>
+{% for i in items %}
+<div>
+
+<h3>{{i.name}}</h3>
+
+<p>{{i.description}}</p>
+
+<p> {{i.price}} </p>
+<a href='{{url_for('editMenuItem', restaurant_id = restaurant.id, menu_id = i.id) }}'>Edit</a>
+
+</br>
+<a href = '{{url_for('deleteMenuItem', restaurant_id = restaurant.id, menu_id = i.id ) }}'>Delete</a>
+
+</div>
+
+</div><br><br>
+
+{% endfor %}
+</body></html>"""
+
+
+def best(run, repeat):
+    """Returns the shortest of repeat runs, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        run()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def compileTime(bytecodeCache, repeat):
+    """Returns the seconds a new environment takes to load the templates of
+    the menu page."""
+    def load():
+        env = Environment(loader=project.app.jinja_loader,
+                          bytecode_cache=bytecodeCache)
+        env.get_template('menu.html')
+        env.get_template('menuitem.html')
+    load()
+    return best(load, repeat)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times rendering menus with and without fragments")
+    parser.add_argument('--items', type=int, nargs='+',
+                        default=[10, 1000, 10000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bench.db')
+    # Loaded before the database is opened in WAL mode.
+    seed.seed(create_engine('sqlite:///' + path),
+              [("Bench %d" % count, next(seed.generateMenus(count, 1))[1])
+               for count in args.items])
+    database = Database(path)
+    project.session = database.session
+
+    # Compiled once, as render_template() would from a file.
+    loopTemplate = project.app.jinja_env.from_string(TEMPLATE_LOOP)
+
+    print("%8s %-18s %10s %9s" % ("items", "path", "ms", "speedup"))
+    try:
+        with project.app.test_request_context():
+            for n, count in enumerate(args.items):
+                restaurant = getMenu(database.session, n + 1)
+
+                def loop():
+                    return loopTemplate.render(restaurant=restaurant,
+                                               items=restaurant.items)
+
+                def fragments():
+                    return render_template(
+                        'menu.html', restaurant=restaurant,
+                        menuItems=project.menuItemsMarkup(restaurant))
+
+                def cold():
+                    project.fragments.clear()
+                    return fragments()
+
+                baseline = None
+                for label, run in (('template loop', loop),
+                                   ('fragments, cold', cold),
+                                   ('fragments, warm', fragments)):
+                    elapsed = best(run, args.repeat)
+                    baseline = baseline or elapsed
+                    print("%8d %-18s %10.2f %8.1fx" % (
+                        count, label, elapsed * 1000, baseline / elapsed))
+        bytecode = os.path.join(directory, 'bytecode')
+        os.mkdir(bytecode)
+        source = compileTime(None, args.repeat)
+        cached = compileTime(FileSystemBytecodeCache(bytecode), args.repeat)
+        print("templates compiled in %.2f ms, loaded from the bytecode "
+              "cache in %.2f ms" % (source * 1000, cached * 1000))
+    finally:
+        database.dispose()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# repository.py -- the queries behind the restaurant menu pages
+#
+# Views ask for what they show through these functions instead of querying
+# the session themselves, so every page loads its rows with a known number
+# of round trips: related rows are loaded eagerly, in the same SELECT where
+# possible, and never lazily while a template is rendered.
+#
+# QueryCounter counts the statements an engine runs, so tests can assert
+# how many round trips a page costs.
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import chain
+
+from sqlalchemy import and_, event, func
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.exc import NoResultFound
+
+from database_setup import MenuItem, Restaurant
+
+
+def getMenu(session, restaurantId):
+    """Returns a restaurant with its menu items, in one SELECT.
+
+    The items are in restaurant.items, ordered by id.
+
+    Raises:
+      NoResultFound: if there is no such restaurant.
+    """
+    return session.query(Restaurant).options(
+        joinedload(Restaurant.items)).filter(
+        Restaurant.id == restaurantId).one()
+
+
+def getMenus(session, restaurantIds=None):
+    """Returns restaurants with their menu items, in two SELECTs.
+
+    With many restaurants a join would repeat every restaurant's columns on
+    each of its items, so the items are read by a second query on their
+    restaurant ids instead.
+
+    Args:
+      restaurantIds: the restaurants to load, or None for all of them.
+
+    Returns:
+      A list of Restaurants, ordered by id.
+    """
+    query = session.query(Restaurant).options(
+        selectinload(Restaurant.items)).order_by(Restaurant.id)
+    if restaurantIds is not None:
+        query = query.filter(Restaurant.id.in_(restaurantIds))
+    return query.all()
+
+
+# The columns iterMenuRows() can select, in the sorted order of the keys
+# of MenuItem.serialize.
+MENU_COLUMNS = OrderedDict([
+    ('course', MenuItem.course),
+    ('description', MenuItem.description),
+    ('id', MenuItem.id),
+    ('name', MenuItem.name),
+    ('price', MenuItem.price),
+])
+
+
+def iterMenuRows(session, restaurantId, fields=tuple(MENU_COLUMNS),
+                 after=None, limit=None, course=None, minPrice=None,
+                 maxPrice=None, batchSize=1000):
+    """Returns (part of) the menu of a restaurant as column tuples, without
+    building MenuItem objects.
+
+    The restaurant is outer joined so a missing one is told from an empty
+    menu in the same SELECT, which is run before this returns. Rows are
+    then fetched batchSize at a time as the result is iterated.
+
+    Pages are found from the (restaurant_id, id) or (restaurant_id, course)
+    index by item id rather than skipped with an OFFSET, so a page deep in
+    the menu costs the same as the first.
+
+    Args:
+      fields: the MENU_COLUMNS to select.
+      after: an item id; only items after it are returned.
+      limit: the number of items to return at most.
+      course: only return items of this course.
+      minPrice, maxPrice: only return items whose price is in this range,
+        in cents.
+
+    Returns:
+      An iterator of tuples of the fields, by item id; the id of the item
+      is appended to each if it is not one of the fields.
+
+    Raises:
+      NoResultFound: if there is no such restaurant.
+    """
+    columns = [MENU_COLUMNS[field] for field in fields]
+    if 'id' in fields:
+        idColumn = list(fields).index('id')
+    else:
+        idColumn = len(columns)
+        columns.append(MenuItem.id)
+    # Conditions on items go in the join: a restaurant with no item left is
+    # still one row.
+    conditions = [MenuItem.restaurant_id == Restaurant.id]
+    if after is not None:
+        conditions.append(MenuItem.id > after)
+    if course is not None:
+        conditions.append(MenuItem.course == course)
+    if minPrice is not None:
+        conditions.append(MenuItem.price_cents >= minPrice)
+    if maxPrice is not None:
+        conditions.append(MenuItem.price_cents <= maxPrice)
+    query = session.query(*columns).select_from(Restaurant).outerjoin(
+        MenuItem, and_(*conditions)).filter(
+        Restaurant.id == restaurantId).order_by(MenuItem.id)
+    if limit is not None:
+        query = query.limit(limit)
+    rows = iter(query.yield_per(batchSize))
+    first = next(rows, None)
+    if first is None:
+        raise NoResultFound("No restaurant %s" % restaurantId)
+    if first[idColumn] is None:
+        # The restaurant has no items.
+        return iter(())
+    return chain([first], rows)
+
+
+def priceStats(session, groupBy=None, restaurantId=None):
+    """Returns statistics of menu item prices, computed by SQLite.
+
+    Grouped by restaurant_id or course, they are read from the
+    (restaurant_id, price_cents) or (course, price_cents) index alone.
+
+    Args:
+      groupBy: the column to group by, MenuItem.restaurant_id or
+        MenuItem.course, or None for a single group.
+      restaurantId: only count the items of this restaurant.
+
+    Returns:
+      A list of (group, count, min, max, average) tuples by group, the
+      prices in cents and the average a float. Items without a price are
+      left out.
+    """
+    columns = [func.count(MenuItem.price_cents),
+               func.min(MenuItem.price_cents),
+               func.max(MenuItem.price_cents),
+               func.avg(MenuItem.price_cents)]
+    if groupBy is None:
+        query = session.query(*columns)
+    else:
+        query = session.query(groupBy, *columns).group_by(groupBy).order_by(
+            groupBy)
+    query = query.filter(MenuItem.price_cents != None)
+    if restaurantId is not None:
+        query = query.filter(MenuItem.restaurant_id == restaurantId)
+    if groupBy is None:
+        return [(None,) + tuple(row) for row in query if row[0]]
+    return [tuple(row) for row in query]
+
+
+def priceHistogram(session, width, restaurantId=None, course=None):
+    """Returns how many menu items cost how much, counted by SQLite.
+
+    Args:
+      width: the width of the price ranges, in cents.
+      restaurantId: only count the items of this restaurant.
+      course: only count the items of this course.
+
+    Returns:
+      A list of (low, high, count) tuples by price: count items cost at
+      least low and less than high cents. Empty ranges are left out.
+    """
+    bucket = MenuItem.price_cents / width
+    query = session.query(bucket, func.count()).filter(
+        MenuItem.price_cents != None)
+    if restaurantId is not None:
+        query = query.filter(MenuItem.restaurant_id == restaurantId)
+    if course is not None:
+        query = query.filter(MenuItem.course == course)
+    return [(n * width, (n + 1) * width, count)
+            for n, count in query.group_by(bucket).order_by(bucket)]
+
+
+def getMenuItem(session, itemId):
+    """Returns a menu item with its restaurant, in one SELECT.
+
+    Raises:
+      NoResultFound: if there is no such item.
+    """
+    return session.query(MenuItem).options(
+        joinedload(MenuItem.restaurant)).filter(MenuItem.id == itemId).one()
+
+
+class QueryCounter(object):
+    """Counts the statements run on an engine while it is listening.
+
+    Attributes:
+      statements: the SQL of every statement, in order.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __len__(self):
+        return len(self.statements)
+
+    def _executed(self, conn, cursor, statement, parameters, context,
+                  executemany):
+        self.statements.append(statement)
+
+    def start(self):
+        event.listen(self.engine, 'before_cursor_execute', self._executed)
+
+    def stop(self):
+        event.remove(self.engine, 'before_cursor_execute', self._executed)
+
+
+@contextmanager
+def assertQueryCount(engine, expected):
+    """Fails if the block runs other than expected statements on engine.
+
+    Usage:
+      with assertQueryCount(engine, 1):
+          client.get('/restaurants/1/')
+
+    Raises:
+      AssertionError: listing the statements that were run.
+    """
+    counter = QueryCounter(engine)
+    counter.start()
+    try:
+        yield counter
+    finally:
+        counter.stop()
+    if len(counter) != expected:
+        raise AssertionError("expected %d queries, ran %d:\n%s" % (
+            expected, len(counter), "\n".join(counter.statements)))
@@ -0,0 +1,638 @@
+#!/usr/bin/env python
+#
+# Test cases for the restaurant menu app
+#
+# Usage: python restaurant_test.py
+#
+# Runs in a scratch directory: project.py opens and migrates
+# ./restaurantmenu.db, and the tests make databases of their own there.
+
+import atexit
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+SCRATCH = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, SCRATCH)
+os.chdir(SCRATCH)
+
+from sqlalchemy import create_engine, inspect
+
+import database_setup
+from database_setup import migratePrices, parsePrice
+
+FIXTURE = os.path.join(HERE, 'menus.json')
+
+_project = []
+
+
+def loadProject():
+    """Returns project.py, serving the sample menus of FIXTURE from the
+    scratch directory's restaurantmenu.db. They are loaded the first time."""
+    if not _project:
+        import seed
+        seed.seed(database_setup.engine, seed.readFixture(FIXTURE))
+        import project
+        project.app.config['TESTING'] = True
+        project.app.secret_key = 'test'
+        _project.append(project)
+    return _project[0]
+
+
+def oldDatabase(name, rows, priceCents=False):
+    """Returns the path of a new database with the text prices of before
+    price_cents, and that column too if priceCents.
+
+    rows are (id, price) pairs, or (id, price, price_cents) with
+    priceCents."""
+    path = os.path.join(SCRATCH, name)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE restaurant (id INTEGER PRIMARY KEY, "
+                 "name VARCHAR(250) NOT NULL)")
+    conn.execute("CREATE TABLE menu_item (name VARCHAR(80) NOT NULL, "
+                 "id INTEGER PRIMARY KEY, description VARCHAR(250), "
+                 "price VARCHAR(8), course VARCHAR(250), "
+                 "restaurant_id INTEGER REFERENCES restaurant(id)%s)" %
+                 (", price_cents INTEGER" if priceCents else ""))
+    conn.execute("INSERT INTO restaurant VALUES (1, 'Old Place')")
+    for row in rows:
+        if priceCents:
+            conn.execute("INSERT INTO menu_item (name, id, price, "
+                         "restaurant_id, price_cents) VALUES "
+                         "('Dish', ?, ?, 1, ?)", row)
+        else:
+            conn.execute("INSERT INTO menu_item (name, id, price, "
+                         "restaurant_id) VALUES ('Dish', ?, ?, 1)", row)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def cents(engine):
+    """Returns {id: price_cents} of every menu item."""
+    return dict(tuple(row) for row in
+                engine.execute("SELECT id, price_cents FROM menu_item"))
+
+
+def testParsePrice():
+    for value, expected in (("$7.50", 750), ("7.5", 750), ("$.99", 99),
+                            (" $1,234.00 ", 123400), ("3", 300), (0, 0),
+                            (None, None), ("", None), ("$", None)):
+        if parsePrice(value) != expected:
+            raise ValueError("parsePrice(%r) should be %r, not %r." % (
+                value, expected, parsePrice(value)))
+    for value in ("$7.505", "seven", "-1", "nan", "inf"):
+        try:
+            parsePrice(value)
+        except ValueError:
+            continue
+        raise ValueError("parsePrice(%r) should raise ValueError." % (value,))
+    print "1. parsePrice() reads prices in cents and refuses the rest."
+
+
+def testMigratePrices():
+    engine = create_engine('sqlite:///' + oldDatabase(
+        'prices.db', [(1, "$7.50"), (2, "$.99"), (3, "free"), (4, None)]))
+    unreadable = migratePrices(engine)
+    if unreadable != [3]:
+        raise ValueError("Item 3 should be unreadable, not %r." % unreadable)
+    if cents(engine) != {1: 750, 2: 99, 3: None, 4: None}:
+        raise ValueError("Prices were not converted: %r" % cents(engine))
+    if sqlite3.sqlite_version_info >= database_setup.DROP_COLUMN_VERSION:
+        columns = [c['name'] for c in inspect(engine).get_columns('menu_item')]
+        if 'price' in columns:
+            raise ValueError("The text price column should be dropped.")
+    if migratePrices(engine) != [] or cents(engine)[1] != 750:
+        raise ValueError("Migrating again should change nothing.")
+    print "2. migratePrices() converts text prices to cents."
+
+
+def testMigratePricesWithoutDropColumn():
+    # As on SQLite before 3.35, which keeps the text column.
+    saved = database_setup.DROP_COLUMN_VERSION
+    database_setup.DROP_COLUMN_VERSION = (sys.maxint,)
+    try:
+        engine = create_engine('sqlite:///' + oldDatabase(
+            'nodrop.db', [(1, "$7.50"), (2, "$2.00")]))
+        migratePrices(engine)
+        left = engine.execute("SELECT count(*) FROM menu_item "
+                              "WHERE price IS NOT NULL").scalar()
+        if left != 0:
+            raise ValueError("Converted text prices should be cleared.")
+        # Edited after the migration, through price_cents only.
+        engine.execute("UPDATE menu_item SET price_cents = 1000 WHERE id = 1")
+        if migratePrices(engine) != [] or cents(engine) != {1: 1000, 2: 200}:
+            raise ValueError("Migrating again overwrote prices: %r" %
+                             cents(engine))
+    finally:
+        database_setup.DROP_COLUMN_VERSION = saved
+    print "3. Without DROP COLUMN, migrating again keeps the prices in cents."
+
+
+def testMigratePricesKeepsCents():
+    # Migrated in part: some items have cents and still their text price.
+    engine = create_engine('sqlite:///' + oldDatabase(
+        'partial.db', [(1, "$7.50", 1000), (2, "$2.00", None)],
+        priceCents=True))
+    migratePrices(engine)
+    if cents(engine) != {1: 1000, 2: 200}:
+        raise ValueError("Prices in cents should be kept: %r" % cents(engine))
+    print "4. migratePrices() keeps the prices already in cents."
+
+
+def testMenuPageQueries():
+    from repository import assertQueryCount
+    project = loadProject()
+    client = project.app.test_client()
+    # Connections are opened, and SQLite asked about itself, only once.
+    client.get('/restaurants/2/')
+    project.cache.clear()
+    database = project.database
+    with assertQueryCount(database.writer, 0):
+        with assertQueryCount(database.reader, 1):
+            response = client.get('/restaurants/1/')
+    if response.status_code != 200 or b"Urban Burger" not in response.data:
+        raise ValueError("The menu page should show the restaurant.")
+    if response.data.count(b"/edit'") != 9:
+        raise ValueError("The menu page should list every item.")
+    print "5. A menu page is loaded with one query."
+
+
+def testRouter():
+    from router import MethodNotAllowed, NotFound, Router
+    router = Router()
+    router.add('/restaurants', 'list')
+    router.add('/restaurants/new', 'newForm')
+    router.add('/restaurants/new', 'new', methods=['POST'])
+    router.add('/restaurants/<int:restaurant_id>/edit', 'edit',
+               methods=['GET', 'POST'])
+    router.add('/restaurants/<name>/about', 'about')
+    router.add('/restaurants/<int:restaurant_id>/menu/<int:menu_id>', 'item')
+    for method, path, expected in (
+            ('GET', '/restaurants', ('list', {})),
+            ('GET', '/restaurants/', ('list', {})),
+            ('POST', '/restaurants/new', ('new', {})),
+            ('GET', '/restaurants/42/edit', ('edit', {'restaurant_id': 42})),
+            ('POST', '/restaurants/42/edit', ('edit', {'restaurant_id': 42})),
+            ('GET', '/restaurants/new/about', ('about', {'name': 'new'})),
+            ('GET', '/restaurants/7/menu/3', ('item', {'restaurant_id': 7,
+                                                       'menu_id': 3}))):
+        if router.match(method, path) != expected:
+            raise ValueError("%s %s should route to %r, not %r." % (
+                method, path, expected, router.match(method, path)))
+    for path in ('/restaurants/x/edit', '/restaurants/42', '/menus',
+                 '/restaurants/7/menu/3/edit'):
+        try:
+            router.match('GET', path)
+        except NotFound:
+            continue
+        raise ValueError("%s should not be found." % path)
+    try:
+        router.match('DELETE', '/restaurants/new')
+    except MethodNotAllowed as e:
+        if e.allowed != ['GET', 'POST']:
+            raise ValueError("405s should list the allowed methods.")
+    else:
+        raise ValueError("Unrouted methods should not be allowed.")
+    for pattern, methods in (('/restaurants/new', ['POST']),
+                             ('/restaurants/<float:price>', ['GET'])):
+        try:
+            router.add(pattern, 'other', methods)
+        except ValueError:
+            continue
+        raise ValueError("Adding %s should fail." % pattern)
+    print "6. The router dispatches every path to one handler."
+
+
+def testResponseCache():
+    from cache import ResponseCache
+    cache = ResponseCache(maxEntries=2)
+    token = cache.begin()
+    entry = cache.put('a', u"caf\xe9", 'text/html', [('restaurant', 1)],
+                      token)
+    if cache.get('a') is not entry or entry.body != b"caf\xc3\xa9":
+        raise ValueError("A stored response should be found, encoded.")
+    for header, expected in ((entry.etag, True), ('W/' + entry.etag, True),
+                             ('"other", ' + entry.etag, True), ('*', True),
+                             ('"other"', False), (None, False)):
+        if entry.matches(header) != expected:
+            raise ValueError("If-None-Match %r should match: %s" % (
+                header, expected))
+    cache.put('b', "b", 'text/html', [('restaurant', 2)], cache.begin())
+    cache.invalidate(('restaurant', 1))
+    if cache.get('a') is not None or cache.get('b') is None:
+        raise ValueError("Invalidating a tag should drop its pages only.")
+    if cache.put('a', "stale", 'text/html', [('restaurant', 1)], token):
+        raise ValueError("Pages read before a write should not be stored.")
+    cache.put('c', "c", 'text/html', [], cache.begin())
+    cache.get('b')
+    cache.put('d', "d", 'text/html', [], cache.begin())
+    if cache.get('c') is not None or cache.get('b') is None:
+        raise ValueError("The least recently used page should be evicted.")
+    expiring = ResponseCache(ttl=-1)
+    expiring.put('a', "a", 'text/html', [], expiring.begin())
+    if expiring.get('a') is not None:
+        raise ValueError("Expired pages should not be returned.")
+    print "7. The response cache evicts, expires and invalidates by tag."
+
+
+def testMenuPageETag():
+    project = loadProject()
+    # Without cookies, so the flashed messages of the edit are not shown.
+    client = project.app.test_client(use_cookies=False)
+    first = client.get('/restaurants/1/')
+    etag = first.headers.get('ETag')
+    if etag is None:
+        raise ValueError("Menu pages should have an ETag.")
+    response = client.get('/restaurants/1/', headers={'If-None-Match': etag})
+    if response.status_code != 304 or response.data:
+        raise ValueError("A page the client has should be answered 304.")
+    client.post('/restaurants/1/1/edit', data={'name': "Renamed Burger"})
+    response = client.get('/restaurants/1/', headers={'If-None-Match': etag})
+    if response.status_code != 200 or \
+            b"Renamed Burger" not in response.data or \
+            response.headers['ETag'] == etag:
+        raise ValueError("Editing an item should invalidate its menu.")
+    print "8. Menu pages have ETags, changed by writes."
+
+
+def testMenuPages():
+    project = loadProject()
+    client = project.app.test_client(use_cookies=False)
+    everything = json.loads(client.get('/restaurants/7/menu/JSON').data)
+    ids = [item['id'] for item in everything['MenuItems']]
+    if len(ids) != 7 or ids != sorted(ids) or 'next' in everything:
+        raise ValueError("Without a limit the whole menu should be listed.")
+    paged = []
+    url = '/restaurants/7/menu/JSON?limit=3&fields=id,name'
+    while url:
+        page = json.loads(client.get(url).data)
+        if len(page['MenuItems']) > 3 or \
+                any(sorted(item) != ['id', 'name']
+                    for item in page['MenuItems']):
+            raise ValueError("Pages should have the fields and size asked.")
+        paged.extend(item['id'] for item in page['MenuItems'])
+        url = page.get('next')
+    if paged != ids:
+        raise ValueError("Following next should list every item once: %r"
+                         % paged)
+    # The page is cached without ?ref, so its next link must not carry it.
+    for query in ('ref=mail&', ''):
+        page = json.loads(client.get('/restaurants/7/menu/JSON?' + query +
+                                     'limit=2&min_price=1').data)
+        if 'ref' in page['next'] or 'min_price=%241.00' not in page['next']:
+            raise ValueError("next should keep only the page's arguments: %r"
+                             % page['next'])
+    cheap = json.loads(client.get(
+        '/restaurants/7/menu/JSON?max_price=$5&after=%d' % ids[0]).data)
+    if [item['price'] for item in cheap['MenuItems']] != ["$2.99", "$1.99"]:
+        raise ValueError("Filters should apply to the page.")
+    for query in ('limit=0', 'after=x', 'fields=secret', 'min_price=cheap'):
+        if client.get('/restaurants/7/menu/JSON?' + query).status_code != 400:
+            raise ValueError("?%s should be refused." % query)
+    print "9. Menu JSON pages follow each other by item id."
+
+
+def testSearchFallback():
+    import search
+    from sqlalchemy.exc import OperationalError
+    loadProject()
+    engine = database_setup.engine
+
+    def noFts5(*args, **kwargs):
+        raise OperationalError("CREATE VIRTUAL TABLE", {},
+                               Exception("no such module: fts5"))
+
+    saved = search.FtsIndex
+    search.FtsIndex = noFts5
+    try:
+        index = search.openIndex(engine)
+    finally:
+        search.FtsIndex = saved
+    if not isinstance(index, search.MemoryIndex):
+        raise ValueError("Without FTS5 the index should be kept in memory.")
+    hits = index.search(u"burg")
+    if not hits or any("burg" not in (hit.name + " " +
+                                      (hit.description or "")).lower()
+                       for hit in hits):
+        raise ValueError("Words should match by prefix.")
+    # A word in the name counts more than one in the description.
+    index.add('item', 1000, u"Plain Rice", u"no caf\xe9", 1)
+    index.add('item', 1001, u"Caf\xe9 au lait", None, 1)
+    if [hit.id for hit in index.search(u"CAFE")] != [1001, 1000]:
+        raise ValueError("Names should rank first, accents ignored.")
+    if [hit.id for hit in index.search(u"plain caf")] != [1000]:
+        raise ValueError("Every word of the query should match.")
+    index.remove('item', 1000, 1001)
+    if index.search(u"cafe") or u"plain" in index.words:
+        raise ValueError("Removed items should be forgotten.")
+    try:
+        fts = search.FtsIndex(engine, table='test_index')
+    except OperationalError:
+        print "10. Search falls back to an index in memory (no FTS5 here)."
+        return
+    for query in (u"burger", u"chick", u"sauce", u"fried rice"):
+        expected = set((hit.kind, hit.id) for hit in fts.search(query, 100))
+        if set((hit.kind, hit.id) for hit in index.search(query, 100)) != \
+                expected:
+            raise ValueError("Both indexes should find the same for %r."
+                             % query)
+    print "10. Search falls back to an index in memory finding the same."
+
+
+def testSeed():
+    import seed
+    path = os.path.join(SCRATCH, 'menus.csv')
+    with open(path, 'wb') as f:
+        f.write(b"restaurant,name,description,price,course\n"
+                b"Caf\xc3\xa9 One,Soup,Hot,$3.50,Appetizer\n"
+                b"Caf\xc3\xa9 One,Tea,,$1,Beverage\n"
+                b"Two,Pie,Sweet,$4.25,Dessert\n")
+    menus = seed.readFixture(path)
+    if [(name, len(items)) for name, items in menus] != \
+            [(u"Caf\xe9 One", 2), (u"Two", 1)]:
+        raise ValueError("A CSV fixture should group items by restaurant.")
+    path = os.path.join(SCRATCH, 'menus.txt')
+    open(path, 'w').close()
+    try:
+        seed.readFixture(path)
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Unknown fixture formats should be refused.")
+
+    engine = create_engine('sqlite:///' + os.path.join(SCRATCH, 'seed.db'))
+    stats = seed.seed(engine, menus)
+    generated = list(seed.generateMenus(25, 4))
+    stats2 = seed.seed(engine, generated, reindex=True, batchSize=4,
+                       commitRows=10)
+    if (stats['restaurants'], stats['items'], stats2['restaurants'],
+            stats2['items']) != (2, 3, 4, 25):
+        raise ValueError("seed() should count what it added.")
+    counts = engine.execute("SELECT restaurant_id, count(*), "
+                            "sum(price_cents) FROM menu_item "
+                            "GROUP BY restaurant_id").fetchall()
+    if [tuple(row) for row in counts[:2]] != [(1, 2, 450), (2, 1, 425)] or \
+            [row[1] for row in counts[2:]] != [7, 6, 6, 6]:
+        raise ValueError("Items should belong to their restaurants.")
+    indexes = set(index['name'] for index in
+                  inspect(engine).get_indexes('menu_item'))
+    if indexes != set(index.name for index in
+                      database_setup.MenuItem.__table__.indexes):
+        raise ValueError("Indexes dropped for the load should be rebuilt.")
+    try:
+        seed.seed(engine, [(u"Bad", [{'name': u"Soup", 'price': u"soon"}])])
+    except ValueError:
+        pass
+    else:
+        raise ValueError("Unreadable prices should be refused.")
+    if engine.execute("SELECT count(*) FROM restaurant").scalar() != 6:
+        raise ValueError("A failed load should leave nothing behind.")
+    print "11. seed.py loads fixtures and generated menus in batches."
+
+
+def testSeedWal():
+    import seed
+    from sqlitedb import Database
+    database = Database(os.path.join(SCRATCH, 'wal.db'))
+    try:
+        # Another connection open, as a running server has.
+        with database.reader.connect() as conn:
+            seed.seed(database.writer, seed.generateMenus(10, 2))
+            if conn.execute("SELECT count(*) FROM menu_item").scalar() != 10:
+                raise ValueError("The items should be loaded.")
+        mode = database.writer.execute("PRAGMA journal_mode").scalar()
+        if mode.lower() != 'wal':
+            raise ValueError("Seeding should keep the database in WAL mode.")
+    finally:
+        database.dispose()
+    print "12. seed.py loads a database in WAL mode that is in use."
+
+
+def testFragmentCache():
+    from cache import FragmentCache
+    cache = FragmentCache(maxEntries=4)
+    cache.putMany({(1, 0): u"one", (2, 0): u"two"})
+    if cache.getMany([(1, 0), (2, 1), (2, 0)]) != [u"one", None, u"two"]:
+        raise ValueError("Fragments should be found by id and version.")
+    # (1, 0) was used last; the new generation is full with (3, 0).
+    cache.putMany({(3, 0): u"three"})
+    cache.getMany([(1, 0)])
+    cache.putMany({(4, 0): u"four", (5, 0): u"five"})
+    if cache.getMany([(1, 0), (2, 0)]) != [u"one", None]:
+        raise ValueError("The least recently used fragments should go.")
+    stats = cache.stats()
+    if (stats['hits'], stats['misses'], stats['stores']) != (4, 2, 5):
+        raise ValueError("Lookups should be counted: %r" % stats)
+    print "13. The fragment cache keeps the recently used fragments."
+
+
+def testMenuFragments():
+    project = loadProject()
+    client = project.app.test_client(use_cookies=False)
+    project.cache.clear()
+    project.fragments.clear()
+    cold = client.get('/restaurants/3/').data
+    stored = project.fragments.stats()['stores']
+    project.cache.clear()
+    if client.get('/restaurants/3/').data != cold or \
+            project.fragments.stats()['stores'] != stored:
+        raise ValueError("A menu should be the same from fragments.")
+    items = [item['id'] for item in json.loads(
+        client.get('/restaurants/3/menu/JSON').data)['MenuItems']]
+    client.post('/restaurants/3/%d/edit' % items[0],
+                data={'name': "Fragment Test"})
+    page = client.get('/restaurants/3/').data
+    if b"Fragment Test" not in page or \
+            project.fragments.stats()['stores'] != stored + 1:
+        raise ValueError("An edited item should be rendered again, alone.")
+    print "14. Menu pages are made of fragments, rendered once per version."
+
+
+def testMemoryIndexUpdates():
+    import search
+    import threading
+    loadProject()
+    engine = database_setup.engine
+    index = search.MemoryIndex(engine, maxAge=60)
+    # Written by another process.
+    restaurantId = engine.execute("INSERT INTO restaurant (name) "
+                                  "VALUES ('Zanzibar Grill')").lastrowid
+    if index.search(u"zanzibar"):
+        raise ValueError("The index should be kept until it is old.")
+    index.built -= 60
+    if [hit.id for hit in index.search(u"zanzibar")] != [restaurantId]:
+        raise ValueError("An old index should be built again.")
+
+    class Writing(object):
+        # Adds an item as the index is being built.
+        def connect(self):
+            index.add('item', 5000, u"Quokka Stew", None, 1)
+            return engine.connect()
+
+    index.engine = Writing()
+    index.rebuild()
+    index.engine = engine
+    if [hit.id for hit in index.search(u"quokka")] != [5000]:
+        raise ValueError("Items added during a build should be kept.")
+
+    errors = []
+
+    def write(n):
+        try:
+            for i in range(300):
+                index.add('item', 10000 + n * 1000 + i,
+                          u"Thread Dish w%d%d" % (n, i), None, 1)
+                index.remove('item', 10000 + n * 1000 + i - 1)
+        except Exception as e:
+            errors.append(e)
+
+    def read():
+        try:
+            for i in range(300):
+                index.search(u"thread dish w")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    threads += [threading.Thread(target=read) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors or index.words != sorted(index.postings):
+        raise ValueError("Concurrent updates broke the index: %r" % errors)
+    if len(index.search(u"thread dish", 100)) != 4:
+        raise ValueError("The last item of every thread should be left.")
+    print "15. The in-memory index is safe to update from many threads."
+
+
+def testMigrateSample():
+    # Importing the models writes nothing; migrate() brings the sample
+    # database up to date, and again does nothing.
+    empty = tempfile.mkdtemp(dir=SCRATCH)
+    subprocess.check_call([sys.executable, '-c', 'import database_setup'],
+                          cwd=empty, env=dict(os.environ, PYTHONPATH=HERE))
+    if os.listdir(empty):
+        raise ValueError("Importing database_setup should make no database.")
+    path = os.path.join(SCRATCH, 'sample.db')
+    shutil.copy(os.path.join(HERE, 'restaurantmenu.db'), path)
+    engine = create_engine('sqlite:///' + path)
+    for attempt in range(2):
+        database_setup.migrate(engine)
+        columns = [c['name'] for c in inspect(engine).get_columns('menu_item')]
+        if 'version' not in columns or 'price' in columns:
+            raise ValueError("migrate() should update the sample: %r" % columns)
+    print "16. migrate() updates the sample database; importing writes nothing."
+
+
+def testDeleteRestaurant():
+    from sqlalchemy.orm import sessionmaker
+    engine = create_engine('sqlite:///' + os.path.join(SCRATCH, 'delete.db'))
+    database_setup.migrate(engine)
+    session = sessionmaker(bind=engine)()
+    restaurant = database_setup.Restaurant(name="Closing")
+    session.add(database_setup.MenuItem(name="Soup", restaurant=restaurant))
+    session.commit()
+    restaurantId = restaurant.id
+    if len(restaurant.items) != 1:
+        raise ValueError("The item should be on the restaurant's menu.")
+    session.delete(restaurant)
+    session.commit()
+    left = engine.execute("SELECT restaurant_id FROM menu_item").fetchall()
+    if left != [(restaurantId,)]:
+        raise ValueError("Items should be left as they are: %r" % left)
+    print "17. Deleting a restaurant leaves its items untouched."
+
+
+def testSeedConcurrentWriter():
+    # Another writer adds a restaurant between two of seed()'s transactions.
+    import seed
+    path = os.path.join(SCRATCH, 'shared.db')
+    engine = create_engine('sqlite:///' + path)
+    seed.seed(engine, [(u"First", [{'name': u"Soup", 'price': u"$1"}])])
+    other = sqlite3.connect(path)
+
+    def menus():
+        for name in (u"Second", u"Third"):
+            yield name, [{'name': u"Tea", 'price': u"$2"}]
+            with other:
+                other.execute("INSERT INTO restaurant (name) VALUES ('Other')")
+                other.execute("INSERT INTO menu_item (name, restaurant_id, "
+                              "version) VALUES ('Pie', last_insert_rowid(), 0)")
+
+    seed.seed(engine, menus(), batchSize=1, commitRows=1)
+    other.close()
+    rows = engine.execute("SELECT restaurant.name, menu_item.name "
+                          "FROM menu_item JOIN restaurant "
+                          "ON restaurant.id = menu_item.restaurant_id "
+                          "ORDER BY menu_item.id").fetchall()
+    if [tuple(row) for row in rows] != [
+            (u"First", u"Soup"), (u"Second", u"Tea"), (u"Other", u"Pie"),
+            (u"Third", u"Tea"), (u"Other", u"Pie")]:
+        raise ValueError("Rows of other writers should not collide: %r"
+                         % rows)
+    print "18. seed.py numbers its rows as it inserts them."
+
+
+def testWebServerForms():
+    import httplib
+    import threading
+    loadProject()
+    import webserver
+
+    class QuietHandler(webserver.webServerHandler):
+        def log_message(self, format, *args):
+            pass
+
+    server = webserver.ThreadedHTTPServer(('127.0.0.1', 0), QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        connection = httplib.HTTPConnection('127.0.0.1', server.server_port)
+        body = "--b\r\nContent-Disposition: form-data; name=\"other\"" \
+               "\r\n\r\nx\r\n--b--\r\n"
+        for path in ('/restaurants/new', '/restaurants/1/edit'):
+            connection.request('POST', path, body, {
+                'Content-Type': 'multipart/form-data; boundary=b'})
+            response = connection.getresponse()
+            response.read()
+            if response.status != 400:
+                raise ValueError("%s without a name should answer 400, not "
+                                 "%d." % (path, response.status))
+        connection.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        webserver.database.dispose()
+    print "19. The web server answers 400 to forms missing a field."
+
+
+if __name__ == '__main__':
+    testParsePrice()
+    testMigratePrices()
+    testMigratePricesWithoutDropColumn()
+    testMigratePricesKeepsCents()
+    testMenuPageQueries()
+    testRouter()
+    testResponseCache()
+    testMenuPageETag()
+    testMenuPages()
+    testSearchFallback()
+    testMemoryIndexUpdates()
+    testSeed()
+    testSeedWal()
+    testFragmentCache()
+    testMenuFragments()
+    testMigrateSample()
+    testDeleteRestaurant()
+    testSeedConcurrentWriter()
+    testWebServerForms()
+    print "Success!  All tests pass!"
@@ -0,0 +1,460 @@
+#!/usr/bin/env python
+# search.py -- full-text and prefix search over restaurants and menu items
+#
+# Restaurant names and menu item names and descriptions are indexed as
+# documents; a query matches the documents containing a word starting with
+# each of its words, best matches first, names counting more than
+# descriptions.
+#
+# FtsIndex keeps the index in the database itself, in an SQLite FTS5 table,
+# so every process using the database sees the same one. Where SQLite is
+# built without FTS5, MemoryIndex keeps an inverted index in the process
+# instead, built from the tables when it is opened and again every
+# REBUILD_SECONDS, so writes of other processes show up that much later.
+# Either way the handlers that write restaurants and menu items keep the
+# index up to date with add() and remove(), see webserver.py and
+# project.py.
+#
+# Usage: python search.py [--items 1000000] [--repeat 5]
+#   times indexing, searching and updating both indexes on a scratch
+#   database.
+
+from collections import namedtuple
+import argparse
+import bisect
+import heapq
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+
+from sqlalchemy import text
+
+KINDS = ('item', 'restaurant')
+
+# How much more a word counts in a name than in a description.
+NAME_WEIGHT = 10.0
+
+# Results returned by a search when no limit is given.
+LIMIT = 20
+
+Hit = namedtuple('Hit', 'kind id restaurantId name description')
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def tokenize(value):
+    """Returns the words of value, lowercase and without accents, as the
+    FTS5 unicode61 tokenizer splits them."""
+    if not value:
+        return []
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    value = unicodedata.normalize('NFKD', value.lower())
+    value = u''.join(c for c in value if not unicodedata.combining(c))
+    return _WORD.findall(value)
+
+
+def _docid(kind, id):
+    # Items and restaurants share the rowids of the index.
+    return id * 2 + KINDS.index(kind)
+
+
+def _hit(docid, name, description, restaurantId):
+    kind = KINDS[docid % 2]
+    return Hit(kind, docid // 2, restaurantId if kind == 'item' else docid // 2,
+               name, description)
+
+
+# Every document, as (docid, name, description, restaurant id).
+_DOCUMENTS = """SELECT id * 2, name, description, restaurant_id
+                FROM menu_item
+                UNION ALL
+                SELECT id * 2 + 1, name, NULL, NULL FROM restaurant"""
+
+
+class FtsIndex(object):
+    """The search index as an SQLite FTS5 table of the database."""
+
+    def __init__(self, engine, table='search_index', reader=None):
+        """Opens the index, creating and filling it if it is missing.
+
+        Args:
+          engine: the database, written through it.
+          table: the name of the FTS5 table.
+          reader: the engine searches go through, engine by default.
+
+        Raises:
+          sqlalchemy.exc.OperationalError: if SQLite has no FTS5.
+        """
+        self.engine = engine
+        self.reader = reader or engine
+        self.table = table
+        with engine.begin() as conn:
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = :table"),
+                table=table).first()
+            if exists is None:
+                conn.execute(
+                    "CREATE VIRTUAL TABLE %s USING fts5("
+                    "name, description, restaurant_id UNINDEXED)" % table)
+        if exists is None:
+            self.rebuild()
+
+    def rebuild(self):
+        """Indexes the restaurant and menu_item tables from scratch."""
+        with self.engine.begin() as conn:
+            conn.execute("DELETE FROM %s" % self.table)
+            conn.execute("INSERT INTO %s (rowid, name, description, "
+                         "restaurant_id) %s" % (self.table, _DOCUMENTS))
+
+    def add(self, kind, id, name, description=None, restaurantId=None):
+        """Indexes a restaurant or menu item, replacing what was indexed for
+        it before."""
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                "INSERT OR REPLACE INTO %s (rowid, name, description, "
+                "restaurant_id) VALUES (:docid, :name, :description, "
+                ":restaurantId)" % self.table), docid=_docid(kind, id),
+                name=name, description=description, restaurantId=restaurantId)
+
+    def remove(self, kind, *ids):
+        """Removes restaurants or menu items from the index."""
+        if not ids:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM %s WHERE rowid = :docid"
+                              % self.table),
+                         [{'docid': _docid(kind, id)} for id in ids])
+
+    def search(self, query, limit=LIMIT):
+        """Returns the best limit Hits for query."""
+        words = tokenize(query)
+        if not words:
+            return []
+        match = " AND ".join('"%s"*' % word for word in words)
+        with self.reader.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT rowid, name, description, restaurant_id FROM %s "
+                "WHERE %s MATCH :match ORDER BY bm25(%s, %s, 1.0), rowid "
+                "LIMIT :limit" % (self.table, self.table, self.table,
+                                  NAME_WEIGHT)), match=match, limit=limit)
+            return [_hit(*row) for row in rows]
+
+
+# Seconds after which the MemoryIndex of openIndex() is built again from the
+# tables, so it sees the writes of other processes.
+REBUILD_SECONDS = 60
+
+
+class MemoryIndex(object):
+    """The search index as an inverted index in this process.
+
+    Prefixes are looked up by bisecting the sorted list of every word
+    indexed. Writes made by other processes, such as the other server, are
+    only seen once the index is built again: by rebuild(), or by the first
+    search made maxAge seconds after the last build. Safe to use from
+    several threads.
+    """
+
+    def __init__(self, engine=None, maxAge=None):
+        """Creates the index, filled from engine's tables if given.
+
+        Args:
+          engine: the database the index is built from.
+          maxAge: seconds after which a search builds it again first, or
+            None to only do so on rebuild().
+        """
+        self.engine = engine
+        self.maxAge = maxAge
+        self.lock = threading.Lock()
+        # Held by the thread building the index.
+        self.building = threading.Lock()
+        # While a build runs, the add() and remove() calls made meanwhile,
+        # replayed on the new index; None otherwise.
+        self.changes = None
+        self.built = time.time()
+        self.clear()
+        if engine is not None:
+            self.rebuild()
+
+    def clear(self):
+        with self.lock:
+            # docid -> (name, description, restaurant id, words).
+            self.documents = {}
+            # word -> {docid: weight}.
+            self.postings = {}
+            # Every key of postings, sorted.
+            self.words = []
+
+    def rebuild(self):
+        """Indexes the restaurant and menu_item tables from scratch.
+
+        Searches go on using the old index until the new one is ready.
+        """
+        with self.building:
+            self._build()
+
+    def _build(self):
+        # Called holding self.building.
+        with self.lock:
+            self.changes = []
+        try:
+            fresh = MemoryIndex()
+            with self.engine.connect() as conn:
+                for docid, name, description, restaurantId in conn.execute(
+                        _DOCUMENTS):
+                    fresh._add(docid, name, description, restaurantId)
+            fresh.words = sorted(fresh.postings)
+            with self.lock:
+                # Writes committed while the tables were read may be
+                # missing from them.
+                for change, args in self.changes:
+                    change(fresh, *args)
+                self.documents = fresh.documents
+                self.postings = fresh.postings
+                self.words = fresh.words
+                self.built = time.time()
+        finally:
+            with self.lock:
+                self.changes = None
+
+    def add(self, kind, id, name, description=None, restaurantId=None):
+        """Indexes a restaurant or menu item, replacing what was indexed for
+        it before."""
+        args = (_docid(kind, id), name, description, restaurantId)
+        with self.lock:
+            self._replace(*args)
+            if self.changes is not None:
+                self.changes.append((MemoryIndex._replace, args))
+
+    def remove(self, kind, *ids):
+        """Removes restaurants or menu items from the index."""
+        docids = [_docid(kind, id) for id in ids]
+        with self.lock:
+            for docid in docids:
+                self._remove(docid)
+                if self.changes is not None:
+                    self.changes.append((MemoryIndex._remove, (docid,)))
+
+    def search(self, query, limit=LIMIT):
+        """Returns the best limit Hits for query; ties in no particular
+        order."""
+        if self.maxAge is not None and self.engine is not None and \
+                time.time() - self.built >= self.maxAge:
+            self._refresh()
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.lock:
+            return self._search(words, limit)
+
+    def _refresh(self):
+        """Builds the index again, unless another thread is already at it."""
+        if not self.building.acquire(False):
+            return
+        try:
+            if time.time() - self.built >= self.maxAge:
+                self._build()
+        finally:
+            self.building.release()
+
+    def _search(self, words, limit):
+        # For every word of the query, the postings of the words it is a
+        # prefix of.
+        terms = []
+        for word in words:
+            i = j = bisect.bisect_left(self.words, word)
+            while j < len(self.words) and self.words[j].startswith(word):
+                j += 1
+            postings = [self.postings[other] for other in self.words[i:j]]
+            terms.append((sum(len(p) for p in postings), postings))
+        # Start from the rarest word, so the others only have to be looked
+        # up for the documents still matching. No tuple is made per
+        # document: with a large index, collecting them costs more than the
+        # search.
+        terms.sort(key=lambda term: term[0])
+        scores = {}
+        for postings in terms[0][1]:
+            for docid in postings:
+                scores[docid] = scores.get(docid, 0.0) + postings[docid]
+        for size, postings in terms[1:]:
+            matched = {}
+            if size < len(scores):
+                for p in postings:
+                    for docid in p:
+                        if docid in scores:
+                            matched[docid] = matched.get(
+                                docid, scores[docid]) + p[docid]
+            else:
+                for docid in scores:
+                    for p in postings:
+                        if docid in p:
+                            matched[docid] = matched.get(
+                                docid, scores[docid]) + p[docid]
+            scores = matched
+        best = heapq.nlargest(limit, scores, key=scores.get)
+        return [_hit(docid, *self.documents[docid][:3]) for docid in best]
+
+    def _add(self, docid, name, description, restaurantId):
+        """Adds a document; returns its words."""
+        weights = {}
+        for word in tokenize(name):
+            weights[word] = weights.get(word, 0.0) + NAME_WEIGHT
+        for word in tokenize(description):
+            weights[word] = weights.get(word, 0.0) + 1.0
+        for word, weight in weights.items():
+            self.postings.setdefault(word, {})[docid] = weight
+        self.documents[docid] = (name, description, restaurantId,
+                                 tuple(weights))
+        return weights
+
+    def _replace(self, docid, name, description, restaurantId):
+        self._remove(docid)
+        for word in self._add(docid, name, description, restaurantId):
+            if len(self.postings[word]) == 1:
+                bisect.insort(self.words, word)
+
+    def _remove(self, docid):
+        document = self.documents.pop(docid, None)
+        if document is None:
+            return
+        for word in document[3]:
+            postings = self.postings[word]
+            del postings[docid]
+            if not postings:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+
+def openIndex(engine, reader=None):
+    """Returns the FtsIndex of the database, or a MemoryIndex of it if
+    SQLite has no FTS5. The FtsIndex searches through reader if given."""
+    try:
+        return FtsIndex(engine, reader=reader)
+    except Exception as e:
+        if 'fts5' not in str(e):
+            raise
+        return MemoryIndex(engine, maxAge=REBUILD_SECONDS)
+
+
+# Words the benchmark makes menus from.
+_ADJECTIVES = ("grilled crispy spicy smoked roasted fried fresh sweet "
+               "sour tangy creamy garlic herbed honey glazed").split()
+_DISHES = ("burger chicken salad pizza noodles tacos sandwich soup curry "
+           "steak salmon dumplings pancakes risotto omelette").split()
+_EXTRAS = ("with lettuce tomato cheese bacon avocado mushrooms onions "
+           "peppers rice beans basil lemon ginger sesame").split()
+
+
+def _seed(engine, items, restaurants):
+    from database_setup import Base, MenuItem, Restaurant
+    Base.metadata.create_all(engine)
+    random.seed(1)
+    with engine.begin() as conn:
+        conn.execute(Restaurant.__table__.insert(), [
+            {'id': i + 1, 'name': "%s %s House" % (
+                random.choice(_ADJECTIVES).title(),
+                random.choice(_DISHES).title())}
+            for i in range(restaurants)])
+        batch = []
+        for i in range(items):
+            batch.append({
+                'name': "%s %s" % (random.choice(_ADJECTIVES),
+                                   random.choice(_DISHES)),
+                'description': " ".join(random.sample(_EXTRAS, 4)) +
+                               " no%d" % i,
+                'price_cents': i % 20 * 100 + 99,
+                'course': 'Entree',
+                'restaurant_id': i % restaurants + 1})
+            if len(batch) == 10000:
+                conn.execute(MenuItem.__table__.insert(), batch)
+                batch = []
+        if batch:
+            conn.execute(MenuItem.__table__.insert(), batch)
+
+
+def _like(engine, query, limit=LIMIT):
+    """What finding a dish costs without an index: a scan with LIKE."""
+    conditions = " AND ".join(
+        "(name LIKE :w%d OR description LIKE :w%d)" % (i, i)
+        for i in range(len(tokenize(query))))
+    params = dict(('w%d' % i, '%' + word + '%')
+                  for i, word in enumerate(tokenize(query)))
+    params['limit'] = limit
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT id FROM menu_item WHERE %s LIMIT :limit" % conditions),
+            **params).fetchall()
+
+
+def _rss():
+    """Returns the peak resident set size of this process, in MB."""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times the search indexes on a scratch database")
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument('--restaurants', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    from sqlalchemy import create_engine
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_engine('sqlite:///' + path)
+    try:
+        start = time.time()
+        _seed(engine, args.items, args.restaurants)
+        print("seeded %d items in %.1f s" % (args.items, time.time() - start))
+
+        indexes = []
+        for name, make in (('fts5', FtsIndex), ('memory', MemoryIndex)):
+            rss = _rss()
+            start = time.time()
+            index = make(engine)
+            print("%-8s built in %6.1f s, peak RSS +%.0f MB" % (
+                name, time.time() - start, _rss() - rss))
+            indexes.append((name, index.search))
+        indexes.append(('LIKE', lambda query: _like(engine, query)))
+
+        queries = ['salmon', 'sal', 'spicy noodles', 'crispy chi bacon',
+                   'no123456', 'missing']
+        print("\n%-18s %12s %12s %12s" % (("query",) + tuple(
+            name + " (ms)" for name, search in indexes)))
+        for query in queries:
+            timings = []
+            for name, search in indexes:
+                best = None
+                for _ in range(args.repeat):
+                    start = time.time()
+                    search(query)
+                    elapsed = time.time() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best * 1000)
+            print("%-18s %12.2f %12.2f %12.2f" % ((query,) + tuple(timings)))
+
+        print("")
+        for name, index in (('fts5', FtsIndex(engine)),
+                            ('memory', indexes[1][1].__self__)):
+            start = time.time()
+            for i in range(100):
+                index.add('item', args.items + i + 1, "benchmark special",
+                          "with zebra", 1)
+            for i in range(100):
+                index.remove('item', args.items + i + 1)
+            print("%-8s add + remove: %.2f ms each" % (
+                name, (time.time() - start) / 200 * 1000))
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
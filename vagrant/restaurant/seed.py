@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+# seed.py -- bulk loading of restaurants and menu items
+#
+# Rows are inserted through SQLAlchemy Core, BATCH_SIZE rows per
+# executemany() and COMMIT_ROWS rows per transaction, with SQLite tuned for
+# loading while it runs: no fsync and, unless the database is in WAL mode,
+# the rollback journal in memory. Large loads drop the menu_item indexes
+# first and build them again at the end, which is much faster than updating
+# them row by row. The search index, if the database has one, is rebuilt
+# afterwards.
+#
+# Usage:
+#   python seed.py fixture menus.json [--db restaurantmenu.db]
+#     loads the restaurants and menus of a JSON, YAML or CSV file.
+#   python seed.py generate --items 10000000 [--restaurants 100000]
+#     loads random menus with that many items.
+
+import argparse
+import csv
+import io
+import json
+import random
+import time
+
+from sqlalchemy import create_engine, inspect
+
+from database_setup import MenuItem, Restaurant, migrate, newVersion, parsePrice
+
+# Rows per executemany() and per transaction.
+BATCH_SIZE = 20000
+COMMIT_ROWS = 1000000
+
+# Loads of at least this many items rebuild the menu_item indexes instead
+# of updating them.
+REINDEX_ITEMS = 100000
+
+# Settings of the connection while it loads. Durability is not needed: a
+# load that fails is run again.
+LOAD_PRAGMAS = (
+    ('synchronous', 'OFF'),
+    ('journal_mode', 'MEMORY'),
+    ('cache_size', '-262144'),
+    ('temp_store', 'MEMORY'),
+)
+
+# Those set while loading a database in WAL mode, see sqlitedb.py. It keeps
+# its journal: changing it fails while the servers have it open.
+WAL_LOAD_PRAGMAS = ('synchronous', 'cache_size')
+
+# The columns of a CSV fixture, one line per menu item.
+CSV_COLUMNS = ('restaurant', 'name', 'description', 'price', 'course')
+
+
+def readFixture(path):
+    """Reads restaurants and their menus from a file.
+
+    A .json or .yaml file holds {"restaurants": [{"name": ..., "items":
+    [{"name": ..., "description": ..., "price": "$7.50", "course": ...}]}]};
+    YAML needs PyYAML. A .csv file has a header line of CSV_COLUMNS and a
+    line per menu item, its restaurant named in the first column.
+
+    Returns:
+      A list of (restaurant name, list of item dicts) pairs.
+
+    Raises:
+      ValueError: if the file is of another kind.
+    """
+    if path.endswith('.csv'):
+        menus = []
+        byName = {}
+        with open(path, 'rb') as f:
+            for row in csv.DictReader(f):
+                row = dict((key, value.decode('utf-8'))
+                           for key, value in row.items())
+                name = row.pop('restaurant')
+                if name not in byName:
+                    byName[name] = []
+                    menus.append((name, byName[name]))
+                byName[name].append(row)
+        return menus
+    with io.open(path, encoding='utf-8') as f:
+        if path.endswith('.json'):
+            data = json.load(f)
+        elif path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Reading %s needs PyYAML" % path)
+            data = yaml.safe_load(f)
+        else:
+            raise ValueError("Unknown fixture format: %s" % path)
+    return [(restaurant['name'], restaurant.get('items', []))
+            for restaurant in data['restaurants']]
+
+
+# Words the random menus are made from.
+_ADJECTIVES = ("Grilled Crispy Spicy Smoked Roasted Fried Fresh Sweet Sour "
+               "Tangy Creamy Garlic Herbed Honey Glazed").split()
+_DISHES = ("Burger Chicken Salad Pizza Noodles Tacos Sandwich Soup Curry "
+           "Steak Salmon Dumplings Pancakes Risotto Omelette").split()
+_EXTRAS = ("lettuce tomato cheese bacon avocado mushrooms onions peppers "
+           "rice beans basil lemon ginger sesame").split()
+_COURSES = ('Appetizer', 'Entree', 'Dessert', 'Beverage')
+
+
+def generateMenus(items, restaurants, seed=1):
+    """Yields random restaurants and menus, as readFixture() returns them,
+    with items menu items spread evenly over restaurants restaurants."""
+    rng = random.Random(seed)
+    # Choosing among prepared strings is much cheaper than building each.
+    names = ["%s %s" % (a, d) for a in _ADJECTIVES for d in _DISHES]
+    descriptions = ["with %s, %s and %s" % tuple(rng.sample(_EXTRAS, 3))
+                    for _ in range(1000)]
+    choice = rng.choice
+    uniform = rng.random
+    for n in range(restaurants):
+        count = items // restaurants + (n < items % restaurants)
+        yield ("%s %s House %d" % (choice(_ADJECTIVES), choice(_DISHES), n),
+               ({'name': choice(names),
+                 'description': choice(descriptions),
+                 'price_cents': int(uniform() * 3000) + 99,
+                 'course': choice(_COURSES)} for _ in range(count)))
+
+
+def seed(engine, menus, reindex=False, batchSize=BATCH_SIZE,
+         commitRows=COMMIT_ROWS):
+    """Adds restaurants and menus to a database.
+
+    Args:
+      engine: the database.
+      menus: (restaurant name, iterable of item dicts) pairs, as from
+        readFixture() or generateMenus(). An item has a name and maybe a
+        description, course and either a price, like "$7.50", or a
+        price_cents.
+      reindex: drop the menu_item indexes during the load and build them
+        again afterwards.
+      batchSize: rows inserted per executemany().
+      commitRows: rows inserted per transaction.
+
+    Returns:
+      A dict of the number of restaurants and items added and the seconds
+      spent inserting, indexing and rebuilding the search index.
+
+    Raises:
+      ValueError: if a price cannot be read. Nothing of the transaction
+        it is in is kept.
+    """
+    migrate(engine)
+    # One version for every item loaded, so none is taken for an item of
+    # the same id cached before.
+    version = newVersion(None)
+    stats = {'restaurants': 0, 'items': 0, 'insert': 0.0, 'index': 0.0,
+             'search': 0.0}
+    restaurantInsert = Restaurant.__table__.insert()
+    itemInsert = MenuItem.__table__.insert()
+    indexes = list(MenuItem.__table__.indexes)
+    with engine.connect() as conn:
+        pragmas = LOAD_PRAGMAS
+        if conn.execute("PRAGMA journal_mode").scalar().lower() == 'wal':
+            pragmas = [(name, value) for name, value in pragmas
+                       if name in WAL_LOAD_PRAGMAS]
+        saved = [(name, conn.execute("PRAGMA %s" % name).scalar())
+                 for name, value in pragmas]
+        for name, value in pragmas:
+            conn.execute("PRAGMA %s = %s" % (name, value))
+        transaction = None
+        try:
+            start = time.time()
+            if reindex:
+                existing = set(index['name'] for index in
+                               inspect(conn).get_indexes('menu_item'))
+                for index in indexes:
+                    if index.name in existing:
+                        index.drop(conn)
+            # SQLite numbers the rows, in the transaction inserting them, so
+            # rows written by others in between never collide with these.
+            items = []
+            uncommitted = 0
+            transaction = conn.begin()
+            for name, menu in menus:
+                restaurantId = conn.execute(
+                    restaurantInsert, {'name': name}).inserted_primary_key[0]
+                uncommitted += 1
+                for item in menu:
+                    if 'price_cents' in item:
+                        cents = item['price_cents']
+                    else:
+                        cents = parsePrice(item.get('price'))
+                    items.append({'name': item['name'],
+                                  'description': item.get('description'),
+                                  'price_cents': cents,
+                                  'course': item.get('course'),
+                                  'restaurant_id': restaurantId,
+                                  'version': version})
+                    if len(items) == batchSize:
+                        conn.execute(itemInsert, items)
+                        stats['items'] += len(items)
+                        uncommitted += len(items)
+                        items = []
+                        if uncommitted >= commitRows:
+                            transaction.commit()
+                            transaction = conn.begin()
+                            uncommitted = 0
+                stats['restaurants'] += 1
+            if items:
+                conn.execute(itemInsert, items)
+                stats['items'] += len(items)
+            transaction.commit()
+            stats['insert'] = time.time() - start
+            if reindex:
+                start = time.time()
+                for index in indexes:
+                    index.create(conn)
+                stats['index'] = time.time() - start
+        finally:
+            # Left open by a load that failed; the pragmas cannot be set
+            # back inside it.
+            if transaction is not None and transaction.is_active:
+                transaction.rollback()
+            for name, value in saved:
+                conn.execute("PRAGMA %s = %s" % (name, value))
+    if 'search_index' in inspect(engine).get_table_names():
+        import search
+        start = time.time()
+        search.FtsIndex(engine).rebuild()
+        stats['search'] = time.time() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Loads restaurants and menus in bulk")
+    parser.add_argument('--db', default='restaurantmenu.db',
+                        help="the SQLite database to load into")
+    commands = parser.add_subparsers(dest='command')
+    fixture = commands.add_parser('fixture', help="load a data file")
+    fixture.add_argument('path', help="a .json, .yaml or .csv file")
+    generate = commands.add_parser('generate', help="load random menus")
+    generate.add_argument('--items', type=int, default=1000000)
+    generate.add_argument('--restaurants', type=int, default=None,
+                          help="default: one per 100 items")
+    generate.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    engine = create_engine('sqlite:///' + args.db)
+    if args.command == 'fixture':
+        menus = readFixture(args.path)
+        reindex = sum(len(items) for name, items in menus) >= REINDEX_ITEMS
+    else:
+        restaurants = args.restaurants or max(1, args.items // 100)
+        menus = generateMenus(args.items, restaurants, args.seed)
+        reindex = args.items >= REINDEX_ITEMS
+    start = time.time()
+    stats = seed(engine, menus, reindex)
+    elapsed = time.time() - start
+    print("added %d restaurants and %d items in %.1f s (%.0f items/s)" % (
+        stats['restaurants'], stats['items'], elapsed,
+        stats['items'] / elapsed if elapsed else 0))
+    print("  insert %.1f s, indexes %.1f s, search index %.1f s" % (
+        stats['insert'], stats['index'], stats['search']))
+
+
+if __name__ == '__main__':
+    main()
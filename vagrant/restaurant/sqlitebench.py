@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# sqlitebench.py -- the default and the tuned SQLite setup under load
+#
+# Usage: python sqlitebench.py [--threads 8] [--seconds 5] [--writes 0.1]
+#   runs a mixed read/write workload against create_engine()'s defaults and
+#   sqlitedb.Database on a scratch database.
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from database_setup import MenuItem
+from loadtest import percentile
+from repository import getMenu
+import seed
+from sqlitedb import Database
+
+
+def _worker(session, restaurants, writes, deadline, seed, results):
+    """Runs requests until deadline: a menu written with probability
+    writes, read otherwise. Appends (latency, wrote, failed) tuples."""
+    rng = random.Random(seed)
+    samples = []
+    while time.time() < deadline:
+        wrote = rng.random() < writes
+        start = time.time()
+        try:
+            restaurantId = rng.randint(1, restaurants)
+            if wrote:
+                session.add(MenuItem(name="Special", price_cents=999,
+                                     course='Entree',
+                                     restaurant_id=restaurantId))
+                session.commit()
+            else:
+                len(getMenu(session, restaurantId).items)
+            failed = False
+        except OperationalError:
+            session.rollback()
+            failed = True
+        finally:
+            session.remove()
+        samples.append((time.time() - start, wrote, failed))
+    results.extend(samples)
+
+
+def _run(session, restaurants, threads, seconds, writes):
+    """Runs threads _workers against session for seconds.
+
+    Returns (read latencies, write latencies, failures); the latencies
+    sorted, in seconds, of the requests that succeeded."""
+    results = []
+    deadline = time.time() + seconds
+    workers = [threading.Thread(target=_worker, args=(
+        session, restaurants, writes, deadline, n, results))
+        for n in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    reads = sorted(t for t, wrote, failed in results
+                   if not wrote and not failed)
+    written = sorted(t for t, wrote, failed in results if wrote and not failed)
+    return reads, written, sum(failed for t, wrote, failed in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compares the default and the tuned SQLite setup under "
+                    "a mixed read/write workload")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--writes', type=float, default=0.1,
+                        help="the fraction of requests that write")
+    parser.add_argument('--restaurants', type=int, default=1000)
+    parser.add_argument('--items', type=int, default=50000)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    template = os.path.join(directory, 'template.db')
+    seed.seed(create_engine('sqlite:///' + template),
+              seed.generateMenus(args.items, args.restaurants))
+
+    print("%-8s %7s %9s %9s %8s %9s %9s %9s" % (
+        "setup", "threads", "reads/s", "writes/s", "failed", "read p50",
+        "read p99", "write p99"))
+    try:
+        for threads in args.threads:
+            for label in ('default', 'tuned'):
+                path = os.path.join(directory, '%s.db' % label)
+                shutil.copy(template, path)
+                if label == 'default':
+                    engine = create_engine('sqlite:///' + path)
+                    session = scoped_session(sessionmaker(bind=engine))
+                    engines = [engine]
+                else:
+                    database = Database(path)
+                    session = database.session
+                    engines = [database.reader, database.writer]
+                reads, written, failed = _run(
+                    session, args.restaurants, threads, args.seconds,
+                    args.writes)
+                for engine in engines:
+                    engine.dispose()
+                print("%-8s %7d %9.0f %9.0f %8d %7.1fms %7.1fms %7.1fms" % (
+                    label, threads, len(reads) / args.seconds,
+                    len(written) / args.seconds, failed,
+                    percentile(reads, 50) * 1000,
+                    percentile(reads, 99) * 1000,
+                    percentile(written, 99) * 1000))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
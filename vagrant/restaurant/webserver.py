@@ -1,166 +1,445 @@
 from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import argparse
 import cgi
+import json
+from StringIO import StringIO
+import urlparse
 
 # import CRUD Operations from Lesson 1
-from database_setup import Base, Restaurant, MenuItem
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from database_setup import Base, Restaurant, MenuItem, migrate
+from sqlalchemy.orm.exc import NoResultFound
 
-# Create session and connect to DB
-engine = create_engine('sqlite:///restaurantmenu.db')
+from cache import ResponseCache
+from router import MethodNotAllowed, NotFound, Router
+from search import openIndex
+from sqlitedb import Database
+
+# Create session and connect to DB. Reads and writes go through separate
+# connection pools shared by the request threads; see sqlitedb.py.
+database = Database('restaurantmenu.db')
+engine = database.writer
+migrate(engine)
 Base.metadata.bind = engine
-DBSession = sessionmaker(bind=engine)
-session = DBSession()
+# Every thread gets its own session from the registry; it is discarded at
+# the end of each request, see webServerHandler.handle_one_request().
+session = database.session
+
+# Maps every (method, path) to one handler method of webServerHandler; see
+# the @router.route() decorators below.
+router = Router()
+
+# Rendered pages, dropped by the handlers that change what they show. The
+# listing is tagged 'restaurants'; see restaurantList().
+cache = ResponseCache()
+
+# Restaurant names, kept up to date by the handlers below; searched by
+# project.py's /search.
+searchIndex = openIndex(engine, database.reader)
+
+
+# Restaurants read from the database per batch, and bytes of HTML sent per
+# chunk, by the streamed /restaurants listing.
+LIST_BATCH_SIZE = 1000
+CHUNK_SIZE = 16384
+
+# Request bodies no handler read are read and dropped up to this size, so
+# the next request on the connection starts where it should; the
+# connection is closed after larger ones.
+MAX_DISCARD = 1024 * 1024
+
+
+class ChunkedWriter(object):
+    """Buffers a streamed response and writes it out in chunks.
+
+    With chunked set, every chunk is framed for Transfer-Encoding: chunked
+    and close() writes the terminating empty chunk; otherwise the bytes
+    are written as they are and the connection must be closed afterwards.
+
+    With capture set, the body is also kept in captured, to be cached,
+    until it grows past that many bytes; captured is None after that.
+    """
+
+    def __init__(self, wfile, chunked=True, size=CHUNK_SIZE, capture=0):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.size = size
+        self.parts = []
+        self.buffered = 0
+        self.capture = capture
+        self.captured = [] if capture else None
+
+    def write(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.parts.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        data = "".join(self.parts)
+        if self.captured is not None:
+            self.capture -= len(data)
+            self.captured.append(data)
+            if self.capture < 0:
+                self.captured = None
+        if self.chunked:
+            data = "%x\r\n%s\r\n" % (len(data), data)
+        self.wfile.write(data)
+        self.parts = []
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+        if self.chunked:
+            self.wfile.write("0\r\n\r\n")
 
 
 class webServerHandler(BaseHTTPRequestHandler):
 
+    # Persistent connections, and chunked responses for streamed pages.
+    protocol_version = 'HTTP/1.1'
+
+    def handle_one_request(self):
+        try:
+            BaseHTTPRequestHandler.handle_one_request(self)
+        finally:
+            # Hand the connection back to the pool and forget the objects
+            # loaded by this request.
+            session.remove()
+
     def do_GET(self):
+        self.dispatch('GET')
+
+    # Objective 3 Step 3- Make POST method
+    def do_POST(self):
+        self.dispatch('POST')
+
+    # No route takes these, but they get a 405 with the allowed methods
+    # rather than BaseHTTPServer's 501.
+    def do_PUT(self):
+        self.dispatch('PUT')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def dispatch(self, method):
+        """Runs the one handler routed for the method and path."""
+        url = urlparse.urlsplit(self.path)
+        path = url.path
+        self.query = urlparse.parse_qs(url.query)
+        self.bodyRead = False
         try:
-            # Objective 3 Step 2 - Create /restarants/new page
-            if self.path.endswith("/restaurants/new"):
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                output = ""
-                output += "<html><body>"
-                output += "<h1>Make a New Restaurant</h1>"
-                output += "<form method = 'POST' enctype='multipart/form-data' action = '/restaurants/new'>"
-                output += "<input name = 'newRestaurantName' type = 'text' placeholder = 'New Restaurant Name' > "
-                output += "<input type='submit' value='Create'>"
-                output += "</form></html></body>"
-                self.wfile.write(output)
+            try:
+                handler, parameters = router.match(method, path)
+            except NotFound:
+                self.send_error(404, 'File Not Found: %s' % path)
                 return
-            if self.path.endswith("/edit"):
-                restaurantIDPath = self.path.split("/")[2]
-                myRestaurantQuery = session.query(Restaurant).filter_by(
-                    id=restaurantIDPath).one()
-                if myRestaurantQuery:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    output = "<html><body>"
-                    output += "<h1>"
-                    output += myRestaurantQuery.name
-                    output += "</h1>"
-                    output += "<form method='POST' enctype='multipart/form-data' action = '/restaurants/%s/edit' >" % restaurantIDPath
-                    output += "<input name = 'newRestaurantName' type='text' placeholder = '%s' >" % myRestaurantQuery.name
-                    output += "<input type = 'submit' value = 'Rename'>"
-                    output += "</form>"
-                    output += "</body></html>"
-
-                    self.wfile.write(output)
-            if self.path.endswith("/delete"):
-                restaurantIDPath = self.path.split("/")[2]
-                myRestaurantQuery = session.query(Restaurant).filter_by(
-                    id=restaurantIDPath).one()
-                if myRestaurantQuery:
-                    self.send_response(200)
-                    self.send_header('Content-type', 'text/html')
-                    self.end_headers()
-                    output = "<html><body>"
-                    output += "<h1>"
-                    output += myRestaurantQuery.name
-                    output += "</h1>"
-                    output += "<form method='POST' enctype='multipart/form-data' action = '/restaurants/%s/delete' >" % restaurantIDPath
-                    output += "<h2> Are you sure you want to delete %s </h2><br> " % myRestaurantQuery.name
-                    output += "<input type = 'submit' value = 'Delete'>"
-                    output += "</form>"
-                    output += "</body></html>"
-
-                    self.wfile.write(output)
-
-            if self.path.endswith("/restaurants"):
-                restaurants = session.query(Restaurant).all()
-                output = ""
-                # Objective 3 Step 1 - Create a Link to create a new menu item
-                output += "<a href = '/restaurants/new' > Make a New Restaurant Here </a></br></br>"
-
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
+            except MethodNotAllowed as e:
+                self.send_response(405)
+                self.send_header('Allow', ", ".join(e.allowed))
+                self.send_header('Content-Length', '0')
                 self.end_headers()
-                output += "<html><body>"
-                for restaurant in restaurants:
-                    output += restaurant.name
-                    output += "</br>"
-                    # Objective 2 -- Add Edit and Delete Links
-                    # Objective 4 -- Replace Edit href
-                    output += "<a href ='/restaurants/%s/edit' >Edit </a> " % restaurant.id
-                    output += "</br>"
-                    output += "<a href ='/restaurants/%s/delete' >Delete </a> " % restaurant.id
-                    output += "</br></br></br>"
-
-                output += "</body></html>"
-                self.wfile.write(output)
                 return
-        except IOError:
-            self.send_error(404, 'File Not Found: %s' % self.path)
+            try:
+                handler(self, **parameters)
+            except NoResultFound:
+                self.send_error(404, 'File Not Found: %s' % path)
+        finally:
+            # Whatever was answered, the body must not be taken for the
+            # next request.
+            self.discardBody()
 
-    # Objective 3 Step 3- Make POST method
-    def do_POST(self):
+    def readBody(self):
+        """Returns the request body, of Content-Length bytes."""
+        self.bodyRead = True
+        length = int(self.headers.getheader('content-length') or 0)
+        return self.rfile.read(length)
+
+    def discardBody(self):
+        """Reads and drops the request body if it was not read, or closes
+        the connection after this response if it is too large or its size
+        is unknown."""
+        if self.bodyRead:
+            return
+        self.bodyRead = True
+        if self.headers.getheader('transfer-encoding'):
+            self.close_connection = 1
+            return
+        try:
+            length = int(self.headers.getheader('content-length') or 0)
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_DISCARD:
+            self.close_connection = 1
+            return
+        while length > 0:
+            data = self.rfile.read(min(length, CHUNK_SIZE))
+            if not data:
+                break
+            length -= len(data)
+
+    def sendPage(self, output, contentType='text/html', etag=None):
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', contentType)
+        self.send_header('Content-Length', str(len(output)))
+        if etag is not None:
+            # Browsers revalidate every time, and get a 304 while the page
+            # is unchanged.
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(output)
+
+    def sendCached(self, key):
+        """Answers from the cache if it has the page.
+
+        Returns:
+          True if the page was sent, with a 304 when the client's
+          If-None-Match names it; False if the handler has to render it.
+        """
+        ifNoneMatch = self.headers.getheader('if-none-match')
+        entry = cache.get(key, ifNoneMatch)
+        if entry is None:
+            return False
+        if entry.matches(ifNoneMatch):
+            self.send_response(304)
+            self.send_header('ETag', entry.etag)
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+        else:
+            self.sendPage(entry.body, entry.contentType, entry.etag)
+        return True
+
+    def startStream(self, capture=0):
+        """Sends the headers of a streamed HTML page and returns the
+        ChunkedWriter to write its body to, capturing up to capture bytes
+        of it."""
+        # HTTP/1.0 clients cannot read chunks: send the body as it is and
+        # close the connection to mark its end.
+        chunked = self.request_version != 'HTTP/1.0'
+        self.send_response(200)
+        self.send_header('Content-type', 'text/html')
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        self.end_headers()
+        return ChunkedWriter(self.wfile, chunked, capture=capture)
+
+    def queryInt(self, name):
+        """Returns an integer query parameter, None if it is missing.
+
+        Raises:
+          ValueError: if it is not a non-negative integer.
+        """
+        values = self.query.get(name)
+        if not values:
+            return None
+        if not values[0].isdigit():
+            raise ValueError("%s should be a non-negative integer" % name)
+        return int(values[0])
+
+    def redirect(self, location):
+        self.send_response(301)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def formFields(self, *required):
+        """Returns the fields of a multipart form POST, or None after
+        answering 400 to any other request body or to a form without one
+        of the required fields."""
+        ctype, pdict = cgi.parse_header(
+            self.headers.getheader('content-type') or '')
+        if ctype != 'multipart/form-data':
+            self.send_error(400, 'Expected multipart/form-data')
+            return None
+        # Parsed from the whole body, so none of it is left unread.
+        fields = cgi.parse_multipart(StringIO(self.readBody()), pdict)
+        missing = [name for name in required if not fields.get(name)]
+        if missing:
+            self.send_error(400, 'Missing form fields: %s'
+                            % ', '.join(missing))
+            return None
+        return fields
+
+    @router.route('/restaurants')
+    def restaurantList(self):
+        """Lists the restaurants, streamed as they are read.
+
+        ?limit=N shows at most N restaurants and links to the next page,
+        which starts after the last id shown (?after=ID).
+        """
         try:
-            if self.path.endswith("/edit"):
-                ctype, pdict = cgi.parse_header(
-                    self.headers.getheader('content-type'))
-                if ctype == 'multipart/form-data':
-                    fields = cgi.parse_multipart(self.rfile, pdict)
-                    messagecontent = fields.get('newRestaurantName')
-                    restaurantIDPath = self.path.split("/")[2]
-
-                    myRestaurantQuery = session.query(Restaurant).filter_by(
-                        id=restaurantIDPath).one()
-                    if myRestaurantQuery != []:
-                        myRestaurantQuery.name = messagecontent[0]
-                        session.add(myRestaurantQuery)
-                        session.commit()
-                        self.send_response(301)
-                        self.send_header('Content-type', 'text/html')
-                        self.send_header('Location', '/restaurants')
-                        self.end_headers()
-            if self.path.endswith("/delete"):
-                ctype, pdict = cgi.parse_header(
-                    self.headers.getheader('content-type'))
-                if ctype == 'multipart/form-data':
-                    fields = cgi.parse_multipart(self.rfile, pdict)
-                    
-                    restaurantIDPath = self.path.split("/")[2]
-
-                    myRestaurantQuery = session.query(Restaurant).filter_by(
-                        id=restaurantIDPath).one()
-                    if myRestaurantQuery != []:
-                        
-                        session.delete(myRestaurantQuery)
-                        session.commit()
-                        self.send_response(301)
-                        self.send_header('Content-type', 'text/html')
-                        self.send_header('Location', '/restaurants')
-                        self.end_headers()
-
-            if self.path.endswith("/restaurants/new"):
-                ctype, pdict = cgi.parse_header(
-                    self.headers.getheader('content-type'))
-                if ctype == 'multipart/form-data':
-                    fields = cgi.parse_multipart(self.rfile, pdict)
-                    messagecontent = fields.get('newRestaurantName')
-
-                    # Create new Restaurant Object
-                    newRestaurant = Restaurant(name=messagecontent[0])
-                    session.add(newRestaurant)
-                    session.commit()
-
-                    self.send_response(301)
-                    self.send_header('Content-type', 'text/html')
-                    self.send_header('Location', '/restaurants')
-                    self.end_headers()
-
-        except:
-            pass
+            limit = self.queryInt('limit')
+            after = self.queryInt('after')
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        key = ('restaurants', limit, after)
+        if self.sendCached(key):
+            return
+        token = cache.begin()
+        restaurants = session.query(Restaurant.id, Restaurant.name).order_by(
+            Restaurant.id)
+        if after is not None:
+            restaurants = restaurants.filter(Restaurant.id > after)
+        if limit is not None:
+            restaurants = restaurants.limit(limit)
+
+        # The first request streams the page and caches it if it is small
+        # enough; the ETag is only known once it has been sent.
+        output = self.startStream(capture=cache.maxBytes // 4)
+        # Objective 3 Step 1 - Create a Link to create a new menu item
+        output.write("<a href = '/restaurants/new' > Make a New Restaurant Here </a></br></br>")
+        output.write("<html><body>")
+        shown = 0
+        last = None
+        for last, name in restaurants.yield_per(LIST_BATCH_SIZE):
+            output.write(name)
+            # Objective 2 -- Add Edit and Delete Links
+            # Objective 4 -- Replace Edit href
+            output.write("</br><a href ='/restaurants/%s/edit' >Edit </a> "
+                         "</br><a href ='/restaurants/%s/delete' >Delete </a> "
+                         "</br></br></br>" % (last, last))
+            shown += 1
+        if limit is not None and shown == limit:
+            output.write("<a href ='/restaurants?after=%s&limit=%s' >Next page</a>"
+                         % (last, limit))
+        output.write("</body></html>")
+        output.close()
+        if output.captured is not None:
+            cache.put(key, "".join(output.captured), 'text/html',
+                      ['restaurants'], token)
+
+    @router.route('/cache')
+    def cacheStats(self):
+        """Shows the cache counters and hit rate as JSON."""
+        self.sendPage(json.dumps(cache.stats(), sort_keys=True),
+                      'application/json')
+
+    # Objective 3 Step 2 - Create /restarants/new page
+    @router.route('/restaurants/new')
+    def restaurantNewForm(self):
+        output = ""
+        output += "<html><body>"
+        output += "<h1>Make a New Restaurant</h1>"
+        output += "<form method = 'POST' enctype='multipart/form-data' action = '/restaurants/new'>"
+        output += "<input name = 'newRestaurantName' type = 'text' placeholder = 'New Restaurant Name' > "
+        output += "<input type='submit' value='Create'>"
+        output += "</form></html></body>"
+        self.sendPage(output)
+
+    @router.route('/restaurants/new', methods=['POST'])
+    def restaurantNew(self):
+        fields = self.formFields('newRestaurantName')
+        if fields is None:
+            return
+        messagecontent = fields['newRestaurantName']
+
+        # Create new Restaurant Object
+        newRestaurant = Restaurant(name=messagecontent[0])
+        session.add(newRestaurant)
+        session.commit()
+        cache.invalidate('restaurants')
+        searchIndex.add('restaurant', newRestaurant.id, newRestaurant.name)
+        self.redirect('/restaurants')
+
+    @router.route('/restaurants/<int:restaurant_id>/edit')
+    def restaurantEditForm(self, restaurant_id):
+        myRestaurantQuery = session.query(Restaurant).filter_by(
+            id=restaurant_id).one()
+        output = "<html><body>"
+        output += "<h1>"
+        output += myRestaurantQuery.name
+        output += "</h1>"
+        output += "<form method='POST' enctype='multipart/form-data' action = '/restaurants/%s/edit' >" % restaurant_id
+        output += "<input name = 'newRestaurantName' type='text' placeholder = '%s' >" % myRestaurantQuery.name
+        output += "<input type = 'submit' value = 'Rename'>"
+        output += "</form>"
+        output += "</body></html>"
+        self.sendPage(output)
+
+    @router.route('/restaurants/<int:restaurant_id>/edit', methods=['POST'])
+    def restaurantEdit(self, restaurant_id):
+        fields = self.formFields('newRestaurantName')
+        if fields is None:
+            return
+        messagecontent = fields['newRestaurantName']
+        myRestaurantQuery = session.query(Restaurant).filter_by(
+            id=restaurant_id).one()
+        myRestaurantQuery.name = messagecontent[0]
+        session.add(myRestaurantQuery)
+        session.commit()
+        cache.invalidate('restaurants', ('restaurant', restaurant_id))
+        searchIndex.add('restaurant', restaurant_id, myRestaurantQuery.name)
+        self.redirect('/restaurants')
+
+    @router.route('/restaurants/<int:restaurant_id>/delete')
+    def restaurantDeleteForm(self, restaurant_id):
+        myRestaurantQuery = session.query(Restaurant).filter_by(
+            id=restaurant_id).one()
+        output = "<html><body>"
+        output += "<h1>"
+        output += myRestaurantQuery.name
+        output += "</h1>"
+        output += "<form method='POST' enctype='multipart/form-data' action = '/restaurants/%s/delete' >" % restaurant_id
+        output += "<h2> Are you sure you want to delete %s </h2><br> " % myRestaurantQuery.name
+        output += "<input type = 'submit' value = 'Delete'>"
+        output += "</form>"
+        output += "</body></html>"
+        self.sendPage(output)
+
+    @router.route('/restaurants/<int:restaurant_id>/delete', methods=['POST'])
+    def restaurantDelete(self, restaurant_id):
+        fields = self.formFields()
+        if fields is None:
+            return
+        myRestaurantQuery = session.query(Restaurant).filter_by(
+            id=restaurant_id).one()
+        # Its items are left without a restaurant: no longer found either.
+        itemIds = [item.id for item in myRestaurantQuery.items]
+        session.delete(myRestaurantQuery)
+        session.commit()
+        cache.invalidate('restaurants', ('restaurant', restaurant_id))
+        searchIndex.remove('restaurant', restaurant_id)
+        searchIndex.remove('item', *itemIds)
+        self.redirect('/restaurants')
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    """Handles every request in its own thread."""
+    daemon_threads = True
+    request_queue_size = 128
+
+
+# No process per request: the children would inherit the open SQLite
+# connections of the pools, which must not cross a fork(), and the cache
+# and search index updates they made would die with them.
+SERVERS = {
+    'single': HTTPServer,
+    'thread': ThreadedHTTPServer,
+}
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Restaurant web server")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--mode', default='thread', choices=sorted(SERVERS),
+                        help="how requests are served: one at a time or "
+                             "one thread each")
+    args = parser.parse_args()
     try:
-        server = HTTPServer(('', 8080), webServerHandler)
-        print 'Web server running...open localhost:8080/restaurants in your browser'
+        server = SERVERS[args.mode](('', args.port), webServerHandler)
+        print 'Web server running...open localhost:%d/restaurants in your browser' % args.port
         server.serve_forever()
     except KeyboardInterrupt:
         print '^C received, shutting down server'
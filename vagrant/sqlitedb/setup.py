@@ -0,0 +1,9 @@
+from setuptools import setup
+
+setup(
+    name='sqlitedb',
+    version='1.0',
+    description="SQLite engines and sessions tuned for concurrent requests",
+    py_modules=['sqlitedb'],
+    install_requires=['SQLAlchemy'],
+)
@@ -0,0 +1,156 @@
+# sqlitedb.py -- SQLite engines and sessions tuned for concurrent requests
+#
+# With create_engine()'s defaults a SQLite database keeps its rollback
+# journal: a writer has to wait for every reader to finish before it can
+# commit, and gives up with "database is locked" after 5 seconds. Database
+# opens the file in WAL mode instead, where readers never block the writer
+# nor it them, and every connection is set up by PRAGMAS as it is opened.
+#
+# Reads and writes go through separate pools. Readers are many query_only
+# connections; writes go through a single connection whose transactions
+# take the write lock up front, so concurrent writers queue for it in the
+# pool rather than deadlocking on the lock halfway through. The sessions of
+# Database.session pick the pool for every statement themselves; see
+# RoutingSession.
+#
+# Shared by the restaurant app and the Puppies scripts; install it with
+# "pip install -e vagrant/sqlitedb" (vagrant/pg_config.sh does so in the VM).
+# vagrant/restaurant/sqlitebench.py measures it against create_engine()'s
+# defaults.
+
+from collections import OrderedDict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import UpdateBase
+
+# Seconds to wait for the write lock, or for a connection of a pool, before
+# failing.
+BUSY_TIMEOUT = 15
+
+# Set on every connection as it is opened, in this order.
+PRAGMAS = OrderedDict([
+    # Readers see the last commit while a writer appends to the log.
+    ('journal_mode', 'WAL'),
+    # In WAL mode a commit survives a crash of the application without
+    # an fsync; the log is synced at checkpoints.
+    ('synchronous', 'NORMAL'),
+    # Read pages straight from the OS page cache, up to 256 MB of the file.
+    ('mmap_size', 256 * 1024 * 1024),
+    # 32 MB of page cache per connection, instead of 2 MB.
+    ('cache_size', -32 * 1024),
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', BUSY_TIMEOUT * 1000),
+])
+
+# Connections kept in the read pool, and opened beyond them when it is busy.
+READ_POOL_SIZE = 8
+READ_MAX_OVERFLOW = 16
+
+
+def createEngine(path, readOnly=False, pragmas=PRAGMAS,
+                 poolSize=READ_POOL_SIZE, maxOverflow=READ_MAX_OVERFLOW):
+    """Returns an engine of the SQLite database at path, shared by threads.
+
+    Args:
+      path: the database file.
+      readOnly: make every connection query_only. Otherwise the engine has
+        a single connection, and its transactions start with BEGIN
+        IMMEDIATE.
+      pragmas: the settings of every connection.
+      poolSize, maxOverflow: the size of the pool of a readOnly engine.
+    """
+    if not readOnly:
+        poolSize, maxOverflow = 1, 0
+    engine = create_engine('sqlite:///' + path, poolclass=QueuePool,
+                           pool_size=poolSize, max_overflow=maxOverflow,
+                           pool_timeout=BUSY_TIMEOUT,
+                           connect_args={'check_same_thread': False,
+                                         'timeout': BUSY_TIMEOUT})
+
+    @event.listens_for(engine, 'connect')
+    def connect(dbapiConnection, record):
+        cursor = dbapiConnection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (name, value))
+        if readOnly:
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            # pysqlite would only BEGIN before the first INSERT, UPDATE or
+            # DELETE; the 'begin' listener below does it instead.
+            dbapiConnection.isolation_level = None
+        cursor.close()
+
+    if not readOnly:
+        @event.listens_for(engine, 'begin')
+        def begin(conn):
+            conn.execute("BEGIN IMMEDIATE")
+
+    return engine
+
+
+class RoutingSession(Session):
+    """A session reading through one engine and writing through another.
+
+    Statements go to the reader until the session flushes or executes an
+    INSERT, UPDATE or DELETE; from then on, until it commits or rolls
+    back, they all go to the writer, so the transaction reads what it has
+    written.
+    """
+
+    def __init__(self, reader=None, writer=None, **kwargs):
+        Session.__init__(self, **kwargs)
+        self.reader = reader
+        self.writer = writer
+        self.writing = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.writing = True
+        return self.writer if self.writing else self.reader
+
+    def commit(self):
+        Session.commit(self)
+        self.writing = False
+
+    def rollback(self):
+        try:
+            Session.rollback(self)
+        finally:
+            self.writing = False
+
+    def close(self):
+        try:
+            Session.close(self)
+        finally:
+            self.writing = False
+
+
+class Database(object):
+    """A SQLite database opened for many threads.
+
+    Attributes:
+      reader: the engine reading the database, see createEngine().
+      writer: the engine writing it.
+      session: a scoped_session of RoutingSessions over both; every thread
+        gets its own, to be discarded with session.remove() at the end of
+        each request.
+    """
+
+    def __init__(self, path, pragmas=PRAGMAS, readers=READ_POOL_SIZE):
+        self.path = path
+        # The writer first, so WAL mode is set without readers around.
+        self.writer = createEngine(path, pragmas=pragmas)
+        self.reader = createEngine(path, readOnly=True, pragmas=pragmas,
+                                   poolSize=readers)
+        self.session = scoped_session(sessionmaker(
+            class_=RoutingSession, reader=self.reader, writer=self.writer))
+        with self.writer.connect():
+            pass
+
+    def dispose(self):
+        """Closes every connection."""
+        self.session.remove()
+        self.reader.dispose()
+        self.writer.dispose()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# aiotournament.py -- asyncio version of the tournament.py API
+#
+# The same functions as tournament.py, as coroutines running on aiopg, so a
+# server can handle many score submissions at once without a thread per
+# request. The SQL comes from queries.py and the pairing logic from
+# tournament.py, so both APIs always behave the same.
+#
+# Requires Python 3.5+ and aiopg ("pip install aiopg").
+
+import asyncio
+
+import aiopg
+
+import queries
+import tournament
+from tournament import DEFAULT_TOURNAMENT
+
+# A future of the shared aiopg pool, so that coroutines asking for the pool
+# while it is being created all wait for the same one.
+_pool = None
+
+
+async def configurePool(minconn=tournament.POOL_MIN_SIZE,
+                        maxconn=tournament.POOL_MAX_SIZE, **kwargs):
+    """(Re)creates the connection pool, closing any existing one.
+
+    Args:
+      minconn: number of connections opened up front.
+      maxconn: maximum number of connections open at the same time.
+      kwargs: extra arguments for aiopg.create_pool (timeout, ...).
+    """
+    global _pool
+    await closePool()
+    _pool = asyncio.ensure_future(
+        aiopg.create_pool(tournament.DSN, minsize=minconn, maxsize=maxconn,
+                          **kwargs))
+    await _pool
+
+
+async def getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        _pool = asyncio.ensure_future(
+            aiopg.create_pool(tournament.DSN,
+                              minsize=tournament.POOL_MIN_SIZE,
+                              maxsize=tournament.POOL_MAX_SIZE))
+    return await _pool
+
+
+async def closePool():
+    """Closes the pool; call it before the event loop ends.
+
+    The next call opens a new pool.
+    """
+    global _pool
+    if _pool is not None:
+        pool, _pool = await _pool, None
+        pool.close()
+        await pool.wait_closed()
+
+
+async def _run(statements, fetch=None):
+    """Runs (query, parameters) pairs in one transaction on a pooled
+    connection and returns the rows of the last one.
+
+    fetch is None to return nothing, 'one' or 'all'.
+    """
+    pool = await getPool()
+    async with pool.acquire() as db:
+        async with db.cursor() as cursor:
+            # aiopg connections are in autocommit mode; several statements
+            # need an explicit transaction.
+            if len(statements) > 1:
+                async with cursor.begin():
+                    for query, parameters in statements:
+                        await cursor.execute(query, parameters)
+            else:
+                await cursor.execute(*statements[0])
+            if fetch == 'one':
+                return await cursor.fetchone()
+            if fetch == 'all':
+                return await cursor.fetchall()
+
+
+async def createTournament(name):
+    """Adds a tournament and returns its id."""
+    row = await _run([(queries.CREATE_TOURNAMENT, (name,))], 'one')
+    return row[0]
+
+
+async def deleteTournament(tournamentId):
+    """Removes a tournament with all its players and matches."""
+    await _run([(queries.DELETE_TOURNAMENT, (tournamentId,))])
+
+
+async def deleteMatches(tournamentId=DEFAULT_TOURNAMENT):
+    """Remove all the match records of a tournament from the database."""
+    await _run([(queries.DELETE_MATCHES, (tournamentId,)),
+                (queries.RESET_PLAYER_STATS, (tournamentId,))])
+
+
+async def deletePlayers(tournamentId=DEFAULT_TOURNAMENT):
+    """Remove all the player records of a tournament from the database."""
+    await _run([(queries.DELETE_PLAYERS, (tournamentId,))])
+
+
+async def countPlayers(tournamentId=DEFAULT_TOURNAMENT):
+    """Returns the number of players currently registered."""
+    row = await _run([(queries.COUNT_PLAYERS, (tournamentId,))], 'one')
+    return row[0]
+
+
+async def registerPlayer(name, tournamentId=DEFAULT_TOURNAMENT):
+    """Adds a player to the tournament database."""
+    await _run([(queries.REGISTER_PLAYER, (tournamentId, name))])
+
+
+async def playerStandings(tournamentId=DEFAULT_TOURNAMENT):
+    """Returns a list of (id, name, wins, matches), sorted by wins."""
+    return await _run([(queries.STANDINGS, (tournamentId,))], 'all')
+
+
+async def reportMatch(winner, loser, tournamentId=DEFAULT_TOURNAMENT):
+    """Records the outcome of a single match between two players."""
+    await _run([(queries.REPORT_MATCH, (tournamentId, winner, loser))])
+
+
+async def reportMatches(results, tournamentId=DEFAULT_TOURNAMENT):
+    """Records the outcome of a whole round of matches in one statement.
+
+    Raises:
+      ValueError: if a player appears more than once in the round.
+    """
+    results = tournament.checkRound(results)
+    if results:
+        await _run([queries.reportMatches(results, tournamentId)])
+
+
+async def nextRound(tournamentId=DEFAULT_TOURNAMENT):
+    """Pairs the players for the next round, see tournament.nextRound()."""
+    players, results = await asyncio.gather(
+        _run([(queries.PAIRING_PLAYERS, (tournamentId,))], 'all'),
+        _run([(queries.PAIRING_MATCHES, (tournamentId,))], 'all'))
+    return tournament.pairStandings(players, results)
+
+
+async def swissPairings(tournamentId=DEFAULT_TOURNAMENT):
+    """Returns (id1, name1, id2, name2) for every pair of the next round."""
+    names, pairs = await nextRound(tournamentId)
+    return [(id1, names[id1], id2, names.get(id2)) for id1, id2 in pairs]
+
+
+async def swissPairingsId(tournamentId=DEFAULT_TOURNAMENT):
+    """Returns (id1, id2) for every pair of the next round."""
+    names, pairs = await nextRound(tournamentId)
+    return pairs
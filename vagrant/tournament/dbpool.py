@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# dbpool.py -- thread-safe psycopg2 connection pool used by tournament.py
+
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolError(psycopg2.Error):
+    """Raised when no connection could be checked out of the pool."""
+
+
+class ConnectionPool(object):
+    """A bounded pool of reusable psycopg2 connections.
+
+    minconn connections are opened up front and more are created lazily up
+    to maxconn; returned connections stay open for reuse. Checking out a
+    connection is safe from several threads at once: when the pool is
+    exhausted the caller waits until another thread returns one.
+
+    Args:
+      dsn: the libpq connection string, e.g. "dbname=tournament".
+      minconn: number of connections opened when the pool is created.
+      maxconn: maximum number of connections open at the same time.
+      timeout: seconds to wait for a free connection (None waits forever).
+      ping_after: connections idle for longer than this many seconds are
+        checked with a "SELECT 1" before being handed out. 0 checks every
+        checkout, None only checks that the connection is still open.
+    """
+
+    def __init__(self, dsn, minconn=1, maxconn=10, timeout=None,
+                 ping_after=30):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("expected 0 <= minconn <= maxconn and maxconn >= 1")
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        # Idle connections as (connection, time returned) pairs. Used as a
+        # stack so the most recently used (warmest) connection goes out first.
+        self._idle = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition(threading.Lock())
+        for _ in range(minconn):
+            self._idle.append((self._newconn(), time.time()))
+            self._size += 1
+
+    def _newconn(self):
+        return psycopg2.connect(self.dsn)
+
+    def _healthy(self, conn, idle_since):
+        """Checks a connection before it is handed out."""
+        if conn.closed:
+            return False
+        if self.ping_after is None or \
+                time.time() - idle_since < self.ping_after:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1;")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """Checks out a connection, waiting for one if the pool is full."""
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("connection pool is closed")
+                    if self._idle:
+                        conn, idle_since = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        # Reserve a slot; the connection is opened below,
+                        # outside the lock, so other threads are not blocked.
+                        self._size += 1
+                        conn = None
+                        break
+                    if deadline is None:
+                        self._cond.wait()
+                    else:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise PoolError(
+                                "no connection available after %ss"
+                                % self.timeout)
+                        self._cond.wait(remaining)
+            if conn is None:
+                try:
+                    return self._newconn()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self._healthy(conn, idle_since):
+                return conn
+            # A dead connection: drop it and try again.
+            self._discard(conn)
+            self._release_slot()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    def putconn(self, conn, close=False):
+        """Returns a connection to the pool.
+
+        Any transaction left open by the caller is rolled back, so the next
+        user always starts from a clean connection.
+        """
+        if not close and not conn.closed:
+            try:
+                status = conn.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+        with self._cond:
+            if close or conn.closed or self._closed:
+                self._size -= 1
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def connection(self):
+        """Checks out a connection wrapped so that close() returns it."""
+        return PooledConnection(self, self.getconn())
+
+    def closeall(self):
+        """Closes every idle connection and refuses further checkouts."""
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._size -= 1
+                self._discard(conn)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        """Returns a dict with the number of open and idle connections."""
+        with self._cond:
+            return {'size': self._size, 'idle': len(self._idle),
+                    'minconn': self.minconn, 'maxconn': self.maxconn}
+
+
+class PooledConnection(object):
+    """Proxy around a pooled connection.
+
+    Behaves like a psycopg2 connection, except that close() hands the
+    connection back to its pool instead of closing the socket. This keeps
+    the "db.close()" calls in tournament.py working unchanged.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._conn is not None:
+            if exc_type is None:
+                self._conn.commit()
+            else:
+                self._conn.rollback()
+        self.close()
+
+    def __del__(self):
+        # A caller that forgets close() must not leak its pool slot.
+        if self.__dict__.get('_conn') is not None:
+            self.close()
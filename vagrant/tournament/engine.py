@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# engine.py -- in-memory Swiss tournament engine
+#
+# TournamentEngine offers the same API as tournament.py but keeps players
+# and matches in memory, so simulations never wait on a database. Every
+# change is written through to a storage backend (see storage.py), which
+# is also where the engine loads its state from when it starts.
+
+from array import array
+
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
+
+import pairing
+import storage
+
+# The functions of tournament.py that TournamentEngine also provides.
+API = ('deleteMatches', 'deletePlayers', 'countPlayers', 'registerPlayer',
+       'playerStandings', 'reportMatch', 'reportMatches', 'swissPairings',
+       'swissPairingsId')
+
+
+class TournamentEngine(object):
+    """Runs registration, reporting, standings and pairings in memory.
+
+    Players are stored column-wise in arrays indexed by their position in
+    registration order, and matches as two arrays of player positions, so
+    a 100k-player event takes a few megabytes.
+
+    Args:
+      store: a storage.Storage to load from and write through to. Defaults
+        to storage.MemoryStorage, which keeps nothing.
+    """
+
+    def __init__(self, store=None):
+        if store is None:
+            store = storage.MemoryStorage()
+        self.storage = store
+        self._clearPlayers()
+        for pid, name in store.loadPlayers():
+            self._addPlayer(pid, name)
+        position = self.position
+        for winner, loser in store.loadMatches():
+            self._addMatch(position[winner], position.get(loser))
+
+    def _clearPlayers(self):
+        self.ids = array('l')
+        self.names = []
+        self.wins = array('l')
+        self.played = array('l')
+        # Player id -> position in the arrays above.
+        self.position = {}
+        self._clearMatches()
+
+    def _clearMatches(self):
+        self.winners = array('l')
+        self.losers = array('l')
+        # Per position, the positions of the opponents faced so far.
+        self.opponents = [[] for _ in self.ids]
+        self.hadBye = set()
+        for i in range(len(self.ids)):
+            self.wins[i] = 0
+            self.played[i] = 0
+
+    def _addPlayer(self, pid, name):
+        self.position[pid] = len(self.ids)
+        self.ids.append(pid)
+        self.names.append(name)
+        self.wins.append(0)
+        self.played.append(0)
+        self.opponents.append([])
+
+    def _addMatch(self, winner, loser):
+        self.wins[winner] += 1
+        self.played[winner] += 1
+        if loser is pairing.BYE:
+            self.hadBye.add(winner)
+            return
+        self.winners.append(winner)
+        self.losers.append(loser)
+        self.played[loser] += 1
+        self.opponents[winner].append(loser)
+        self.opponents[loser].append(winner)
+
+    def deleteMatches(self):
+        """Remove all the match records."""
+        self.storage.deleteMatches()
+        self._clearMatches()
+
+    def deletePlayers(self):
+        """Remove all the player records.
+
+        Their matches are removed with them, as the ON DELETE CASCADE
+        foreign keys of the SQL schema do.
+        """
+        self.storage.deletePlayers()
+        self._clearPlayers()
+
+    def countPlayers(self):
+        """Returns the number of players currently registered."""
+        return len(self.ids)
+
+    def registerPlayer(self, name):
+        """Adds a player and returns the id assigned by the storage."""
+        return self.registerPlayers([name])[0]
+
+    def registerPlayers(self, names):
+        """Adds several players at once and returns their ids."""
+        names = list(names)
+        ids = self.storage.insertPlayers(names)
+        for pid, name in zip(ids, names):
+            self._addPlayer(pid, name)
+        return ids
+
+    def opponentWins(self):
+        """Returns, per player position, the sum of its opponents' wins."""
+        wins = self.wins
+        total = array('l', [0]) * len(wins)
+        for winner, loser in zip(self.winners, self.losers):
+            total[winner] += wins[loser]
+            total[loser] += wins[winner]
+        return total
+
+    def ranking(self):
+        """Returns player positions sorted as in the standings.
+
+        Players are ordered by wins, then opponent wins, then id, like the
+        standings query of tournament.py.
+        """
+        ids = self.ids
+        order = sorted(range(len(ids)), key=ids.__getitem__)
+        # One integer per player instead of a key tuple keeps the sort
+        # cheap; the sort is stable, so equal keys stay ordered by id.
+        keys = [wins << 32 | opponents for wins, opponents
+                in zip(self.wins, self.opponentWins())]
+        order.sort(key=keys.__getitem__, reverse=True)
+        return order
+
+    def playerStandings(self):
+        """Returns a list of (id, name, wins, matches), sorted by wins."""
+        ids, names, wins, played = self.ids, self.names, self.wins, self.played
+        return [(ids[i], names[i], wins[i], played[i])
+                for i in self.ranking()]
+
+    def reportMatch(self, winner, loser):
+        """Records the outcome of a single match between two players."""
+        self.reportMatches([(winner, loser)])
+
+    def reportMatches(self, results):
+        """Records the outcome of a whole round of matches at once.
+
+        Args:
+          results: a sequence of (winner, loser) pairs of player ids, loser
+            being None for a bye.
+
+        Raises:
+          ValueError: if a player is unknown or appears more than once.
+        """
+        results = list(results)
+        seen = set()
+        for winner, loser in results:
+            players = (winner,) if loser is pairing.BYE else (winner, loser)
+            for player in players:
+                if player not in self.position:
+                    raise ValueError("Unknown player %s." % player)
+                if player in seen:
+                    raise ValueError(
+                        "Player %s appears more than once in the round."
+                        % player)
+                seen.add(player)
+        if not results:
+            return
+        self.storage.insertMatches(results)
+        position = self.position
+        for winner, loser in results:
+            self._addMatch(position[winner], position.get(loser))
+
+    def _pairings(self):
+        """Pairs the next round, as a list of pairs of positions."""
+        players = range(len(self.ids))
+        buchholz, omw = pairing.tiebreaks(players, self.opponents, self.wins,
+                                          self.played)
+        order = pairing.rankPlayers(players, self.wins, [buchholz, omw])
+        return pairing.pairPlayers(order, self.opponents, self.hadBye)
+
+    def swissPairings(self):
+        """Returns (id1, name1, id2, name2) for every pair of the next round.
+
+        Pairings avoid rematches and give a bye to one player when the
+        number of players is odd, see pairing.pairPlayers(). The player
+        with the bye is paired with (None, None).
+        """
+        ids, names = self.ids, self.names
+        pairs = []
+        for a, b in self._pairings():
+            if b is pairing.BYE:
+                pairs.append((ids[a], names[a], None, None))
+            else:
+                pairs.append((ids[a], names[a], ids[b], names[b]))
+        return pairs
+
+    def swissPairingsId(self):
+        """Returns (id1, id2) for every pair of the next round.
+
+        The player with a bye, if any, comes last as (id, None).
+        """
+        ids = self.ids
+        return [(ids[a], None if b is pairing.BYE else ids[b])
+                for a, b in self._pairings()]
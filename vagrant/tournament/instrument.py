@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# instrument.py -- per-statement query statistics and slow-query log
+#
+# When enabled, tournament.py hands out cursors wrapped in InstrumentedCursor,
+# which times every statement and records its latency, row count and call
+# site. The statements of named (server-side) cursors are timed until their
+# last row is fetched, and their rows counted as they are. Statistics are
+# kept per SQL statement (with the placeholders, not the values) and can be
+# read at any time with stats(). Statements slower than the configured
+# threshold are logged with their parameters.
+#
+# Disabled (the default), wrap() returns cursors untouched, so the only cost
+# is one function call per connection.
+
+import logging
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger('tournament.sql')
+
+ENABLED = False
+
+# Statements taking longer than this many seconds are logged. None never
+# logs.
+SLOW_QUERY_SECONDS = 0.5
+
+# Upper bounds, in seconds, of the latency histogram buckets. The last
+# bucket counts everything slower.
+BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0,
+           5.0)
+
+_lock = threading.Lock()
+_statements = {}
+_normalized = {}
+
+
+def configure(enabled=True, slowQuery=SLOW_QUERY_SECONDS):
+    """Turns instrumentation on or off.
+
+    Args:
+      enabled: whether cursors handed out from now on are instrumented.
+      slowQuery: threshold in seconds above which a statement is logged to
+        the "tournament.sql" logger, or None to log nothing.
+    """
+    global ENABLED, SLOW_QUERY_SECONDS
+    ENABLED = enabled
+    SLOW_QUERY_SECONDS = slowQuery
+
+
+def wrap(cursor):
+    """Returns cursor instrumented if instrumentation is enabled."""
+    if not ENABLED:
+        return cursor
+    return InstrumentedCursor(cursor)
+
+
+def reset():
+    """Forgets all the statistics collected so far."""
+    with _lock:
+        _statements.clear()
+
+
+def stats():
+    """Returns a snapshot of the statistics collected so far.
+
+    Returns:
+      A dict keyed by SQL statement, with whitespace collapsed and the
+      value lists of multi-row INSERTs shortened. Each value is a dict of:
+        calls: number of executions.
+        total, max: total and longest latency, in seconds.
+        rows: total number of rows returned or affected.
+        histogram: a list of (upper bound in seconds, count) pairs, the
+          last bound being None.
+        callers: a dict of "module.function" -> number of executions.
+    """
+    with _lock:
+        snapshot = {}
+        for sql, record in _statements.items():
+            snapshot[sql] = {
+                'calls': record.calls,
+                'total': record.total,
+                'max': record.max,
+                'rows': record.rows,
+                'histogram': list(zip(BUCKETS + (None,), record.buckets)),
+                'callers': dict(record.callers),
+            }
+        return snapshot
+
+
+class _Record(object):
+    __slots__ = ('calls', 'total', 'max', 'rows', 'buckets', 'callers')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.callers = {}
+
+
+def _normalize(query):
+    """Returns the key statistics of query are kept under."""
+    sql = _normalized.get(query)
+    if sql is None:
+        sql = " ".join(query.split())
+        # reportMatches() inserts one value list per match; count all its
+        # round sizes as one statement.
+        sql = re.sub(r"(\([^()]*\))(\s*,\s*\([^()]*\))+", r"\1, ...", sql)
+        _normalized[query] = sql
+    return sql
+
+
+def _callSite():
+    """Returns "module.function" of the code that ran the statement.
+
+    Frames of this module and private helpers (named with a leading
+    underscore, like tournament._iterate) are skipped.
+    """
+    here = _callSite.__code__.co_filename
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename != here and not code.co_name.startswith('_'):
+            module = frame.f_globals.get('__name__', '?')
+            return "%s.%s" % (module, code.co_name)
+        frame = frame.f_back
+    return '?'
+
+
+def _record(query, parameters, elapsed, rows, caller):
+    sql = _normalize(query)
+    with _lock:
+        record = _statements.get(sql)
+        if record is None:
+            record = _statements[sql] = _Record()
+        record.calls += 1
+        record.total += elapsed
+        record.max = max(record.max, elapsed)
+        record.rows += max(rows, 0)
+        i = 0
+        while i < len(BUCKETS) and elapsed > BUCKETS[i]:
+            i += 1
+        record.buckets[i] += 1
+        record.callers[caller] = record.callers.get(caller, 0) + 1
+    threshold = SLOW_QUERY_SECONDS
+    if threshold is not None and elapsed >= threshold:
+        params = repr(parameters)
+        if len(params) > 200:
+            params = params[:200] + "..."
+        logger.warning("slow query (%.1f ms, %d rows) in %s: %s -- %s",
+                       elapsed * 1000, rows, caller, sql, params)
+
+
+class _Statement(object):
+    """A statement of a named cursor whose rows are still being fetched."""
+    __slots__ = ('query', 'parameters', 'elapsed', 'rows', 'caller')
+
+    def __init__(self, query, parameters, elapsed, caller):
+        self.query = query
+        self.parameters = parameters
+        self.elapsed = elapsed
+        self.rows = 0
+        self.caller = caller
+
+
+class InstrumentedCursor(object):
+    """A psycopg2 cursor whose statements are timed and recorded.
+
+    A statement is recorded as execute() returns, with the rowcount of the
+    cursor. On a named cursor execute() only declares it, and the rows are
+    read from the server as they are fetched: the statement is recorded
+    once the last row has been fetched, the iteration stopped or the
+    cursor closed, with the time spent fetching and the rows fetched.
+
+    Everything but execute(), executemany(), copy_expert(), the fetch
+    methods, iteration and close() is passed through to the wrapped cursor.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name, value):
+        # Settings like itersize belong to the wrapped cursor.
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._cursor, name, value)
+
+    def __iter__(self):
+        if self._pending is None:
+            return iter(self._cursor)
+        return self._iterate(self._pending)
+
+    def _iterate(self, pending):
+        rows = iter(self._cursor)
+        try:
+            while True:
+                start = time.time()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    return
+                finally:
+                    pending.elapsed += time.time() - start
+                pending.rows += 1
+                yield row
+        finally:
+            # Also when the loop over the cursor is left early.
+            if self._pending is pending:
+                self._flush()
+
+    def _flush(self):
+        """Records the statement of the named cursor, if any."""
+        pending = self._pending
+        if pending is not None:
+            self._pending = None
+            _record(pending.query, pending.parameters, pending.elapsed,
+                    pending.rows, pending.caller)
+
+    def _timed(self, method, query, parameters, *args):
+        self._flush()
+        caller = _callSite()
+        start = time.time()
+        declared = False
+        try:
+            result = method(query, parameters, *args)
+            declared = self._cursor.name is not None
+            return result
+        finally:
+            elapsed = time.time() - start
+            if isinstance(query, bytes):
+                query = query.decode('utf-8')
+            if declared:
+                self._pending = _Statement(query, parameters, elapsed, caller)
+            else:
+                _record(query, parameters, elapsed, self._cursor.rowcount,
+                        caller)
+
+    def _fetch(self, method, *args):
+        """Returns method(*args), its time added to the pending statement."""
+        pending = self._pending
+        if pending is None:
+            return method(*args)
+        start = time.time()
+        try:
+            return method(*args)
+        finally:
+            pending.elapsed += time.time() - start
+
+    def execute(self, query, parameters=None):
+        return self._timed(self._cursor.execute, query, parameters)
+
+    def executemany(self, query, parameters):
+        return self._timed(self._cursor.executemany, query, parameters)
+
+    def copy_expert(self, sql, file, *args):
+        return self._timed(self._cursor.copy_expert, sql, file, *args)
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if row is None:
+            self._flush()
+        elif self._pending is not None:
+            self._pending.rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self._cursor.arraysize
+        rows = self._fetch(self._cursor.fetchmany, size)
+        if self._pending is not None:
+            self._pending.rows += len(rows)
+            if len(rows) < size:
+                self._flush()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        if self._pending is not None:
+            self._pending.rows += len(rows)
+            self._flush()
+        return rows
+
+    def close(self):
+        self._flush()
+        self._cursor.close()
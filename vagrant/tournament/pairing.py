@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# pairing.py -- Swiss pairing shared by tournament.py and engine.py
+#
+# Players are identified by keys (player ids, or array positions in the
+# engine) and the per-player data is passed in anything indexable by those
+# keys: dicts keyed by id or lists indexed by position both work.
+
+# Stands in for the missing opponent of a player who gets a bye.
+BYE = None
+
+# How many times pairPlayers() may undo a pairing before it gives up on
+# avoiding every rematch.
+BACKTRACK_BUDGET = 10000
+
+
+def tiebreaks(players, opponents, wins, played):
+    """Computes the Buchholz and OMW tiebreaks of every player.
+
+    Buchholz is the sum of the wins of every opponent faced. OMW (opponent
+    match-win percentage) is the average match-win percentage of those
+    opponents, each counted as at least 1/3 as is customary. Byes count for
+    neither; players without opponents score 0.
+
+    Args:
+      players: the player keys.
+      opponents: per player key, the keys of the players already faced.
+      wins: wins per player key.
+      played: matches played per player key.
+
+    Returns:
+      A (buchholz, omw) pair of dicts keyed by player.
+    """
+    percentage = {}
+    for p in players:
+        if played[p]:
+            percentage[p] = max(float(wins[p]) / played[p], 1.0 / 3)
+    # Summing through map() with bound __getitem__ methods keeps the inner
+    # loop in C, which matters with hundreds of thousands of players.
+    winsOf = wins.__getitem__
+    percentageOf = percentage.__getitem__
+    total = {}
+    omw = {}
+    for p in players:
+        faced = opponents[p]
+        if faced:
+            total[p] = sum(map(winsOf, faced))
+            omw[p] = sum(map(percentageOf, faced)) / len(faced)
+        else:
+            total[p] = 0
+            omw[p] = 0.0
+    return total, omw
+
+
+def rankPlayers(players, wins, tiebreaks):
+    """Sorts players for pairing.
+
+    Players are ordered by wins, then by each tiebreak in turn, then by key
+    so the order is fully deterministic.
+
+    Args:
+      players: the player keys.
+      wins: wins per player key.
+      tiebreaks: a list of mappings from player key to a tiebreak score,
+        most important first, e.g. the two dicts returned by tiebreaks().
+    """
+    order = sorted(players)
+    # Sorting once per criterion, least important first, relies on the
+    # sort being stable (also in reverse) and avoids building a key tuple
+    # per player.
+    for scores in reversed([wins] + list(tiebreaks)):
+        order.sort(key=scores.__getitem__, reverse=True)
+    return order
+
+
+def pairPlayers(order, opponents, byes=()):
+    """Pairs players for the next round, avoiding rematches.
+
+    Walking down the ranking, each player is paired with the highest ranked
+    player left that they have not played yet, so players are paired within
+    their score group whenever possible and float down otherwise. When a
+    player cannot be paired at all, earlier pairings are undone and retried
+    (backtracking). If no pairing without rematches is found within
+    BACKTRACK_BUDGET steps, the remaining players are paired allowing the
+    fewest rematches the greedy walk can find.
+
+    With an odd number of players the lowest ranked player who has not had
+    a bye yet gets one.
+
+    Args:
+      order: player keys, best ranked first (see rankPlayers()).
+      opponents: per player key, the keys of the players already faced.
+      byes: the keys of the players who already had a bye.
+
+    Returns:
+      A list of (key1, key2) pairs in ranking order. A player with a bye
+      appears last, as (key, BYE).
+    """
+    order = list(order)
+    bye = []
+    if len(order) % 2:
+        byes = set(byes)
+        for i in range(len(order) - 1, -1, -1):
+            if order[i] not in byes:
+                break
+        else:
+            # Everyone had a bye already: start over from the bottom.
+            i = len(order) - 1
+        bye = [(order.pop(i), BYE)]
+    n = len(order)
+    faced = [opponents[p] for p in order]
+    partner = [-1] * n
+    stack = []
+    steps = 0
+    i = 0
+    resume = None
+    while True:
+        while i < n and partner[i] >= 0:
+            i += 1
+        if i == n:
+            break
+        j = i + 1 if resume is None else resume
+        resume = None
+        opponentsOfI = faced[i]
+        while j < n and (partner[j] >= 0 or order[j] in opponentsOfI):
+            j += 1
+        if j < n:
+            partner[i] = j
+            partner[j] = i
+            stack.append((i, j))
+            continue
+        if not stack or steps >= BACKTRACK_BUDGET:
+            return _pairGreedy(order, faced, partner) + bye
+        # Undo the last pairing and move its first player on to their next
+        # candidate.
+        i, j = stack.pop()
+        partner[i] = partner[j] = -1
+        resume = j + 1
+        steps += 1
+    return [(order[i], order[j]) for i, j in stack] + bye
+
+
+def _pairGreedy(order, faced, partner):
+    """Pairs the players pairPlayers() left unpaired, allowing rematches.
+
+    Each of them still takes the highest ranked player left they have not
+    faced, or else the highest ranked player left.
+    """
+    free = [i for i in range(len(order)) if partner[i] < 0]
+    for a, i in enumerate(free):
+        if partner[i] >= 0:
+            continue
+        choice = None
+        for b in range(a + 1, len(free)):
+            j = free[b]
+            if partner[j] >= 0:
+                continue
+            if choice is None:
+                choice = j
+            if order[j] not in faced[i]:
+                choice = j
+                break
+        partner[i] = choice
+        partner[choice] = i
+    return [(order[i], order[j]) for i, j in enumerate(partner) if i < j]
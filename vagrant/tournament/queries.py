@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# queries.py -- SQL shared by tournament.py and aiotournament.py
+#
+# Both modules talk to PostgreSQL through psycopg2 (aiopg wraps it), so the
+# statements and their %s placeholders are the same for the blocking and
+# the asyncio API. Every statement takes the tournament id as a parameter.
+
+CREATE_TOURNAMENT = "INSERT INTO tournaments (name) VALUES (%s) RETURNING id;"
+
+DELETE_TOURNAMENT = "DELETE FROM tournaments WHERE id = %s;"
+
+DELETE_MATCHES = "DELETE FROM matches WHERE tournament_id = %s;"
+
+# With no matches left every player of the tournament is back to zero; the
+# triggers only handle new matches (see tournament.sql).
+RESET_PLAYER_STATS = "UPDATE player_stats \
+                      SET wins = 0, matches = 0, opponent_wins = 0 \
+                      WHERE tournament_id = %s;"
+
+DELETE_PLAYERS = "DELETE FROM players WHERE tournament_id = %s;"
+
+COUNT_PLAYERS = "SELECT COUNT (*) FROM players WHERE tournament_id = %s;"
+
+REGISTER_PLAYER = "INSERT INTO players (tournament_id, name) VALUES (%s, %s);"
+
+# The standings view reads the player_stats table, which the database keeps
+# up to date on every reported match, so this is a single indexed read.
+# Ties are broken by opponent wins and then by id to keep the order stable
+# between calls.
+STANDINGS = "SELECT id, name, wins, matches FROM standings \
+             WHERE tournament_id = %s \
+             ORDER BY wins DESC, opponent_wins DESC, id;"
+
+# What aiotournament.nextRound() pairs from: every player's record and
+# every match, in no particular order.
+PAIRING_PLAYERS = "SELECT id, name, wins, matches FROM standings \
+                   WHERE tournament_id = %s;"
+PAIRING_MATCHES = "SELECT ID_PLAYER1, ID_PLAYER2 FROM matches \
+                   WHERE tournament_id = %s;"
+
+# Every match in reporting order, as (winner, loser).
+MATCHES = "SELECT ID_PLAYER1, ID_PLAYER2 FROM matches \
+           WHERE tournament_id = %s ORDER BY id;"
+
+REPORT_MATCH = "INSERT INTO matches \
+                (TOURNAMENT_ID, ID_PLAYER1, ID_PLAYER2, OUTCOME) \
+                VALUES (%s, %s, %s, 1);"
+
+
+def reportMatches(results, tournament):
+    """Returns (query, parameters) inserting a round with one statement.
+
+    Args:
+      results: a list of (winner, loser) pairs of player ids.
+      tournament: the id of the tournament they play in.
+    """
+    query = ("INSERT INTO matches \
+              (TOURNAMENT_ID, ID_PLAYER1, ID_PLAYER2, OUTCOME) VALUES " +
+             ",".join(["(%s, %s, %s, 1)"] * len(results)) + ";")
+    parameters = []
+    for winner, loser in results:
+        parameters.extend((tournament, winner, loser))
+    return query, parameters
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# ratings.py -- vectorized tiebreaks and Elo ratings over the match history
+#
+# The matches table is loaded once into NumPy integer arrays (winner, loser,
+# round) and every statistic is computed with array operations, so
+# recomputing ratings over a million matches takes a fraction of a second.
+
+from io import BytesIO
+
+import numpy as np
+
+import tournament
+
+# Elo parameters: every player starts at INITIAL_RATING and a win against
+# an equally rated opponent is worth K_FACTOR / 2 points.
+INITIAL_RATING = 1500.0
+K_FACTOR = 32.0
+
+
+class MatchHistory(object):
+    """The match history as arrays of player indexes.
+
+    Attributes:
+      ids: the player ids, sorted. Player index i stands for ids[i].
+      names: the player names, in the same order.
+      winners: per match, the index of the winner.
+      losers: per match, the index of the loser, or -1 for a bye.
+      rounds: per match, the round it belongs to, counted from 0: the
+        number of matches the busier of its two players had played before.
+        In a Swiss event this is the actual round, and no player appears
+        twice in a round.
+    """
+
+    def __init__(self, ids, names, winners, losers):
+        """Builds the history from player ids.
+
+        Args:
+          ids: the player ids, sorted.
+          names: the player names, in the same order.
+          winners: per match in reporting order, the id of the winner.
+          losers: per match, the id of the loser, 0 for a bye.
+        """
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.names = list(names)
+        self.winners = _indexes(self.ids, winners)
+        self.losers = _indexes(self.ids, losers)
+        self.rounds = _rounds(self.winners, self.losers, len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+
+# Player ids are turned into indexes with a lookup table when they span at
+# most this many times as many values as there are players, and by binary
+# search otherwise.
+LOOKUP_SPAN = 4
+
+
+def _indexes(ids, players):
+    """Returns the index in ids of every player id, -1 for 0 (a bye)."""
+    players = np.asarray(players, dtype=np.int64)
+    if len(ids) == 0:
+        return np.full(len(players), -1, dtype=np.int64)
+    low, high = ids[0], ids[-1]
+    if high - low < LOOKUP_SPAN * len(ids):
+        # Index 0 of the table is the bye, any id below low.
+        table = np.full(high - low + 2, -1, dtype=np.int64)
+        table[ids - low + 1] = np.arange(len(ids))
+        return table[np.maximum(players - low + 1, 0)]
+    return np.where(players > 0, np.searchsorted(ids, players), -1)
+
+
+def _rounds(winners, losers, n):
+    """Numbers every match with how many matches its players played before.
+
+    For each of the n players, its matches are numbered 0, 1, 2... in
+    reporting order; a match gets the larger of the numbers of its two
+    players. Sorting the two sides of every match by player, then match,
+    groups them; keys made of both are unique, so a plain sort of one
+    array does it, several times faster than lexsort() or a stable
+    argsort().
+    """
+    m = len(winners)
+    if m == 0:
+        return np.zeros(0, dtype=np.int64)
+    # Both sides of match i at 2i and 2i + 1; byes are counted as player n.
+    players = np.empty(2 * m, dtype=np.int64)
+    players[0::2] = winners
+    players[1::2] = np.where(losers >= 0, losers, n)
+    keys = players * (2 * m) + np.arange(2 * m)
+    keys.sort()
+    counts = np.bincount(players, minlength=n + 1)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    nth = np.empty(2 * m, dtype=np.int64)
+    nth[keys % (2 * m)] = np.arange(2 * m) - first
+    return np.maximum(nth[0::2], np.where(losers >= 0, nth[1::2], -1))
+
+
+def loadHistory(tournamentId=tournament.DEFAULT_TOURNAMENT):
+    """Loads the players and matches of a tournament from the database.
+
+    The matches are streamed with COPY and parsed by NumPy rather than
+    fetched as one Python tuple per row.
+    """
+    db, cursor = tournament.connect()
+    cursor.execute("SELECT id, name FROM players WHERE tournament_id = %s \
+                    ORDER BY id;", (tournamentId,))
+    players = cursor.fetchall()
+    buf = BytesIO()
+    query = cursor.mogrify("COPY (SELECT ID_PLAYER1, COALESCE(ID_PLAYER2, 0) \
+                            FROM matches WHERE tournament_id = %s \
+                            ORDER BY ID) TO STDOUT", (tournamentId,))
+    cursor.copy_expert(query.decode(), buf)
+    db.close()
+    values = np.array(buf.getvalue().split(), dtype=np.int64)
+    return MatchHistory([row[0] for row in players],
+                        [row[1] for row in players],
+                        values[0::2], values[1::2])
+
+
+def computeRatings(history):
+    """Computes wins, tiebreaks and Elo ratings for every player.
+
+    Buchholz and OMW are defined as in pairing.tiebreaks(). Elo ratings
+    are updated round by round; all the matches of a round are applied at
+    once, from the ratings before the round.
+
+    Returns:
+      A dict of arrays indexed by player index: wins, matches, buchholz,
+      omw and elo.
+    """
+    n = len(history)
+    winners, losers = history.winners, history.losers
+    real = losers >= 0
+    w, l = winners[real], losers[real]
+
+    wins = np.bincount(winners, minlength=n)
+    matches = wins + np.bincount(l, minlength=n)
+    faced = np.bincount(w, minlength=n) + np.bincount(l, minlength=n)
+    buchholz = (np.bincount(w, weights=wins[l], minlength=n) +
+                np.bincount(l, weights=wins[w], minlength=n))
+    percentage = np.maximum(wins / np.maximum(matches, 1.0), 1.0 / 3)
+    omw = (np.bincount(w, weights=percentage[l], minlength=n) +
+           np.bincount(l, weights=percentage[w], minlength=n))
+    omw = np.where(faced > 0, omw / np.maximum(faced, 1), 0.0)
+
+    elo = np.full(n, INITIAL_RATING)
+    rounds = history.rounds[real]
+    # The matches of a round are applied together, in any order.
+    byRound = np.argsort(rounds)
+    w, l = w[byRound], l[byRound]
+    bounds = np.searchsorted(rounds[byRound],
+                             np.arange(rounds.max() + 2 if len(rounds) else 1))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        rw, rl = w[start:end], l[start:end]
+        expected = 1.0 / (1.0 + 10.0 ** ((elo[rl] - elo[rw]) / 400.0))
+        delta = K_FACTOR * (1.0 - expected)
+        elo += (np.bincount(rw, weights=delta, minlength=n) -
+                np.bincount(rl, weights=delta, minlength=n))
+
+    return {'wins': wins, 'matches': matches,
+            'buchholz': buchholz.astype(np.int64), 'omw': omw, 'elo': elo}
+
+
+def ratedStandings(history=None, by='tiebreaks'):
+    """Returns standings ranked with the computed tiebreaks or ratings.
+
+    Args:
+      history: a MatchHistory, loaded from the database when omitted.
+      by: 'tiebreaks' ranks by wins, Buchholz, OMW and id, like the
+        pairings; 'elo' ranks by Elo rating, then id.
+
+    Returns:
+      A list of (id, name, wins, matches) tuples, like playerStandings().
+    """
+    if history is None:
+        history = loadHistory()
+    stats = computeRatings(history)
+    if by == 'tiebreaks':
+        keys = (history.ids, -stats['omw'], -stats['buchholz'],
+                -stats['wins'])
+    elif by == 'elo':
+        keys = (history.ids, -stats['elo'])
+    else:
+        raise ValueError("by should be 'tiebreaks' or 'elo', not %r" % by)
+    order = np.lexsort(keys)
+    ids = history.ids[order].tolist()
+    wins = stats['wins'][order].tolist()
+    matches = stats['matches'][order].tolist()
+    names = history.names
+    return [(ids[k], names[i], wins[k], matches[k])
+            for k, i in enumerate(order.tolist())]
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# report.py -- standings reports in text, CSV or JSON lines
+#
+# Standings are streamed from a server-side cursor (tournament.iterStandings)
+# into a buffered file, so a report takes the same memory for ten players as
+# for a million, and each round is written in one pass with a single flush
+# at the end.
+#
+# Usage: python report.py [--format text|csv|jsonl] [--tournament ID] [FILE]
+
+import argparse
+import csv
+import json
+import sys
+
+import tournament
+
+FORMATS = ('text', 'csv', 'jsonl')
+
+# Size in bytes of the buffer reports are written through.
+REPORT_BUFFER = 1 << 16
+
+
+def openReport(path, mode='w'):
+    """Opens a report file with a large write buffer."""
+    if sys.version_info[0] >= 3:
+        # The csv module does its own line endings.
+        return open(path, mode, REPORT_BUFFER, newline='')
+    return open(path, mode + 'b', REPORT_BUFFER)
+
+
+class StandingsReport(object):
+    """Writes standings, one round after the other, to an open file.
+
+    Args:
+      out: a file object to write to, see openReport().
+      fmt: 'text' for the aligned table of file.txt, 'csv' for one row per
+        player with a header line, or 'jsonl' for one JSON object per
+        player. CSV and JSON lines rows carry the round number.
+    """
+
+    def __init__(self, out, fmt='text'):
+        if fmt not in FORMATS:
+            raise ValueError("Unknown report format %r, expected one of %s"
+                             % (fmt, ", ".join(FORMATS)))
+        self.out = out
+        self.fmt = fmt
+        self.csv = None
+        if fmt == 'csv':
+            self.csv = csv.writer(out)
+            self.csv.writerow(['round', 'rank', 'id', 'name', 'wins',
+                               'matches'])
+
+    def note(self, text):
+        """Writes a line of prose; only the text format has room for it."""
+        if self.fmt == 'text':
+            self.out.write(text + "\n")
+
+    def write(self, rows, round=None):
+        """Writes one set of standings and flushes it.
+
+        Args:
+          rows: (id, name, wins, matches) tuples in ranking order, e.g.
+            from tournament.iterStandings() or playerStandings().
+          round: the round number recorded in CSV and JSON lines rows.
+        """
+        write = self.out.write
+        if self.fmt == 'text':
+            write("Ranking | Name      | Wins  |\n")
+            for rank, (pid, name, wins, matches) in enumerate(rows, 1):
+                write(" %d.     | %s  | %d     |\n" % (rank, name, wins))
+        elif self.fmt == 'csv':
+            self.csv.writerows([round, rank, pid, name, wins, matches]
+                               for rank, (pid, name, wins, matches)
+                               in enumerate(rows, 1))
+        else:
+            dumps = json.dumps
+            for rank, (pid, name, wins, matches) in enumerate(rows, 1):
+                write(dumps({'round': round, 'rank': rank, 'id': pid,
+                             'name': name, 'wins': wins, 'matches': matches},
+                            sort_keys=True) + "\n")
+        self.out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes the current standings of a tournament")
+    parser.add_argument('output', nargs='?',
+                        help="file to write to, standard output by default")
+    parser.add_argument('--format', default='text', choices=FORMATS)
+    parser.add_argument('--tournament', type=int,
+                        default=tournament.DEFAULT_TOURNAMENT)
+    args = parser.parse_args()
+    out = openReport(args.output) if args.output else sys.stdout
+    StandingsReport(out, args.format).write(
+        tournament.iterStandings(args.tournament))
+    if args.output:
+        out.close()
+
+
+if __name__ == '__main__':
+    main()
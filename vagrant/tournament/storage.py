@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# storage.py -- storage backends for the in-memory tournament engine
+#
+# A storage backend persists what the engine does: it hands out player ids
+# and records players and matches. The engine keeps its own copy of the
+# state and only reads the backend when it starts up.
+
+import sqlite3
+
+import queries
+
+
+class Storage(object):
+    """Interface every storage backend implements."""
+
+    def loadPlayers(self):
+        """Returns a list of (id, name) for every player, ordered by id."""
+        raise NotImplementedError
+
+    def loadMatches(self):
+        """Returns a list of (winner id, loser id), in the order reported."""
+        raise NotImplementedError
+
+    def insertPlayers(self, names):
+        """Stores new players and returns their ids, in the same order."""
+        raise NotImplementedError
+
+    def insertMatches(self, results):
+        """Stores a list of (winner id, loser id) in one transaction."""
+        raise NotImplementedError
+
+    def deleteMatches(self):
+        raise NotImplementedError
+
+    def deletePlayers(self):
+        """Deletes every player and their matches."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryStorage(Storage):
+    """Keeps nothing: ids are handed out by a counter.
+
+    Used for simulations, where the engine's own state is all we need.
+    """
+
+    def __init__(self):
+        self.nextid = 1
+
+    def loadPlayers(self):
+        return []
+
+    def loadMatches(self):
+        return []
+
+    def insertPlayers(self, names):
+        first = self.nextid
+        self.nextid += len(names)
+        return list(range(first, self.nextid))
+
+    def insertMatches(self, results):
+        pass
+
+    def deleteMatches(self):
+        pass
+
+    def deletePlayers(self):
+        pass
+
+
+class SQLiteStorage(Storage):
+    """Stores players and matches in a SQLite file (or in ":memory:")."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS players (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            NAME TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS matches (
+            ID INTEGER PRIMARY KEY AUTOINCREMENT,
+            ID_PLAYER1 INTEGER REFERENCES players(ID),
+            ID_PLAYER2 INTEGER REFERENCES players(ID),
+            OUTCOME INTEGER NOT NULL);
+    """
+
+    def __init__(self, path=':memory:'):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+
+    def loadPlayers(self):
+        return self.db.execute(
+            "SELECT ID, NAME FROM players ORDER BY ID;").fetchall()
+
+    def loadMatches(self):
+        return self.db.execute(
+            "SELECT ID_PLAYER1, ID_PLAYER2 FROM matches ORDER BY ID;"
+        ).fetchall()
+
+    def insertPlayers(self, names):
+        ids = []
+        with self.db:
+            cursor = self.db.cursor()
+            for name in names:
+                cursor.execute("INSERT INTO players (NAME) VALUES (?);",
+                               (name,))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def insertMatches(self, results):
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO matches (ID_PLAYER1, ID_PLAYER2, OUTCOME) \
+                 VALUES (?, ?, 1);", results)
+
+    def deleteMatches(self):
+        with self.db:
+            self.db.execute("DELETE FROM matches;")
+
+    def deletePlayers(self):
+        # The matches go with their players, as in the SQL schema.
+        with self.db:
+            self.db.execute("DELETE FROM matches;")
+            self.db.execute("DELETE FROM players;")
+
+    def close(self):
+        self.db.close()
+
+
+class PostgresStorage(Storage):
+    """Stores players and matches in the tournament database.
+
+    Uses the pooled connections and the schema of tournament.py, so the
+    player_stats table stays up to date for the SQL API as well.
+
+    Args:
+      tournamentId: the tournament to store into, see
+        tournament.createTournament().
+    """
+
+    def __init__(self, tournamentId=None):
+        # Imported here so the other backends work without psycopg2.
+        import tournament
+        self.tournament = tournament
+        if tournamentId is None:
+            tournamentId = tournament.DEFAULT_TOURNAMENT
+        self.tournamentId = tournamentId
+
+    def loadPlayers(self):
+        db, cursor = self.tournament.connect()
+        cursor.execute("SELECT id, name FROM players WHERE tournament_id = %s \
+                        ORDER BY id;", (self.tournamentId,))
+        rows = cursor.fetchall()
+        db.close()
+        return rows
+
+    def loadMatches(self):
+        db, cursor = self.tournament.connect()
+        cursor.execute(queries.MATCHES, (self.tournamentId,))
+        rows = cursor.fetchall()
+        db.close()
+        return rows
+
+    def insertPlayers(self, names):
+        if not names:
+            return []
+        db, cursor = self.tournament.connect()
+        values = ",".join(cursor.mogrify("(%s, %s)", (self.tournamentId, name))
+                          .decode('utf-8') for name in names)
+        cursor.execute("INSERT INTO players (tournament_id, name) VALUES " +
+                       values + " RETURNING id;")
+        ids = [row[0] for row in cursor.fetchall()]
+        db.commit()
+        db.close()
+        return ids
+
+    def insertMatches(self, results):
+        self.tournament.reportMatches(results, self.tournamentId)
+
+    def deleteMatches(self):
+        self.tournament.deleteMatches(self.tournamentId)
+
+    def deletePlayers(self):
+        self.tournament.deletePlayers(self.tournamentId)
+
+
+BACKENDS = {
+    'memory': MemoryStorage,
+    'sqlite': SQLiteStorage,
+    'postgres': PostgresStorage,
+}
+
+
+def create(backend, *args):
+    """Returns a new storage backend by name: memory, sqlite or postgres."""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown storage backend %r, expected one of %s"
+                         % (backend, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[backend](*args)
@@ -3,39 +3,131 @@
 
 import psycopg2
 import math
+import threading
+
+import dbpool
+import instrument
+import pairing
+import queries
+
+DSN = "dbname=tournament"
+
+# The tournament the functions below work on when none is given. It is
+# created by tournament.sql, so single-event code never has to care.
+DEFAULT_TOURNAMENT = 1
+
+# Rows fetched from the server per round trip by iterStandings() and
+# iterMatches().
+ITERSIZE = 2000
+
+# Connection pool settings, see configurePool().
+POOL_ENABLED = True
+POOL_MIN_SIZE = 1
+POOL_MAX_SIZE = 10
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def configurePool(minconn=POOL_MIN_SIZE, maxconn=POOL_MAX_SIZE,
+                  enabled=True, **kwargs):
+    """(Re)configures the connection pool used by connect().
+
+    Any existing pool is closed. Connections that are checked out at that
+    moment are closed when they are returned.
+
+    Args:
+      minconn: number of connections opened up front.
+      maxconn: maximum number of connections open at the same time.
+      enabled: when False every connect() opens a brand new connection.
+      kwargs: extra arguments for dbpool.ConnectionPool (timeout,
+        ping_after).
+    """
+    global _pool, POOL_ENABLED
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+        POOL_ENABLED = enabled
+        _pool = None
+        if enabled:
+            _pool = dbpool.ConnectionPool(DSN, minconn, maxconn, **kwargs)
+
+
+def getPool():
+    """Returns the shared connection pool, creating it on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = dbpool.ConnectionPool(DSN, POOL_MIN_SIZE,
+                                              POOL_MAX_SIZE)
+    return _pool
 
 
 def connect():
-    """Connect to the PostgreSQL database.  Returns a database connection."""
+    """Connect to the PostgreSQL database.  Returns a database connection.
+
+    The connection comes from the shared pool (unless it was disabled with
+    configurePool(enabled=False)); calling close() on it hands it back.
+    The cursor records query statistics when instrumentation is enabled,
+    see instrument.configure().
+    """
     try:
-        db = psycopg2.connect("dbname=tournament")
-        cursor = db.cursor()
+        if POOL_ENABLED:
+            db = getPool().connection()
+        else:
+            db = psycopg2.connect(DSN)
+        cursor = instrument.wrap(db.cursor())
         return db, cursor
     except:
         print("<error message>")
 
 
-def deleteMatches():
-    """Remove all the match records from the database."""
+def createTournament(name):
+    """Adds a tournament and returns its id.
+
+    Every other function takes an optional tournament id; players, matches,
+    standings and pairings of different tournaments never mix, and any
+    number of tournaments can be played at the same time.
+    """
     db, cursor = connect()
-    cursor.execute("DELETE FROM matches;")
+    cursor.execute(queries.CREATE_TOURNAMENT, (name,))
+    tournament = cursor.fetchone()[0]
     db.commit()
     db.close()
+    return tournament
 
 
-def deletePlayers():
-    """Remove all the player records from the database."""
+def deleteTournament(tournament):
+    """Removes a tournament with all its players and matches."""
+    db, cursor = connect()
+    cursor.execute(queries.DELETE_TOURNAMENT, (tournament,))
+    db.commit()
+    db.close()
+
+
+def deleteMatches(tournament=DEFAULT_TOURNAMENT):
+    """Remove all the match records of a tournament from the database."""
+    db, cursor = connect()
+    cursor.execute(queries.DELETE_MATCHES, (tournament,))
+    cursor.execute(queries.RESET_PLAYER_STATS, (tournament,))
+    db.commit()
+    db.close()
+
+
+def deletePlayers(tournament=DEFAULT_TOURNAMENT):
+    """Remove all the player records of a tournament from the database."""
     db, cursor = connect()
     # We delete all the records from players ;)
-    cursor.execute("DELETE FROM players;")
+    cursor.execute(queries.DELETE_PLAYERS, (tournament,))
     db.commit()
     db.close()
 
 
-def countPlayers():
+def countPlayers(tournament=DEFAULT_TOURNAMENT):
     """Returns the number of players currently registered."""
     db, cursor = connect()
-    cursor.execute("SELECT COUNT (*) FROM players;")
+    cursor.execute(queries.COUNT_PLAYERS, (tournament,))
     # We get the first row of the query
     single_row_of_data = cursor.fetchone()
     db.close()
@@ -44,7 +136,7 @@ def countPlayers():
     return single_row_of_data[0]
 
 
-def registerPlayer(name):
+def registerPlayer(name, tournament=DEFAULT_TOURNAMENT):
     """Adds a player to the tournament database.
 
     The database assigns a unique serial id number for the player.  (This
@@ -52,21 +144,20 @@ def registerPlayer(name):
 
     Args:
       name: the player's full name (need not be unique).
+      tournament: the id of the tournament the player enters.
 
     old version of code --> c.execute("INSERT INTO players
     (NAME,WINS,MATCHES_PLAYED) VALUES ($$"+name+"$$,0,0);")
     """
     db, cursor = connect()
 
-    query = "INSERT INTO players (name) VALUES (%s);"
-    parameter = (name,)
-    cursor.execute(query, parameter)
+    cursor.execute(queries.REGISTER_PLAYER, (tournament, name))
 
     db.commit()
     db.close()
 
 
-def playerStandings():
+def playerStandings(tournament=DEFAULT_TOURNAMENT):
     """Returns a list of the players and their win records, sorted by wins.
 
     The first entry in the list should be the player in first place, or a
@@ -80,73 +171,197 @@ def playerStandings():
         matches: the number of matches the player has played
     """
     db, cursor = connect()
-    """
-    We select the players.ID and players.NAME and we count the number
-    of wins of the players. We join the tables, group them by player ID
-    and order by wins.
-    """
-    cursor.execute("SELECT players.id,players.name, \
-                    count(matches.ID_PLAYER1)  as wins from players left \
-                    join matches on players.id = matches.ID_PLAYER1 \
-                    group by players.id order by wins desc;")
-    rows = cursor.fetchall()
-    standings = []
-    for item in rows:
-        # calculate wins as appearances on column winner
-        query = "SELECT COUNT (*) FROM matches where ID_PLAYER1 = (%s) \
-                or ID_PLAYER2 = (%s);"
-        parameter = (item[0], item[0])
-        cursor.execute(query, parameter)
-        matches = cursor.fetchone()
-        l = list(item)
-        l.append(matches[0])
-        standings.append(l)
+    cursor.execute(queries.STANDINGS, (tournament,))
+    standings = cursor.fetchall()
     db.close()
     return standings
 
 
+def iterStandings(tournament=DEFAULT_TOURNAMENT, itersize=ITERSIZE):
+    """Yields the rows of playerStandings() one at a time.
+
+    The rows come from a named (server-side) cursor, itersize at a time,
+    so memory stays bounded however many players there are. The pooled
+    connection is held until the generator is exhausted or closed.
+    """
+    return _iterate(queries.STANDINGS, (tournament,), itersize)
+
+
+def iterMatches(tournament=DEFAULT_TOURNAMENT, itersize=ITERSIZE):
+    """Yields every match as (winner, loser), in the order reported.
+
+    loser is None for a bye. Streams like iterStandings().
+    """
+    return _iterate(queries.MATCHES, (tournament,), itersize)
+
+
+def _iterate(query, parameters, itersize):
+    db, cursor = connect()
+    try:
+        cursor = instrument.wrap(db.cursor('tournament_iterate'))
+        cursor.itersize = itersize
+        cursor.execute(query, parameters)
+        for row in cursor:
+            yield row
+        cursor.close()
+    finally:
+        db.close()
+
+
+def checkPlayerStats(repair=False, tournament=DEFAULT_TOURNAMENT):
+    """Compares player_stats with a fresh computation from matches.
+
+    Args:
+      repair: when True and differences are found, player_stats is rebuilt
+        from matches.
+      tournament: the id of the tournament to check.
+
+    Returns:
+      A list of tuples (id, expected, actual), one per player whose stats
+      differ, where expected and actual are (wins, matches, opponent_wins)
+      tuples, or None when the player is missing on that side. An empty
+      list means player_stats is consistent.
+    """
+    db, cursor = connect()
+    cursor.execute("SELECT COALESCE(fresh.id, kept.id), \
+                    fresh.wins, fresh.matches, fresh.opponent_wins, \
+                    kept.wins, kept.matches, kept.opponent_wins \
+                    FROM player_stats_from_matches(%(t)s) AS fresh \
+                    FULL JOIN (SELECT * FROM player_stats \
+                               WHERE tournament_id = %(t)s) AS kept \
+                    ON kept.id = fresh.id \
+                    WHERE (fresh.wins, fresh.matches, fresh.opponent_wins) \
+                    IS DISTINCT FROM \
+                    (kept.wins, kept.matches, kept.opponent_wins) \
+                    ORDER BY 1;", {'t': tournament})
+    differences = []
+    for row in cursor.fetchall():
+        expected = tuple(row[1:4]) if row[1] is not None else None
+        actual = tuple(row[4:7]) if row[4] is not None else None
+        differences.append((row[0], expected, actual))
+    if differences and repair:
+        cursor.execute("SELECT rebuild_player_stats(%s);", (tournament,))
+        db.commit()
+    db.close()
+    return differences
+
+
 def standingsNiceDisplay(rows):
     """EXTRA CREDIT Writes on the file file.txt the standings
     when the function is called. """
-
-    numberofplayers = countPlayers()
-    playerposition = 0
-    f = open('file.txt', 'a')
-    f.write("Ranking | Name      | Wins  |\n")
-    while (playerposition < numberofplayers):
-        f.write(" " + str(playerposition + 1) + ".     | " +
-                str(rows[playerposition][1]) +
-                "  | " + str(rows[playerposition][2]) + "     |\n")
-        playerposition = playerposition + 1
+    # Imported here because report.py imports this module.
+    import report
+    f = report.openReport('file.txt', 'a')
+    report.StandingsReport(f).write(rows)
     f.close()
 
 
-def reportMatch(winner, loser):
+def reportMatch(winner, loser, tournament=DEFAULT_TOURNAMENT):
     """Records the outcome of a single match between two players.
 
     Args:
       winner:  the id number of the player who won
       loser:  the id number of the player who lost
+      tournament: the id of the tournament both players play in
 
     """
     db, cursor = connect()
     """ We insert into matches the ouctome of the match. Since the player in the
     first position is the winner then the outcome is always 1."""
-    query = "INSERT INTO matches (ID_PLAYER1, ID_PLAYER2,OUTCOME) \
-            VALUES (%s, %s, %s);"
-    parameter = (winner, loser, 1)
-    cursor.execute(query, parameter)
+    cursor.execute(queries.REPORT_MATCH, (tournament, winner, loser))
     db.commit()
     db.close()
 
 
-def swissPairings():
+def reportMatches(results, tournament=DEFAULT_TOURNAMENT):
+    """Records the outcome of a whole round of matches in one transaction.
+
+    All the matches are written with a single multi-row INSERT and one
+    commit, so a round costs one round trip no matter how many pairings
+    it has.
+
+    Args:
+      results: a sequence of (winner, loser) pairs of player ids, loser
+        being None for a player who had a bye.
+      tournament: the id of the tournament the round belongs to.
+
+    Raises:
+      ValueError: if a player appears more than once in the round.
+    """
+    results = checkRound(results)
+    if not results:
+        return
+    db, cursor = connect()
+    cursor.execute(*queries.reportMatches(results, tournament))
+    db.commit()
+    db.close()
+
+
+def checkRound(results):
+    """Returns the results of a round as a list, after checking them.
+
+    Raises:
+      ValueError: if a player appears more than once in the round.
+    """
+    results = list(results)
+    seen = set()
+    for winner, loser in results:
+        players = (winner,) if loser is pairing.BYE else (winner, loser)
+        for player in players:
+            if player in seen:
+                raise ValueError(
+                    "Player %s appears more than once in the round." % player)
+            seen.add(player)
+    return results
+
+
+def nextRound(tournament=DEFAULT_TOURNAMENT):
+    """Pairs the players for the next round.
+
+    Players are ranked by wins, then by Buchholz and OMW tiebreaks (see
+    pairing.tiebreaks()), and paired avoiding rematches, with a bye for one
+    player when the number of players is odd (see pairing.pairPlayers()).
+
+    Returns:
+      A (names, pairs) tuple: a dict of player id -> name, and a list of
+      (id1, id2) pairs where id2 is None for the player with the bye.
+    """
+    return pairStandings(iterStandings(tournament), iterMatches(tournament))
+
+
+def pairStandings(players, results):
+    """Pairs the next round from rows of the database, see nextRound().
+
+    Args:
+      players: (id, name, wins, matches) rows for every player.
+      results: (winner, loser) rows for every match played. Both are only
+        iterated once, so they can be streamed.
+    """
+    names, wins, played, opponents = {}, {}, {}, {}
+    for pid, name, won, matches in players:
+        names[pid] = name
+        wins[pid] = won
+        played[pid] = matches
+        opponents[pid] = []
+    byes = set()
+    for winner, loser in results:
+        if loser is pairing.BYE:
+            byes.add(winner)
+        else:
+            opponents[winner].append(loser)
+            opponents[loser].append(winner)
+    buchholz, omw = pairing.tiebreaks(names, opponents, wins, played)
+    order = pairing.rankPlayers(names, wins, [buchholz, omw])
+    return names, pairing.pairPlayers(order, opponents, byes)
+
+
+def swissPairings(tournament=DEFAULT_TOURNAMENT):
     """Returns a list of pairs of players for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Each player appears exactly once in the pairings. Each player is paired
+    with the closest player in the standings they have not played yet, see
+    nextRound(). With an odd number of players, one player gets a bye and
+    is paired with (None, None).
 
     Returns:
       A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -156,86 +371,58 @@ def swissPairings():
         name2: the second player's name
 
     """
-    # We get all the rows from the colums ID, Name of the table players.
-    rows = playerStandings()
-    isfirst = True
-    # We proceed to organize the pairings.
-    mypairings = []
-    for item in rows:
-        # Since item is a pair we want to know if it's the first or the second.
-        if (isfirst):
-            firstvalue = item
-            isfirst = False
-        else:
-            secondvalue = item
-            isfirst = True
-            # We prepare the pairing list and append it pairings list.
-            mypair = [firstvalue[0], firstvalue[1],
-                      secondvalue[0], secondvalue[1]]
-            mypairings.append(mypair)
-    return mypairings
+    names, pairs = nextRound(tournament)
+    return [(id1, names[id1], id2, names.get(id2)) for id1, id2 in pairs]
 
 
-def swissPairingsId():
+def swissPairingsId(tournament=DEFAULT_TOURNAMENT):
     """Returns a list of pairs of players' Ids for the next round of a match.
 
-    Assuming that there are an even number of players registered, each player
-    appears exactly once in the pairings.  Each player is paired with another
-    player with an equal or nearly-equal win record, that is, a player adjacent
-    to him or her in the standings.
+    Same pairings as swissPairings(), the player with a bye (if any) comes
+    last as (id, None).
 
     Returns:
       A list of tuples, each of which contains (id1, id2)
         id1: the first player's unique id
         id2: the second player's unique id
     """
-    rows = playerStandings()
-    isfirst = True
-    mypairings = []
-    for item in rows:
-        if (isfirst):
-            firstvalue = item
-            isfirst = False
-        else:
-            secondvalue = item
-            isfirst = True
-            mypair = [firstvalue[0], secondvalue[0]]
-            mypairings.append(mypair)
-    return mypairings
+    names, pairs = nextRound(tournament)
+    return pairs
+
 
+def playSampleTournament(tournament=DEFAULT_TOURNAMENT, path='file.txt',
+                         fmt='text'):
+    """ Plays a tournament with the registered players.
 
-def playSampleTournament():
-    """ Plays a tournament with the registered players. """
+    The standings after every round are streamed into the report at path,
+    which is opened once for the whole tournament; fmt is one of the
+    formats of report.StandingsReport.
+    """
+    import report
 
-    f = open('file.txt', 'w')
-    numberofplayers = countPlayers()
+    numberofplayers = countPlayers(tournament)
     numberofrounds = int(math.log(numberofplayers, 2))
-    f.write("\nWelcome to the 1st Open Grand Slam Tournament.\n")
-    f.write("There are " + str(numberofplayers) +
-            " players registered.\nThere will be a total of " +
-            str(numberofplayers - 1) + " matches in " + str(numberofrounds) +
-            " rounds.\nGood luck to you all!\n")
-    roundnow = 1
-    f.close()
+    f = report.openReport(path)
+    output = report.StandingsReport(f, fmt)
+    output.note("\nWelcome to the 1st Open Grand Slam Tournament.")
+    output.note("There are " + str(numberofplayers) +
+                " players registered.\nThere will be a total of " +
+                str(numberofplayers - 1) + " matches in " +
+                str(numberofrounds) + " rounds.\nGood luck to you all!")
 
     # We proceed with the rounds
-    while (roundnow <= numberofrounds):
+    for roundnow in range(1, numberofrounds + 1):
         """ We prepare the pairings with a custom function
          that returns only the id's of the pairings."""
-        pairingofround = swissPairingsId()
-        for itemm in pairingofround:
-            # We report the matches for the pairings.
-            reportMatch(itemm[0], itemm[1])
+        pairingofround = swissPairingsId(tournament)
+        # We report all the matches of the round at once.
+        reportMatches(pairingofround, tournament)
 
         # We proceed with the standings
-        f = open('file.txt', 'a')
-        f.write("\nStandings after the round\n")
-        f.close()
-        standings = playerStandings()
-        standingsNiceDisplay(standings)
-        roundnow = roundnow+1
-
-    f = open('file.txt', 'a')
-    f.write("\nAnd the tournament has finished and we have a winner!!!!!\n")
-    f.write("Congratulations to " + str(standings[0][1]) + "! Great games!")
+        output.note("\nStandings after the round")
+        output.write(iterStandings(tournament), roundnow)
+
+    winner = next(iterStandings(tournament, itersize=1))
+    output.note("\nAnd the tournament has finished and we have a winner!!!!!")
+    output.note("Congratulations to " + str(winner[1]) + "! Great games!")
     f.close()
@@ -14,15 +14,156 @@ create database tournament;
 
 
 
+-- Every event is a tournament; players and matches belong to exactly one.
+-- All keys and indexes lead with TOURNAMENT_ID, so each event works on its
+-- own slice of the tables and events running at the same time never lock
+-- each other's rows.
+--
+-- The tables are not partitioned: the Vagrant box (ubuntu/trusty32) runs
+-- PostgreSQL 9.3, which has no PARTITION BY, and its inheritance-based
+-- partitions cannot be the target of the foreign keys below. On 11 or later
+-- players and matches could be declared PARTITION BY HASH (TOURNAMENT_ID),
+-- with primary keys of (TOURNAMENT_ID, ID) and player_stats referencing
+-- players by both columns.
+CREATE TABLE tournaments (
+   ID  BIGSERIAL PRIMARY KEY NOT NULL,
+   NAME           TEXT      NOT NULL);
+
+-- The tournament used when the API is called without a tournament id.
+INSERT INTO tournaments (NAME) VALUES ('Default tournament');
+
 CREATE TABLE players (
 	ID  BIGSERIAL PRIMARY KEY NOT NULL,
-   NAME           TEXT      NOT NULL);
+   TOURNAMENT_ID BIGINT NOT NULL REFERENCES tournaments(ID) ON DELETE CASCADE,
+   NAME           TEXT      NOT NULL,
+   UNIQUE (TOURNAMENT_ID, ID));
 
+-- ID_PLAYER1 is always the winner and ID_PLAYER2 the loser of a match, or
+-- NULL when ID_PLAYER1 had a bye. Both must play in the match's tournament.
 CREATE TABLE matches (   
 	ID  BIGSERIAL PRIMARY KEY NOT NULL,
-   ID_PLAYER1 INT REFERENCES players(ID),
-   ID_PLAYER2 INT REFERENCES players(ID),  
-   OUTCOME INT NOT NULL);
+   TOURNAMENT_ID BIGINT NOT NULL REFERENCES tournaments(ID) ON DELETE CASCADE,
+   ID_PLAYER1 INT NOT NULL,
+   ID_PLAYER2 INT,  
+   OUTCOME INT NOT NULL,
+   FOREIGN KEY (TOURNAMENT_ID, ID_PLAYER1)
+      REFERENCES players(TOURNAMENT_ID, ID) ON DELETE CASCADE,
+   FOREIGN KEY (TOURNAMENT_ID, ID_PLAYER2)
+      REFERENCES players(TOURNAMENT_ID, ID) ON DELETE CASCADE);
+
+CREATE INDEX matches_tournament_idx ON matches (TOURNAMENT_ID, ID);
+CREATE INDEX matches_id_player1_idx ON matches (ID_PLAYER1);
+CREATE INDEX matches_id_player2_idx ON matches (ID_PLAYER2);
+
+-- Wins, matches played and the sum of the wins of every opponent faced
+-- (OPPONENT_WINS, the opponent match wins tiebreak) for each player of a
+-- tournament, computed from scratch over its match history.
+CREATE FUNCTION player_stats_from_matches(BIGINT)
+   RETURNS TABLE (ID BIGINT, WINS BIGINT, MATCHES BIGINT,
+                  OPPONENT_WINS BIGINT) AS $$
+   WITH results AS (
+      SELECT ID_PLAYER1 AS ID, ID_PLAYER2 AS OPPONENT, 1 AS WON
+      FROM matches WHERE TOURNAMENT_ID = $1
+      UNION ALL
+      SELECT ID_PLAYER2 AS ID, ID_PLAYER1 AS OPPONENT, 0 AS WON
+      FROM matches WHERE TOURNAMENT_ID = $1),
+   totals AS (
+      SELECT players.ID, COALESCE(SUM(results.WON), 0) AS WINS,
+             COUNT(results.ID) AS MATCHES
+      FROM players LEFT JOIN results ON results.ID = players.ID
+      WHERE players.TOURNAMENT_ID = $1
+      GROUP BY players.ID)
+   SELECT totals.ID, totals.WINS, totals.MATCHES,
+          COALESCE(SUM(opponent.WINS), 0)::BIGINT AS OPPONENT_WINS
+   FROM totals
+   LEFT JOIN results ON results.ID = totals.ID
+   LEFT JOIN totals AS opponent ON opponent.ID = results.OPPONENT
+   GROUP BY totals.ID, totals.WINS, totals.MATCHES;
+$$ LANGUAGE sql STABLE;
+
+-- The same statistics, kept up to date by the triggers below so reading
+-- the standings never has to scan matches.
+CREATE TABLE player_stats (
+   ID BIGINT PRIMARY KEY REFERENCES players(ID) ON DELETE CASCADE,
+   TOURNAMENT_ID BIGINT NOT NULL,
+   WINS INT NOT NULL DEFAULT 0,
+   MATCHES INT NOT NULL DEFAULT 0,
+   OPPONENT_WINS INT NOT NULL DEFAULT 0);
+
+CREATE INDEX player_stats_rank_idx
+   ON player_stats (TOURNAMENT_ID, WINS DESC, OPPONENT_WINS DESC, ID);
+
+CREATE VIEW standings AS
+   SELECT players.ID, players.TOURNAMENT_ID, players.NAME, player_stats.WINS,
+          player_stats.MATCHES, player_stats.OPPONENT_WINS
+   FROM players JOIN player_stats ON player_stats.ID = players.ID;
+
+-- Replaces the player_stats rows of a tournament with a fresh computation
+-- from its matches.
+CREATE FUNCTION rebuild_player_stats(BIGINT) RETURNS void AS $$
+   DELETE FROM player_stats WHERE TOURNAMENT_ID = $1;
+   INSERT INTO player_stats (ID, TOURNAMENT_ID, WINS, MATCHES, OPPONENT_WINS)
+      SELECT ID, $1, WINS, MATCHES, OPPONENT_WINS
+      FROM player_stats_from_matches($1);
+$$ LANGUAGE sql;
+
+CREATE FUNCTION player_stats_on_player() RETURNS trigger AS $$
+BEGIN
+   INSERT INTO player_stats (ID, TOURNAMENT_ID)
+      VALUES (NEW.ID, NEW.TOURNAMENT_ID);
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Applies one new match to player_stats. Row triggers of a multi-row
+-- INSERT run after the whole statement, in insertion order, so of the
+-- matches inserted by this transaction only those with a lower ID count as
+-- "previous" ones here; matches of other transactions count once they are
+-- visible.
+--
+-- Matches of one tournament are applied one at a time, under an advisory
+-- lock on the tournament id held until commit: concurrent reports would
+-- otherwise update the same player_stats rows in different orders and
+-- deadlock, or miss each other's wins.
+CREATE FUNCTION player_stats_on_match() RETURNS trigger AS $$
+DECLARE
+   mine xid;
+BEGIN
+   PERFORM pg_advisory_xact_lock(NEW.TOURNAMENT_ID);
+   SELECT xmin INTO mine FROM matches WHERE ID = NEW.ID;
+
+   -- Everyone the winner played before gains one opponent win for each
+   -- of those matches.
+   UPDATE player_stats SET OPPONENT_WINS = OPPONENT_WINS + previous.n
+   FROM (SELECT CASE WHEN ID_PLAYER1 = NEW.ID_PLAYER1
+                     THEN ID_PLAYER2 ELSE ID_PLAYER1 END AS ID,
+                COUNT(*) AS n
+         FROM matches
+         WHERE (ID_PLAYER1 = NEW.ID_PLAYER1 OR ID_PLAYER2 = NEW.ID_PLAYER1)
+           AND ID <> NEW.ID AND (ID < NEW.ID OR NOT xmin = mine)
+         GROUP BY 1) AS previous
+   WHERE player_stats.ID = previous.ID;
+
+   -- Both players now count each other's wins, the winner's including
+   -- this match. A bye (ID_PLAYER2 is NULL) is a win without opponent.
+   UPDATE player_stats SET WINS = WINS + 1, MATCHES = MATCHES + 1,
+      OPPONENT_WINS = OPPONENT_WINS + COALESCE(
+         (SELECT WINS FROM player_stats WHERE ID = NEW.ID_PLAYER2), 0)
+   WHERE ID = NEW.ID_PLAYER1;
+   UPDATE player_stats SET MATCHES = MATCHES + 1,
+      OPPONENT_WINS = OPPONENT_WINS +
+         (SELECT WINS FROM player_stats WHERE ID = NEW.ID_PLAYER1)
+   WHERE ID = NEW.ID_PLAYER2;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
+CREATE TRIGGER player_stats_insert_player AFTER INSERT ON players
+   FOR EACH ROW EXECUTE PROCEDURE player_stats_on_player();
 
+CREATE TRIGGER player_stats_insert_match AFTER INSERT ON matches
+   FOR EACH ROW EXECUTE PROCEDURE player_stats_on_match();
 
+-- Matches are only ever deleted a whole tournament at a time, by
+-- deleteMatches() in tournament.py, which resets player_stats itself.
+-- After any other change to past matches, run rebuild_player_stats().
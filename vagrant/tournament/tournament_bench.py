@@ -0,0 +1,565 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py. They run against the tournament database
+# (see tournament.sql) and wipe the players and matches of the default
+# tournament.
+#
+# Usage: python tournament_bench.py <benchmark> [options]
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+
+import engine
+import instrument
+import storage
+import tournament
+
+
+def timed(fn, ops, threads=1):
+    """Runs fn() ops times spread over threads and returns ops/sec."""
+    per_thread = ops // threads
+
+    def worker():
+        for _ in range(per_thread):
+            fn()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    elapsed = time.time() - start
+    return per_thread * threads / elapsed
+
+
+def seed(players, matches, rng=None):
+    """Fills the database with synthetic players and random matches.
+
+    Rows are generated in SQL so seeding large populations is fast. Returns
+    the list of player ids.
+    """
+    rng = rng or random.Random(1)
+    tournament.deleteMatches()
+    tournament.deletePlayers()
+    db, cursor = tournament.connect()
+    # Bulk load without the player_stats triggers and rebuild the table
+    # once at the end, which is much faster for a random history. Row by
+    # row, the foreign key checks of player_stats would also keep using
+    # plans made while the tables were empty, turning into ever longer
+    # sequential scans.
+    cursor.execute("ALTER TABLE players \
+                    DISABLE TRIGGER player_stats_insert_player;")
+    cursor.execute("ALTER TABLE matches \
+                    DISABLE TRIGGER player_stats_insert_match;")
+    cursor.execute("INSERT INTO players (tournament_id, name) \
+                    SELECT %s, 'Player ' || g FROM generate_series(1, %s) g \
+                    RETURNING id;", (tournament.DEFAULT_TOURNAMENT, players))
+    ids = [row[0] for row in cursor.fetchall()]
+    rows = []
+    for _ in range(matches):
+        winner, loser = rng.sample(ids, 2)
+        rows.append("(%d,%d,%d,1)" % (tournament.DEFAULT_TOURNAMENT, winner,
+                                      loser))
+    for start in range(0, len(rows), 10000):
+        cursor.execute("INSERT INTO matches \
+                        (TOURNAMENT_ID, ID_PLAYER1, ID_PLAYER2, OUTCOME) \
+                        VALUES " + ",".join(rows[start:start + 10000]) + ";")
+    cursor.execute("ALTER TABLE players \
+                    ENABLE TRIGGER player_stats_insert_player;")
+    cursor.execute("ALTER TABLE matches \
+                    ENABLE TRIGGER player_stats_insert_match;")
+    # Fresh statistics first: planned against the emptied tables, the
+    # rebuild would pick nested loops over a million matches.
+    cursor.execute("ANALYZE players; ANALYZE matches;")
+    cursor.execute("SELECT rebuild_player_stats(%s);",
+                   (tournament.DEFAULT_TOURNAMENT,))
+    db.commit()
+    cursor.execute("ANALYZE player_stats;")
+    db.commit()
+    db.close()
+    return ids
+
+
+def legacyStandings():
+    """playerStandings() as it used to be: one COUNT query per player."""
+    db, cursor = tournament.connect()
+    cursor.execute("SELECT players.id, players.name, \
+                    count(matches.ID_PLAYER1) as wins from players left \
+                    join matches on players.id = matches.ID_PLAYER1 \
+                    where players.tournament_id = %s \
+                    group by players.id order by wins desc;",
+                   (tournament.DEFAULT_TOURNAMENT,))
+    standings = []
+    for item in cursor.fetchall():
+        cursor.execute("SELECT COUNT (*) FROM matches where ID_PLAYER1 = (%s) \
+                        or ID_PLAYER2 = (%s);", (item[0], item[0]))
+        standings.append(list(item) + [cursor.fetchone()[0]])
+    db.close()
+    return standings
+
+
+def benchPool(args):
+    """Compares ops/sec of the public API with and without the pool.
+
+    The last run uses the pool with query instrumentation turned on.
+    """
+    print("%-8s %-16s %12s" % ("pool", "operation", "ops/sec"))
+    for enabled, label in ((False, "off"), (True, "on"),
+                           (True, "on+stats")):
+        tournament.configurePool(maxconn=max(args.threads, 1),
+                                 enabled=enabled)
+        instrument.configure(enabled=label == "on+stats", slowQuery=None)
+        tournament.deleteMatches()
+        tournament.deletePlayers()
+        rate = timed(lambda: tournament.registerPlayer("Bench Player"),
+                     args.ops, args.threads)
+        print("%-8s %-16s %12.1f" % (label, "registerPlayer", rate))
+        rate = timed(tournament.countPlayers, args.ops, args.threads)
+        print("%-8s %-16s %12.1f" % (label, "countPlayers", rate))
+    instrument.configure(enabled=False)
+    tournament.configurePool()
+
+
+def benchStandings(args):
+    """Times playerStandings() over a large match history."""
+    seed(args.players, args.matches)
+    print("%d players, %d matches" % (args.players, args.matches))
+    variants = [("playerStandings", tournament.playerStandings)]
+    if args.legacy:
+        variants.append(("legacy N+1", legacyStandings))
+    for label, fn in variants:
+        start = time.time()
+        for _ in range(args.repeat):
+            fn()
+        elapsed = (time.time() - start) / args.repeat
+        print("%-16s %10.1f ms/call" % (label, elapsed * 1000))
+
+
+def benchExport(args):
+    """Compares peak memory of a CSV export, streamed and fetched whole."""
+    # Imported here so the other benchmarks run without the report module.
+    import report
+
+    if not args.no_seed:
+        seed(args.players, args.matches)
+        # Seeding holds every generated match in memory. Start over in a
+        # fresh process so the peak below is the export's alone.
+        os.execv(sys.executable, [sys.executable, sys.argv[0], 'export',
+                                  '--no-seed'])
+    print("%d players" % tournament.countPlayers())
+    print("%-16s %10s %14s" % ("export", "time (s)", "peak RSS (MB)"))
+    # The peak RSS of a process never goes down, so the streamed export,
+    # expected to be the smaller one, runs first.
+    variants = [("iterStandings", tournament.iterStandings),
+                ("playerStandings", tournament.playerStandings)]
+    for label, fn in variants:
+        start = time.time()
+        with open(os.devnull, 'w') as out:
+            report.StandingsReport(out, 'csv').write(fn())
+        elapsed = time.time() - start
+        # ru_maxrss is in kilobytes on Linux.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        print("%-16s %10.2f %14.1f" % (label, elapsed, peak))
+
+
+def playRound(sim, rng):
+    """Pairs and reports one round on an engine, with coin-flip results."""
+    results = []
+    for a, b in sim.swissPairingsId():
+        results.append((a, b) if b is None or rng.random() < 0.5 else (b, a))
+    sim.reportMatches(results)
+
+
+def benchSimulate(args):
+    """Plays a full Swiss event on the in-memory engine."""
+    rng = random.Random(args.seed)
+    start = time.time()
+    sim = engine.TournamentEngine(storage.create(args.backend))
+    sim.deleteMatches()
+    sim.deletePlayers()
+    sim.registerPlayers("Player %d" % i for i in range(args.players))
+    registered = time.time()
+    rounds = max(1, int(math.ceil(math.log(args.players, 2))))
+    for _ in range(rounds):
+        playRound(sim, rng)
+    played = time.time()
+    winner = sim.playerStandings()[0]
+    print("%s backend, %d players, %d rounds" % (args.backend, args.players,
+                                                 rounds))
+    print("%-10s %8.2f s" % ("register", registered - start))
+    print("%-10s %8.2f s" % ("rounds", played - registered))
+    print("%-10s %8.2f s" % ("total", time.time() - start))
+    print("winner: %s with %d wins" % (winner[1], winner[2]))
+
+
+def benchPairing(args):
+    """Times Swiss pairing of the last round at several event sizes."""
+    print("%10s %7s %12s %10s" % ("players", "round", "pairing (s)",
+                                  "rematches"))
+    for size in args.sizes:
+        rng = random.Random(args.seed)
+        sim = engine.TournamentEngine()
+        sim.registerPlayers("Player %d" % i for i in range(size))
+        rounds = max(1, int(math.ceil(math.log(size, 2))))
+        for _ in range(rounds - 1):
+            playRound(sim, rng)
+        start = time.time()
+        pairs = sim.swissPairingsId()
+        elapsed = time.time() - start
+        position = sim.position
+        rematches = sum(1 for a, b in pairs if b is not None and
+                        position[b] in sim.opponents[position[a]])
+        print("%10d %7d %12.3f %10d" % (size, rounds, elapsed, rematches))
+
+
+def playEvent(players, rng, tournamentId):
+    """Plays a full Swiss event through the SQL API of tournament.py."""
+    for i in range(players):
+        tournament.registerPlayer("Player %d" % i, tournamentId)
+    for _ in range(max(1, int(math.ceil(math.log(players, 2))))):
+        results = []
+        for a, b in tournament.swissPairingsId(tournamentId):
+            results.append((a, b) if b is None or rng.random() < 0.5
+                           else (b, a))
+        tournament.reportMatches(results, tournamentId)
+    return tournament.playerStandings(tournamentId)
+
+
+def benchConcurrent(args):
+    """Plays several tournaments at once, one thread each."""
+    tournament.configurePool(maxconn=max(args.tournaments, 1))
+    print("%12s %10s %10s %12s" % ("tournaments", "players", "time (s)",
+                                   "events/sec"))
+    for count in sorted(set([1, args.tournaments])):
+        events = [tournament.createTournament("Bench %d" % i)
+                  for i in range(count)]
+        workers = [threading.Thread(target=playEvent,
+                                    args=(args.players,
+                                          random.Random(args.seed + i), t))
+                   for i, t in enumerate(events)]
+        start = time.time()
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        elapsed = time.time() - start
+        print("%12d %10d %10.2f %12.2f" % (count, args.players, elapsed,
+                                           count / elapsed))
+        for t in events:
+            tournament.deleteTournament(t)
+    tournament.configurePool()
+
+
+class PhaseTimer(object):
+    """Collects the duration of every call, grouped by phase."""
+
+    def __init__(self):
+        self.samples = {}
+
+    def call(self, phase, fn, *args):
+        start = time.time()
+        result = fn(*args)
+        self.samples.setdefault(phase, []).append(time.time() - start)
+        return result
+
+    def summary(self):
+        """Returns per phase the call count and total, mean, median, 95th
+        percentile and maximum durations in seconds."""
+        phases = {}
+        for phase, samples in self.samples.items():
+            samples = sorted(samples)
+            n = len(samples)
+            phases[phase] = {
+                'calls': n,
+                'total': sum(samples),
+                'mean': sum(samples) / n,
+                'p50': samples[n // 2],
+                'p95': samples[min(n - 1, int(n * 0.95))],
+                'max': samples[-1],
+            }
+        return phases
+
+
+def eventApi(args):
+    """Returns (api, cleanup) for the event benchmark.
+
+    api has the tournament.py functions, bound to a fresh tournament for
+    the SQL API or to a TournamentEngine on the chosen storage backend.
+    """
+    if args.api == 'sql':
+        event = tournament.createTournament("Bench event")
+
+        class api(object):
+            registerPlayer = staticmethod(
+                lambda name: tournament.registerPlayer(name, event))
+            swissPairingsId = staticmethod(
+                lambda: tournament.swissPairingsId(event))
+            reportMatches = staticmethod(
+                lambda results: tournament.reportMatches(results, event))
+            playerStandings = staticmethod(
+                lambda: tournament.playerStandings(event))
+
+        return api, lambda: tournament.deleteTournament(event)
+    sim = engine.TournamentEngine(storage.create(args.api))
+    sim.deleteMatches()
+    sim.deletePlayers()
+    return sim, sim.storage.close
+
+
+def benchEvent(args):
+    """Plays a full Swiss event and records per-phase timings."""
+    rng = random.Random(args.seed)
+    api, cleanup = eventApi(args)
+    timer = PhaseTimer()
+    for i in range(args.players):
+        timer.call('register', api.registerPlayer, "Player %d" % i)
+    # Skill-based outcomes follow the Elo model: a player rated 200 points
+    # above the opponent wins about 76% of the time.
+    skill = {}
+    for pid, name, wins, matches in sorted(api.playerStandings()):
+        skill[pid] = rng.gauss(1500, 200)
+    rounds = args.rounds or max(1, int(math.ceil(math.log(args.players, 2))))
+    for _ in range(rounds):
+        results = []
+        for a, b in timer.call('pair', api.swissPairingsId):
+            if b is None:
+                results.append((a, b))
+                continue
+            if args.outcomes == 'skill':
+                chance = 1.0 / (1.0 + 10.0 ** ((skill[b] - skill[a]) / 400.0))
+            else:
+                chance = 0.5
+            results.append((a, b) if rng.random() < chance else (b, a))
+        timer.call('report', api.reportMatches, results)
+        timer.call('standings', api.playerStandings)
+    cleanup()
+
+    phases = timer.summary()
+    print("%s API, %d players, %d rounds, %s outcomes" % (
+        args.api, args.players, rounds, args.outcomes))
+    printPhases(phases)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'benchmark': 'event', 'api': args.api,
+                       'players': args.players, 'rounds': rounds,
+                       'outcomes': args.outcomes, 'seed': args.seed,
+                       'python': platform.python_version(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'phases': phases}, f, indent=2, sort_keys=True)
+        print("results written to %s" % args.output)
+
+
+def printPhases(phases):
+    print("%-10s %7s %10s %10s %10s %10s" % ("phase", "calls", "total (s)",
+                                             "mean (ms)", "p95 (ms)",
+                                             "max (ms)"))
+    for phase in PHASES:
+        if phase in phases:
+            p = phases[phase]
+            print("%-10s %7d %10.3f %10.2f %10.2f %10.2f" % (
+                phase, p['calls'], p['total'], p['mean'] * 1000,
+                p['p95'] * 1000, p['max'] * 1000))
+
+
+# The phases of benchEvent(), in the order they are reported.
+PHASES = ('register', 'pair', 'report', 'standings')
+
+
+def benchCompare(args):
+    """Compares two event results files and flags slower phases."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    for key in ('api', 'players', 'rounds', 'outcomes'):
+        if baseline.get(key) != candidate.get(key):
+            print("warning: runs differ in %s (%s vs %s)" % (
+                key, baseline.get(key), candidate.get(key)))
+    print("%-10s %12s %12s %9s" % ("phase", "base (ms)", "new (ms)",
+                                   "change"))
+    regressions = []
+    for phase in PHASES:
+        if phase not in baseline['phases'] or \
+                phase not in candidate['phases']:
+            continue
+        old = baseline['phases'][phase][args.stat]
+        new = candidate['phases'][phase][args.stat]
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ""
+        if change > args.threshold:
+            flag = "  REGRESSION"
+            regressions.append(phase)
+        print("%-10s %12.2f %12.2f %+8.1f%%%s" % (phase, old * 1000,
+                                                  new * 1000, change, flag))
+    if regressions:
+        sys.exit("%s slower by more than %g%%" % (", ".join(regressions),
+                                                  args.threshold))
+
+
+def benchAsync(args):
+    """Compares reportMatch() throughput of threads and asyncio tasks."""
+    # Imported here: aiotournament needs Python 3.5+ and aiopg; this module
+    # itself stays free of async syntax so it runs on Python 2 too.
+    import asyncio
+    import aiotournament
+
+    event = tournament.createTournament("Async bench")
+    for i in range(args.players):
+        tournament.registerPlayer("Player %d" % i, event)
+    ids = [row[0] for row in tournament.playerStandings(event)]
+    rng = random.Random(args.seed)
+    games = [rng.sample(ids, 2) for _ in range(args.ops)]
+
+    print("%-8s %12s %12s" % ("api", "concurrency", "reports/sec"))
+    tournament.configurePool(maxconn=args.concurrency)
+    pending = iter(games)
+    lock = threading.Lock()
+
+    def report():
+        with lock:
+            winner, loser = next(pending)
+        tournament.reportMatch(winner, loser, event)
+
+    rate = timed(report, args.ops, args.concurrency)
+    print("%-8s %12d %12.1f" % ("threads", args.concurrency, rate))
+    tournament.configurePool()
+
+    # Every report is its own task; the pool size bounds how many run at
+    # the same time.
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(
+        aiotournament.configurePool(maxconn=args.concurrency))
+    start = time.time()
+    loop.run_until_complete(asyncio.gather(
+        *[aiotournament.reportMatch(winner, loser, event)
+          for winner, loser in games]))
+    rate = args.ops / (time.time() - start)
+    loop.run_until_complete(aiotournament.closePool())
+    print("%-8s %12d %12.1f" % ("asyncio", args.concurrency, rate))
+    differences = tournament.checkPlayerStats(tournament=event)
+    print("player_stats differences after the run: %d" % len(differences))
+    tournament.deleteTournament(event)
+
+
+def benchRatings(args):
+    """Times tiebreak and Elo computation over a large match history."""
+    # Imported here so the other benchmarks run without NumPy.
+    import numpy as np
+    import ratings
+
+    rng = np.random.RandomState(args.seed)
+    ids = np.arange(1, args.players + 1)
+    winners = rng.randint(1, args.players + 1, args.matches)
+    losers = (winners + rng.randint(1, args.players, args.matches) - 1) \
+        % args.players + 1
+    names = ["Player %d" % i for i in ids]
+    print("%d players, %d matches" % (args.players, args.matches))
+    # Building the history is part of every computation over new matches.
+    start = time.time()
+    history = ratings.MatchHistory(ids, names, winners, losers)
+    built = time.time()
+    ratings.computeRatings(history)
+    computed = time.time()
+    ratings.ratedStandings(history)
+    ranked = time.time()
+    print("%-24s %8.3f s" % ("history + computeRatings", computed - start))
+    print("%-24s %8.3f s" % ("  history", built - start))
+    print("%-24s %8.3f s" % ("  computeRatings", computed - built))
+    print("%-24s %8.3f s" % ("ratedStandings", ranked - computed))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for tournament.py")
+    commands = parser.add_subparsers(dest='benchmark')
+
+    pool = commands.add_parser('pool', help=benchPool.__doc__)
+    pool.add_argument('--ops', type=int, default=1000)
+    pool.add_argument('--threads', type=int, default=1)
+    pool.set_defaults(run=benchPool)
+
+    standings = commands.add_parser('standings', help=benchStandings.__doc__)
+    standings.add_argument('--players', type=int, default=10000)
+    standings.add_argument('--matches', type=int, default=100000)
+    standings.add_argument('--repeat', type=int, default=5)
+    standings.add_argument('--legacy', action='store_true',
+                           help="also time the old per-player queries")
+    standings.set_defaults(run=benchStandings)
+
+    export = commands.add_parser('export', help=benchExport.__doc__)
+    export.add_argument('--players', type=int, default=1000000)
+    export.add_argument('--matches', type=int, default=1000000)
+    export.add_argument('--no-seed', action='store_true',
+                        help="export the players already in the database")
+    export.set_defaults(run=benchExport)
+
+    simulate = commands.add_parser('simulate', help=benchSimulate.__doc__)
+    simulate.add_argument('--players', type=int, default=100000)
+    simulate.add_argument('--backend', default='memory',
+                          choices=sorted(storage.BACKENDS))
+    simulate.add_argument('--seed', type=int, default=1)
+    simulate.set_defaults(run=benchSimulate)
+
+    pairings = commands.add_parser('pairing', help=benchPairing.__doc__)
+    pairings.add_argument('--sizes', type=int, nargs='+',
+                          default=[1000, 10000, 100000])
+    pairings.add_argument('--seed', type=int, default=1)
+    pairings.set_defaults(run=benchPairing)
+
+    concurrent = commands.add_parser('concurrent',
+                                     help=benchConcurrent.__doc__)
+    concurrent.add_argument('--tournaments', type=int, default=8)
+    concurrent.add_argument('--players', type=int, default=64)
+    concurrent.add_argument('--seed', type=int, default=1)
+    concurrent.set_defaults(run=benchConcurrent)
+
+    event = commands.add_parser('event', help=benchEvent.__doc__)
+    event.add_argument('--players', type=int, default=1000)
+    event.add_argument('--rounds', type=int, default=0,
+                       help="rounds to play, log2(players) by default")
+    event.add_argument('--api', default='sql',
+                       choices=['sql'] + sorted(storage.BACKENDS),
+                       help="sql for tournament.py, or the storage backend "
+                            "of an in-memory engine")
+    event.add_argument('--outcomes', default='random',
+                       choices=['random', 'skill'])
+    event.add_argument('--seed', type=int, default=1)
+    event.add_argument('--output', help="JSON file to record the results in")
+    event.set_defaults(run=benchEvent)
+
+    compare = commands.add_parser('compare', help=benchCompare.__doc__)
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--stat', default='mean',
+                         choices=['mean', 'p50', 'p95', 'max', 'total'])
+    compare.add_argument('--threshold', type=float, default=10.0,
+                         help="percent slowdown reported as a regression")
+    compare.set_defaults(run=benchCompare)
+
+    aio = commands.add_parser('async', help=benchAsync.__doc__)
+    aio.add_argument('--ops', type=int, default=5000)
+    aio.add_argument('--players', type=int, default=1000)
+    aio.add_argument('--concurrency', type=int, default=10)
+    aio.add_argument('--seed', type=int, default=1)
+    aio.set_defaults(run=benchAsync)
+
+    rated = commands.add_parser('ratings', help=benchRatings.__doc__)
+    rated.add_argument('--players', type=int, default=100000)
+    rated.add_argument('--matches', type=int, default=1000000)
+    rated.add_argument('--seed', type=int, default=1)
+    rated.set_defaults(run=benchRatings)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
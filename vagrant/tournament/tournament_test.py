@@ -1,6 +1,13 @@
 #!/usr/bin/env python
 #
 # Test cases for tournament.py
+#
+# Usage: python tournament_test.py [postgres|sqlite|memory]
+#
+# With "sqlite" or "memory" the same tests run against the in-memory
+# TournamentEngine (engine.py) on that storage backend instead.
+
+import sys
 
 from tournament import *
 
@@ -125,6 +132,251 @@ def testPairings():
             "After one match, players with one win should be paired.")
     print "8. After one match, players with one win are paired."
 
+def testPairingsAvoidRematches():
+    deleteMatches()
+    deletePlayers()
+    for name in ["North", "East", "South", "West"]:
+        registerPlayer(name)
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings()]
+    reportMatches([(id1, id2), (id3, id4)])
+    reportMatches([(id1, id3), (id2, id4)])
+    # Adjacent players in the standings (id1 and id3) already met.
+    pairs = set(frozenset(pair) for pair in swissPairingsId())
+    if pairs != set([frozenset([id1, id4]), frozenset([id2, id3])]):
+        raise ValueError("swissPairings should avoid rematches.")
+    print "10. Pairings avoid rematches."
+
+
+def testPairingsWithBye():
+    deleteMatches()
+    deletePlayers()
+    for name in ["Larry", "Curly", "Moe"]:
+        registerPlayer(name)
+    pairs = swissPairingsId()
+    if len(pairs) != 2 or pairs[-1][1] is not None:
+        raise ValueError("With three players one of them gets a bye.")
+    firstBye = pairs[-1][0]
+    reportMatches(pairs)
+    pairs = swissPairingsId()
+    if pairs[-1][1] is not None or pairs[-1][0] == firstBye:
+        raise ValueError("A player should not get a second bye.")
+    for (i, n, w, m) in playerStandings():
+        if i == firstBye and (w, m) != (1, 1):
+            raise ValueError("A bye counts as a win.")
+    print "11. With an odd number of players, byes rotate."
+
+
+def testDeletePlayersWithMatches():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Ann")
+    registerPlayer("Ben")
+    [id1, id2] = [row[0] for row in playerStandings()]
+    reportMatch(id1, id2)
+    deletePlayers()
+    registerPlayer("Cat")
+    registerPlayer("Dan")
+    if [row[3] for row in playerStandings()] != [0, 0]:
+        raise ValueError("Deleting players should delete their matches.")
+    print "18. Deleting players deletes their matches."
+
+
+def testPoolReusesConnections():
+    configurePool(minconn=1, maxconn=2)
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Pooled Player")
+    for _ in range(20):
+        countPlayers()
+    stats = getPool().stats()
+    if stats['size'] != 1:
+        raise ValueError(
+            "Sequential calls should reuse a single pooled connection.")
+    print "12. Sequential calls reuse one pooled connection."
+
+
+def testReportRound():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Ada Lovelace")
+    registerPlayer("Grace Hopper")
+    registerPlayer("Alan Turing")
+    registerPlayer("Edsger Dijkstra")
+    standings = playerStandings()
+    [id1, id2, id3, id4] = [row[0] for row in standings]
+    try:
+        reportMatches([(id1, id2), (id2, id3)])
+    except ValueError:
+        pass
+    else:
+        raise ValueError(
+            "reportMatches should reject a player appearing twice.")
+    reportMatches([(id1, id2), (id3, id4)])
+    for (i, n, w, m) in playerStandings():
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if w != (1 if i in (id1, id3) else 0):
+            raise ValueError("Round winners should have one win recorded.")
+    print "9. A whole round can be reported at once."
+
+
+def testPlayerStatsConsistency():
+    deleteMatches()
+    deletePlayers()
+    for name in ["Alice", "Bob", "Carol", "Dave", "Erin", "Frank"]:
+        registerPlayer(name)
+    ids = [row[0] for row in playerStandings()]
+    reportMatch(ids[0], ids[1])
+    reportMatches([(ids[2], ids[3]), (ids[4], ids[5])])
+    reportMatches([(ids[0], ids[2]), (ids[5], ids[1]), (ids[3], ids[4])])
+    if checkPlayerStats() != []:
+        raise ValueError("player_stats should match the match history.")
+    db, cursor = connect()
+    cursor.execute("UPDATE player_stats SET wins = wins + 5 WHERE id = %s;",
+                   (ids[1],))
+    db.commit()
+    db.close()
+    if [row[0] for row in checkPlayerStats(repair=True)] != [ids[1]]:
+        raise ValueError("checkPlayerStats should report the corrupted row.")
+    if checkPlayerStats() != []:
+        raise ValueError("checkPlayerStats(repair=True) should fix the table.")
+    print "13. Player statistics stay consistent with the match history."
+
+
+def testRatings():
+    import ratings
+    deleteMatches()
+    deletePlayers()
+    for name in ["Magnus", "Hikaru", "Fabiano", "Ding"]:
+        registerPlayer(name)
+    [id1, id2, id3, id4] = [row[0] for row in playerStandings()]
+    reportMatches([(id1, id2), (id3, id4)])
+    reportMatches([(id1, id3), (id4, id2)])
+    rated = ratings.ratedStandings()
+    if sorted(rated) != sorted(playerStandings()):
+        raise ValueError("ratedStandings should report the same records.")
+    if rated[0][0] != id1 or rated[-1][0] != id2:
+        raise ValueError("ratedStandings should rank by wins first.")
+    elo = [row[0] for row in ratings.ratedStandings(by='elo')]
+    if elo[0] != id1 or elo[-1] != id2:
+        raise ValueError("The unbeaten player should have the best rating.")
+    print "14. Ratings are computed from the match history."
+
+
+def testTournamentsAreIsolated():
+    deleteMatches()
+    deletePlayers()
+    registerPlayer("Default Player")
+    chess = createTournament("Chess Open")
+    go = createTournament("Go Open")
+    try:
+        for name in ["Kasparov", "Karpov", "Tal", "Fischer"]:
+            registerPlayer(name, chess)
+        registerPlayer("Honinbo Shusaku", go)
+        registerPlayer("Go Seigen", go)
+        if (countPlayers(), countPlayers(chess), countPlayers(go)) != (1, 4, 2):
+            raise ValueError("Each tournament should count its own players.")
+        reportMatches(swissPairingsId(chess), chess)
+        [(id1, id2)] = swissPairingsId(go)
+        reportMatch(id1, id2, go)
+        if [row[3] for row in playerStandings()] != [0]:
+            raise ValueError("Other tournaments' matches should not count.")
+        if [row[2] for row in playerStandings(go)] != [1, 0]:
+            raise ValueError("Standings should only list the tournament's "
+                             "own players and matches.")
+        if checkPlayerStats(tournament=chess) != []:
+            raise ValueError("player_stats should be kept per tournament.")
+        deleteMatches(go)
+        if [row[3] for row in playerStandings(chess)] != [1, 1, 1, 1]:
+            raise ValueError("Deleting matches should not touch other "
+                             "tournaments.")
+        try:
+            reportMatch(id1, playerStandings(chess)[0][0], go)
+        except psycopg2.IntegrityError:
+            pass
+        else:
+            raise ValueError("Players of another tournament should be "
+                             "rejected.")
+    finally:
+        deleteTournament(chess)
+        deleteTournament(go)
+    if countPlayers() != 1:
+        raise ValueError("Deleting a tournament should keep the others.")
+    print "15. Tournaments are isolated from each other."
+
+
+def testStandingsReport():
+    import json
+    import report
+    from StringIO import StringIO
+    deleteMatches()
+    deletePlayers()
+    for name in ["Ann", "Ben", "Cat"]:
+        registerPlayer(name)
+    [id1, id2, id3] = [row[0] for row in playerStandings()]
+    reportMatches([(id2, id1), (id3, None)])
+    if list(iterStandings(itersize=1)) != playerStandings():
+        raise ValueError("iterStandings should match playerStandings.")
+    if list(iterMatches(itersize=1)) != [(id2, id1), (id3, None)]:
+        raise ValueError("iterMatches should list matches as reported.")
+    out = StringIO()
+    report.StandingsReport(out, 'jsonl').write(iterStandings(), 1)
+    rows = [json.loads(line) for line in out.getvalue().splitlines()]
+    if [(row['rank'], row['id'], row['round']) for row in rows] != \
+            [(1, id2, 1), (2, id3, 1), (3, id1, 1)]:
+        raise ValueError("The JSON lines report should list every player.")
+    out = StringIO()
+    report.StandingsReport(out, 'csv').write(playerStandings(), 1)
+    if out.getvalue().splitlines()[1] != "1,1,%d,Ben,1,1" % id2:
+        raise ValueError("The CSV report should have one row per player.")
+    print "16. Standings reports stream in text, CSV or JSON lines."
+
+
+def testQueryStats():
+    import logging
+    import instrument
+
+    class Collect(logging.Handler):
+        def emit(self, record):
+            slow.append(record.getMessage())
+
+    slow = []
+    handler = Collect()
+    instrument.logger.addHandler(handler)
+    instrument.configure(enabled=True, slowQuery=0)
+    instrument.reset()
+    try:
+        deleteMatches()
+        deletePlayers()
+        registerPlayer("Timed Player")
+        registerPlayer("Other Player")
+        reportMatches(swissPairingsId())
+        playerStandings()
+        # Left after the first row, as tournament.py does to find the winner.
+        next(iterStandings(itersize=1))
+        stats = instrument.stats()
+    finally:
+        instrument.configure(enabled=False)
+        instrument.logger.removeHandler(handler)
+    standings = " ".join(queries.STANDINGS.split())
+    if stats[standings]['callers'] != {'tournament.playerStandings': 1,
+                                       'tournament.pairStandings': 1,
+                                       '__main__.testQueryStats': 1}:
+        raise ValueError("Statistics should record where queries come from.")
+    # Two rows each for playerStandings() and the pairings, whose named
+    # cursor counts them as they are fetched, and one for the winner.
+    if stats[standings]['rows'] != 5:
+        raise ValueError("Statistics should count the rows of each query.")
+    if sum(count for bound, count in stats[standings]['histogram']) != 3:
+        raise ValueError("Every execution should land in the histogram.")
+    if not any("Timed Player" in message for message in slow):
+        raise ValueError("Slow queries should be logged with parameters.")
+    playerStandings()
+    if instrument.stats()[standings]['calls'] != 3:
+        raise ValueError("Disabled instrumentation should record nothing.")
+    print "17. Queries are timed, counted and logged when slow."
+
+
 def myOwnTournament():
     """
     players for testing purposes
@@ -150,8 +402,20 @@ def myOwnTournament():
 
 
 
+def useEngine(backend):
+    """Points the tournament functions used by the tests at an engine."""
+    import engine
+    import storage
+    tournamentEngine = engine.TournamentEngine(storage.create(backend))
+    for name in engine.API:
+        globals()[name] = getattr(tournamentEngine, name)
+
+
 if __name__ == '__main__':
-  
+    backend = sys.argv[1] if len(sys.argv) > 1 else 'postgres'
+    if backend != 'postgres':
+        useEngine(backend)
+
     testDeleteMatches()
     testDelete()
     testCount()
@@ -160,12 +424,18 @@ if __name__ == '__main__':
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testReportRound()
+    testPairingsAvoidRematches()
+    testPairingsWithBye()
+    testDeletePlayersWithMatches()
+    if backend == 'postgres':
+        testPoolReusesConnections()
+        testPlayerStatsConsistency()
+        testRatings()
+        testTournamentsAreIsolated()
+        testStandingsReport()
+        testQueryStats()
     print "Success!  All tests pass!"
-    print "Now let's play the actual tournament"
-    myOwnTournament()
-
-    
-
-    
-
-
+    if backend == 'postgres':
+        print "Now let's play the actual tournament"
+        myOwnTournament()